@@ -1,6 +1,8 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
-from .models import User
+from backend.exports import ExportFormatError, export_response
+from .exports import history_table
+from .models import RecommendationHistory, User
 from django.utils.translation import gettext_lazy as _
 
 @admin.register(User)
@@ -15,4 +17,34 @@ class UserAdmin(DjangoUserAdmin):
     )
     list_display = ('username', 'nickname', 'email', 'is_staff', 'is_active')
     search_fields = ('username', 'nickname', 'email', 'phone')
-    ordering = ('-date_joined',)
\ No newline at end of file
+    ordering = ('-date_joined',)
+
+
+@admin.register(RecommendationHistory)
+class RecommendationHistoryAdmin(admin.ModelAdmin):
+    # 历史记录只读浏览 + 流式导出（CSV / gzip CSV / Parquet）
+    list_display = ('id', 'user', 'summary', 'created_at')
+    list_select_related = ('user',)
+    search_fields = ('user__username', 'summary')
+    date_hierarchy = 'created_at'
+    raw_id_fields = ('user',)
+    readonly_fields = ('created_at',)
+    actions = ['export_selected_as_csv', 'export_selected_as_csv_gz', 'export_selected_as_parquet']
+
+    def _export(self, request, queryset, fmt, compress=False):
+        try:
+            return export_response(history_table(queryset), 'history_export', fmt, compress, request=request)
+        except ExportFormatError as exc:
+            self.message_user(request, str(exc), level=messages.ERROR)
+
+    def export_selected_as_csv(self, request, queryset):
+        return self._export(request, queryset, 'csv')
+    export_selected_as_csv.short_description = "导出所选历史为 CSV"
+
+    def export_selected_as_csv_gz(self, request, queryset):
+        return self._export(request, queryset, 'csv', compress=True)
+    export_selected_as_csv_gz.short_description = "导出所选历史为 CSV（gzip 压缩）"
+
+    def export_selected_as_parquet(self, request, queryset):
+        return self._export(request, queryset, 'parquet')
+    export_selected_as_parquet.short_description = "导出所选历史为 Parquet"
@@ -0,0 +1,231 @@
+"""
+Avatar processing pipeline.
+
+``UserInfoView.patch`` used to decode, convert and thumbnail uploads inside
+the request and its transaction (and silently stored the full-size original
+whenever that failed, e.g. on Pillow >= 10 where ``Image.ANTIALIAS`` is gone).
+Now the request only runs the cheap checks:
+
+  - ``validate_upload``: byte size (``AVATAR_MAX_UPLOAD_BYTES``), format and
+    pixel count (``AVATAR_MAX_PIXELS``) read from the image header, plus
+    ``Image.verify()``; a bad upload is a 400, never stored
+  - the upload's SHA-256 names the output files
+    (``avatars/<digest>_<size>.jpg`` / ``.webp``, one pair per
+    ``AVATAR_SIZES``): re-uploading an image that was already processed
+    just points the user at the existing files
+
+and ``schedule`` hands the bytes to a small per-process thread pool once the
+transaction commits (``AVATAR_ASYNC=False``, or a pool that cannot take the
+job, processes inline instead). ``render_variants`` decodes JPEGs with
+``Image.draft`` (the decoder downscales by up to 1/8 while reading, so a phone
+photo is never fully decoded), applies the EXIF orientation and writes every
+size as JPEG and WebP. The user keeps the old avatar until the files exist;
+meanwhile ``status`` is 'processing' (the profile page polls userinfo until
+it changes), and 'failed' for a while if the image could not be decoded.
+
+Processed files are shared between users who uploaded the same image, so
+``release`` only deletes them when nobody else references them.
+"""
+import hashlib
+import io
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = 'avatars'
+ALLOWED_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF', 'BMP')
+OUTPUT_FORMATS = (('jpg', 'JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+                  ('webp', 'WEBP', {'quality': 80, 'method': 4}))
+# how long the 'processing' / 'failed' status is kept
+STATUS_TTL = 300
+FAILED = 'failed'
+
+_NAME_RE = re.compile(rf'^{UPLOAD_DIR}/(?P<digest>[0-9a-f]{{32}})_(?P<size>\d+)\.(?:jpg|webp)$')
+
+
+class AvatarError(ValueError):
+    """The upload is not an acceptable avatar image."""
+
+
+def avatar_async():
+    return getattr(settings, 'AVATAR_ASYNC', True)
+
+
+def avatar_workers():
+    return getattr(settings, 'AVATAR_WORKERS', 2)
+
+
+def avatar_sizes():
+    return sorted(getattr(settings, 'AVATAR_SIZES', (300, 96)), reverse=True)
+
+
+def max_upload_bytes():
+    return getattr(settings, 'AVATAR_MAX_UPLOAD_BYTES', 10 * 1024 * 1024)
+
+
+def max_pixels():
+    return getattr(settings, 'AVATAR_MAX_PIXELS', 40_000_000)
+
+
+def variant_name(digest, size, ext):
+    return f'{UPLOAD_DIR}/{digest}_{size}.{ext}'
+
+
+def main_name(digest):
+    """Name stored in ``User.avatar``: the largest JPEG."""
+    return variant_name(digest, avatar_sizes()[0], 'jpg')
+
+
+def variants(name):
+    """{ext: {size: name}} of a pipeline avatar name; None for other (legacy) avatars."""
+    match = _NAME_RE.match(name or '')
+    if match is None:
+        return None
+    digest = match['digest']
+    return {ext: {size: variant_name(digest, size, ext) for size in avatar_sizes()} for ext, _, _ in OUTPUT_FORMATS}
+
+
+def validate_upload(upload):
+    """Bytes and content digest of ``upload``; raises AvatarError."""
+    if upload.size is not None and upload.size > max_upload_bytes():
+        raise AvatarError(f'头像文件不能超过 {max_upload_bytes() // (1024 * 1024)}MB')
+    upload.seek(0)
+    data = upload.read()
+    if len(data) > max_upload_bytes():
+        raise AvatarError(f'头像文件不能超过 {max_upload_bytes() // (1024 * 1024)}MB')
+    try:
+        # Image.open only parses the header; verify() checks the file structure without decoding pixels
+        with Image.open(io.BytesIO(data)) as img:
+            fmt, (width, height) = img.format, img.size
+            if fmt not in ALLOWED_FORMATS:
+                raise AvatarError('不支持的图片格式')
+            if width * height > max_pixels():
+                raise AvatarError('图片像素过大')
+            img.verify()
+    except AvatarError:
+        raise
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError, ValueError):
+        raise AvatarError('无法识别的图片文件')
+    return data, hashlib.sha256(data).hexdigest()[:32]
+
+
+def render_variants(data):
+    """{(size, ext): encoded bytes} for every configured size and output format."""
+    sizes = avatar_sizes()
+    with Image.open(io.BytesIO(data)) as img:
+        if img.format == 'JPEG':
+            # let the JPEG decoder downscale (1/2 .. 1/8) to no less than the largest output
+            img.draft('RGB', (sizes[0], sizes[0]))
+        img = ImageOps.exif_transpose(img)
+        img = img.convert('RGB')
+    out = {}
+    for size in sizes:
+        # thumbnail keeps the aspect ratio and never upscales
+        img.thumbnail((size, size), Image.Resampling.LANCZOS)
+        for ext, fmt, options in OUTPUT_FORMATS:
+            buffer = io.BytesIO()
+            img.save(buffer, format=fmt, **options)
+            out[size, ext] = buffer.getvalue()
+    return out
+
+
+def is_processed(digest):
+    return default_storage.exists(main_name(digest))
+
+
+def _status_key(user_id):
+    # value: digest of the upload being processed, or FAILED
+    return f'avatar:status:{user_id}'
+
+
+def status(user_id):
+    """'processing', 'failed' or None (no recent upload)."""
+    value = cache.get(_status_key(user_id))
+    if value is None:
+        return None
+    return FAILED if value == FAILED else 'processing'
+
+
+def process(user_id, data, digest):
+    """Write the variants of ``data`` and point the user at them (unless a newer upload superseded it)."""
+    from .models import User
+
+    try:
+        if not is_processed(digest):
+            for (size, ext), content in render_variants(data).items():
+                name = variant_name(digest, size, ext)
+                if not default_storage.exists(name):
+                    default_storage.save(name, ContentFile(content))
+        # the status holds the digest of the user's latest upload
+        latest = cache.get(_status_key(user_id))
+        if latest is None or latest == digest:
+            User.objects.filter(pk=user_id).update(avatar=main_name(digest))
+            cache.delete(_status_key(user_id))
+    except Exception:
+        logger.exception('avatar processing failed for user %s', user_id)
+        if cache.get(_status_key(user_id)) == digest:
+            cache.set(_status_key(user_id), FAILED, STATUS_TTL)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=avatar_workers(), thread_name_prefix='avatar')
+        return _pool
+
+
+def _process_in_pool(user_id, data, digest):
+    try:
+        process(user_id, data, digest)
+    finally:
+        # pool threads outlive requests: drop their connection like request_finished does
+        close_old_connections()
+
+
+def schedule(user_id, data, digest):
+    """Process ``data`` for the user once the current transaction commits."""
+    cache.set(_status_key(user_id), digest, STATUS_TTL)
+
+    def submit():
+        if avatar_async():
+            try:
+                _get_pool().submit(_process_in_pool, user_id, data, digest)
+                return
+            except RuntimeError:  # interpreter / pool shutting down
+                logger.warning('avatar pool unavailable; processing inline')
+        process(user_id, data, digest)
+
+    transaction.on_commit(submit)
+
+
+def release(user):
+    """Delete ``user``'s avatar files unless other users still use them (does not save)."""
+    from .models import User
+
+    name = getattr(user.avatar, 'name', None)
+    if not name or name == user._meta.get_field('avatar').default:
+        return
+    files = variants(name)
+    if files is None:
+        user.avatar.delete(save=False)
+        return
+    if User.objects.filter(avatar=name).exclude(pk=user.pk).exists():
+        return
+    for by_size in files.values():
+        for variant in by_size.values():
+            default_storage.delete(variant)
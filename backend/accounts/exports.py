@@ -0,0 +1,36 @@
+"""
+Export table of ``RecommendationHistory`` (admin actions and ``manage.py export_history``).
+
+payload / result are written as JSON text; packed results (``result_packed``)
+are rehydrated from the current hospital snapshot, like the history API does.
+"""
+from backend.exports import CHUNK_SIZE, ExportTable
+from backend.renderers import dumps
+
+HISTORY_FIELDS = ('id', 'user_id', 'user__username', 'summary', 'payload', 'result', 'result_packed', 'created_at')
+HISTORY_COLUMNS = (
+    ('id', 'int'), ('user_id', 'int'), ('username', 'str'), ('summary', 'str'),
+    ('payload', 'str'), ('result', 'str'), ('created_at', 'datetime'),
+)
+
+
+def _json(value):
+    return None if value is None else dumps(value).decode('utf-8')
+
+
+def history_table(queryset, chunk_size=CHUNK_SIZE):
+    from hospital.snapshot import get_snapshot
+    from .result_codec import rehydrate
+
+    snapshot = None
+
+    def convert(row):
+        nonlocal snapshot
+        pk, user_id, username, summary, payload, result, packed, created_at = row
+        if packed:
+            if snapshot is None:
+                snapshot = get_snapshot()
+            result = rehydrate(packed, snapshot=snapshot)
+        return pk, user_id, username, summary, _json(payload), _json(result), created_at
+
+    return ExportTable(queryset, HISTORY_FIELDS, columns=HISTORY_COLUMNS, convert=convert, chunk_size=chunk_size)
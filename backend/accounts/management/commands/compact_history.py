@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.models import RecommendationHistory
+
+
+class Command(BaseCommand):
+    help = "Convert RecommendationHistory.result rows to the compact result_packed storage."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='only report how many rows / bytes would be converted')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        qs = (RecommendationHistory.objects
+              .filter(result_packed__isnull=True)
+              .only('id', 'result', 'result_packed')
+              .order_by('pk'))
+
+        converted = skipped = bytes_before = bytes_after = 0
+        last_pk = 0
+        while True:
+            # keyset batches: each batch is one short transaction, progress survives interruption
+            rows = list(qs.filter(pk__gt=last_pk)[:batch_size])
+            if not rows:
+                break
+            last_pk = rows[-1].pk
+            batch = []
+            for h in rows:
+                size = len(json.dumps(h.result, ensure_ascii=False).encode('utf-8'))
+                if not h.pack_result():
+                    skipped += 1
+                    continue
+                bytes_before += size
+                bytes_after += len(h.result_packed)
+                batch.append(h)
+            if batch and not dry_run:
+                with transaction.atomic():
+                    RecommendationHistory.objects.bulk_update(batch, ['result', 'result_packed'])
+            converted += len(batch)
+
+        verb = 'would convert' if dry_run else 'converted'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {converted} history rows ({bytes_before} -> {bytes_after} bytes), "
+            f"{skipped} left as JSON"))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.exports import history_table
+from accounts.models import RecommendationHistory
+from backend.exports import CHUNK_SIZE, FORMATS, ExportFormatError, detect_format, write_export
+
+
+class Command(BaseCommand):
+    help = "Export RecommendationHistory to CSV (optionally gzipped) or Parquet, streaming keyset batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='output file (.csv, .csv.gz or .parquet)')
+        parser.add_argument('--format', choices=FORMATS, help='output format (default: from the file extension)')
+        parser.add_argument('--gzip', action='store_true', help='gzip the CSV output')
+        parser.add_argument('--user', help='only the history of this username')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='rows per query')
+
+    def handle(self, *args, **options):
+        fmt, compress = detect_format(options['path'])
+        fmt = options['format'] or fmt
+        compress = fmt == 'csv' and (compress or options['gzip'])
+        qs = RecommendationHistory.objects.all()
+        if options['user']:
+            qs = qs.filter(user__username=options['user'])
+        table = history_table(qs, chunk_size=options['chunk_size'])
+
+        started = time.perf_counter()
+        try:
+            written = write_export(table, options['path'], fmt, compress)
+        except ExportFormatError as exc:
+            raise CommandError(str(exc))
+        except OSError as exc:
+            raise CommandError(f"cannot write {options['path']}: {exc}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"exported history to {options['path']} ({written} bytes, {time.perf_counter() - started:.1f}s)"))
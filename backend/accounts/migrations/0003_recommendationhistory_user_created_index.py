@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0002_recommendationhistory"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="recommendationhistory",
+            index=models.Index(
+                fields=["user", "created_at", "id"], name="history_user_created_idx"
+            ),
+        ),
+    ]
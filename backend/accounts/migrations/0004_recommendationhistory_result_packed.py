@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0003_recommendationhistory_user_created_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recommendationhistory",
+            name="result_packed",
+            field=models.BinaryField(blank=True, null=True, verbose_name="紧凑结果"),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def populate_preferred_region_code(apps, schema_editor):
+    from hospital.regions import resolve, resolve_query
+
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    rows = User.objects.values_list("pk", "preferred_region", "preferred_region_values")
+    for pk, region, values in rows.iterator(chunk_size=1000):
+        # same rule as User.refresh_preferred_region_code
+        codes = resolve_query(values or [])
+        if codes is None:
+            codes = resolve(region or "")
+        if codes.code:
+            User.objects.filter(pk=pk).update(preferred_region_code=codes.code)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0004_recommendationhistory_result_packed"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="preferred_region_code",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                max_length=6,
+                verbose_name="偏好地区代码",
+            ),
+        ),
+        migrations.RunPython(populate_preferred_region_code, migrations.RunPython.noop),
+    ]
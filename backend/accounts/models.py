@@ -31,6 +31,8 @@ class User(AbstractUser):
     address = models.CharField('联系地址', max_length=255, blank=True, null=True)
     preferred_region = models.CharField('偏好地区', max_length=255, blank=True, null=True)
     preferred_region_values = models.JSONField('偏好地区值', blank=True, null=True, default=list)
+    # 偏好地区最具体一级的行政区划代码（由 preferred_region_values / preferred_region 解析，保存时刷新）
+    preferred_region_code = models.CharField('偏好地区代码', max_length=6, blank=True, db_index=True, editable=False)
 
     # 第三方账号
     wechat = models.CharField('微信号', max_length=50, blank=True, null=True)
@@ -40,6 +42,21 @@ class User(AbstractUser):
     def __str__(self):
         return self.username
 
+    def refresh_preferred_region_code(self):
+        """由级联选择的代码（优先）或偏好地区文本解析 preferred_region_code（不保存）"""
+        from hospital.regions import resolve, resolve_query
+        codes = resolve_query(self.preferred_region_values or [])
+        if codes is None:
+            codes = resolve(self.preferred_region or '')
+        self.preferred_region_code = codes.code
+
+    def save(self, *args, **kwargs):
+        self.refresh_preferred_region_code()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'preferred_region_code'}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = '用户'
         verbose_name_plural = '用户'
@@ -53,19 +70,43 @@ class RecommendationHistory(models.Model):
     - summary: 简短文本摘要（方便前端展示与搜索）
     - payload: 请求参数（JSONField）
     - result: 推荐结果（JSONField，可为空）
+    - result_packed: 紧凑存储的推荐结果（见 accounts.result_codec），非空时 result 为空列表，
+      读取时通过 get_result() 从医院快照还原
     - created_at: 创建时间
     """
     user = models.ForeignKey(User, related_name='histories', on_delete=models.CASCADE)
     summary = models.CharField('摘要', max_length=255, blank=True, null=True)
     payload = models.JSONField('payload', blank=True, null=True, default=dict)
     result = models.JSONField('result', blank=True, null=True, default=list)
+    result_packed = models.BinaryField('紧凑结果', blank=True, null=True, editable=False)
     created_at = models.DateTimeField('创建时间', default=timezone.now, db_index=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # 历史列表按用户 + (created_at, id) 游标分页
+            models.Index(fields=['user', 'created_at', 'id'], name='history_user_created_idx'),
+        ]
         verbose_name = '推荐历史'
         verbose_name_plural = '推荐历史'
         db_table = 'accounts_recommendationhistory'
 
     def __str__(self):
-        return f'{self.user.username} @ {self.created_at.isoformat()}'
\ No newline at end of file
+        return f'{self.user.username} @ {self.created_at.isoformat()}'
+
+    def pack_result(self):
+        """尝试将 result 转为紧凑存储（不保存）；无法紧凑编码时保持原样并返回 False"""
+        from .result_codec import pack_result
+        packed = pack_result(self.result)
+        if packed is None:
+            return False
+        self.result_packed = packed
+        self.result = []
+        return True
+
+    def get_result(self, snapshot=None):
+        """推荐结果（紧凑存储时从医院快照还原）"""
+        if self.result_packed:
+            from .result_codec import rehydrate
+            return rehydrate(self.result_packed, snapshot=snapshot)
+        return self.result
\ No newline at end of file
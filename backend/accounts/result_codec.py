@@ -0,0 +1,185 @@
+"""
+Compact encoding of ``RecommendationHistory.result``.
+
+A stored result is a list of serialized hospitals (``HospitalSerializer``
+output plus ``recommendation_score`` / ``score_breakdown``). Almost all of it
+is a copy of the hospital row, repeated in every history entry that
+recommended that hospital. The packed form keeps only what is specific to the
+entry:
+
+  - hospital id and name (the name keeps entries of deleted hospitals readable)
+  - recommendation_score, distance_km and the score_breakdown values
+    (one column per breakdown key, NaN where an item lacks the key)
+  - the original key order of the items
+
+as a zlib-compressed blob: a JSON header followed by little-endian float64 /
+int64 columns. On read the hospital fields are rehydrated from the current
+``HospitalSnapshot``, so they show today's hospital data rather than the data
+at recommendation time.
+
+Results that do not have this shape (custom keys, non-numeric breakdowns)
+are left as JSON; ``pack_result`` returns None for them.
+"""
+import json
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b'RH1'
+_HEADER_LEN = struct.Struct('<I')
+
+# per-entry values kept in the blob; every other key must be a hospital field
+ENTRY_FIELDS = ('id', 'name', 'recommendation_score', 'distance_km', 'score_breakdown')
+
+
+def _hospital_fields():
+    from hospital.serializers import HospitalSerializer
+    return HospitalSerializer.Meta.fields
+
+
+def _number(value):
+    if value is None:
+        return np.nan
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise TypeError
+    return float(value)
+
+
+def _merge_keys(merged, keys):
+    """
+    Merge ``keys`` into ``merged`` keeping the relative order of both
+    (breakdowns list subsets of one fixed key order). False on conflicting orders.
+    """
+    prev = -1
+    for key in keys:
+        if key in merged:
+            pos = merged.index(key)
+            if pos <= prev:
+                return False
+        else:
+            pos = prev + 1
+            merged.insert(pos, key)
+        prev = pos
+    return True
+
+
+def pack_result(result):
+    """Packed bytes for ``result``, or None when it cannot be stored compactly."""
+    if not isinstance(result, list) or not result:
+        return None
+    first = result[0]
+    if not isinstance(first, dict):
+        return None
+    keys = list(first)
+    allowed = set(_hospital_fields()) | set(ENTRY_FIELDS)
+    if 'id' not in keys or not set(keys) <= allowed:
+        return None
+    if 'score_breakdown' in keys:
+        breakdown_keys = []
+        for item in result:
+            b = item.get('score_breakdown') if isinstance(item, dict) else None
+            if not isinstance(b, dict) or not _merge_keys(breakdown_keys, list(b)):
+                return None
+    else:
+        breakdown_keys = None
+
+    n = len(result)
+    ids = np.empty(n, dtype='<i8')
+    scores = np.empty(n, dtype='<f8')
+    distances = np.empty(n, dtype='<f8')
+    # NaN marks a breakdown key the item does not have
+    values = np.full((n, len(breakdown_keys or ())), np.nan, dtype='<f8')
+    names = []
+    try:
+        for i, item in enumerate(result):
+            if not isinstance(item, dict) or list(item) != keys or isinstance(item['id'], bool):
+                return None
+            ids[i] = item['id']
+            names.append(item.get('name'))
+            scores[i] = _number(item.get('recommendation_score'))
+            distances[i] = _number(item.get('distance_km'))
+            if breakdown_keys is not None:
+                for k, v in item['score_breakdown'].items():
+                    if v is None:
+                        return None
+                    values[i, breakdown_keys.index(k)] = _number(v)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+    header = json.dumps({
+        'n': n,
+        'keys': keys,
+        'breakdown': breakdown_keys,
+        'names': names,
+    }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    body = b''.join((_HEADER_LEN.pack(len(header)), header,
+                     ids.tobytes(), scores.tobytes(), distances.tobytes(), values.tobytes()))
+    return MAGIC + zlib.compress(body, 6)
+
+
+def unpack_result(blob):
+    """(header, ids, scores, distances, breakdown_values) of a packed result."""
+    blob = bytes(blob)
+    if not blob.startswith(MAGIC):
+        raise ValueError('not a packed history result')
+    body = zlib.decompress(blob[len(MAGIC):])
+    (header_len,) = _HEADER_LEN.unpack_from(body)
+    offset = _HEADER_LEN.size + header_len
+    header = json.loads(body[_HEADER_LEN.size:offset])
+    n = header['n']
+    k = len(header['breakdown'] or ())
+    ids = np.frombuffer(body, dtype='<i8', count=n, offset=offset)
+    scores = np.frombuffer(body, dtype='<f8', count=n, offset=offset + 8 * n)
+    distances = np.frombuffer(body, dtype='<f8', count=n, offset=offset + 16 * n)
+    values = np.frombuffer(body, dtype='<f8', count=n * k, offset=offset + 24 * n).reshape(n, k)
+    return header, ids, scores, distances, values
+
+
+def _optional(value):
+    value = float(value)
+    return None if value != value else value
+
+
+def summarize(blob, top):
+    """``{'count', 'top'}`` of a packed result without touching the hospital table."""
+    header, ids, scores, _, _ = unpack_result(blob)
+    return {
+        'count': header['n'],
+        'top': [
+            {'id': int(ids[i]), 'name': header['names'][i], 'recommendation_score': _optional(scores[i])}
+            for i in range(min(top, header['n']))
+        ],
+    }
+
+
+def rehydrate(blob, snapshot=None):
+    """The ``result`` list of a packed blob, hospital fields read from the snapshot."""
+    from hospital.row_serializer import HospitalRowSerializer
+    from hospital.snapshot import get_snapshot
+
+    header, ids, scores, distances, values = unpack_result(blob)
+    snapshot = snapshot if snapshot is not None else get_snapshot()
+    keys, breakdown_keys = header['keys'], header['breakdown']
+    hospital_keys = [k for k in keys if k not in ENTRY_FIELDS]
+
+    rows = [snapshot.index_of(int(pk)) for pk in ids.tolist()]
+    present = [row for row in rows if row is not None]
+    hospital_data = iter(HospitalRowSerializer(fields=hospital_keys).from_snapshot(snapshot, present)
+                         if hospital_keys else [{}] * len(present))
+
+    result = []
+    for i in range(header['n']):
+        pk = int(ids[i])
+        data = next(hospital_data) if rows[i] is not None else {}
+        entry = {
+            'id': pk,
+            'name': header['names'][i],
+            'recommendation_score': _optional(scores[i]),
+            'distance_km': _optional(distances[i]),
+        }
+        if breakdown_keys is not None:
+            entry['score_breakdown'] = {k: float(v) for k, v in zip(breakdown_keys, values[i]) if v == v}
+        # deleted hospitals keep their stored values, hospital fields become null
+        result.append({k: entry[k] if k in entry else data.get(k) for k in keys})
+    return result
@@ -1,8 +1,11 @@
 from rest_framework import serializers
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
 from datetime import date
 
+from . import avatars
+
 User = get_user_model()
 
 
@@ -10,12 +13,16 @@ class UserSerializer(serializers.ModelSerializer):
     """
     只读序列化器：返回用户信息给前端。
     - avatar: 返回绝对 URL（如果没有则返回默认头像路径）
+    - avatar_variants: 头像各尺寸的 JPEG/WebP 绝对 URL（{"webp": {"300": url, ...}, "jpg": {...}}），旧头像为 None
+    - avatar_status: 新上传头像的后台处理状态：'processing' / 'failed'，无进行中的上传为 None
     - real_name: 组合 first_name + last_name（模型没有 real_name 字段时使用此方法避免 500）
     - birthday 允许不传(required=False)，允许传 null (allow_null=True)，并接受常见输入格式。
     - age: 基于 birthday 计算年龄（若无生日返回 None）
     - nickname / preferred_region 等使用 SerializerMethodField 安全读取（若模型没有对应字段返回 None）
     """
     avatar = serializers.SerializerMethodField()
+    avatar_variants = serializers.SerializerMethodField()
+    avatar_status = serializers.SerializerMethodField()
     age = serializers.SerializerMethodField()
     real_name = serializers.SerializerMethodField()
 
@@ -41,7 +48,7 @@ class UserSerializer(serializers.ModelSerializer):
         fields = (
             'id', 'username', 'nickname', 'email', 'gender', 'phone',
             'real_name', 'address', 'birthday',
-            'preferred_region', 'avatar',
+            'preferred_region', 'avatar', 'avatar_variants', 'avatar_status',
             'date_joined', 'is_staff', 'is_superuser', 'age'
         )
         read_only_fields = ('id', 'username', 'date_joined', 'is_staff', 'is_superuser')
@@ -69,6 +76,23 @@ class UserSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(avatar_url)
         return avatar_url
 
+    def get_avatar_variants(self, obj):
+        files = avatars.variants(getattr(getattr(obj, 'avatar', None), 'name', None))
+        if files is None:
+            return None
+        request = self.context.get('request')
+        out = {}
+        for ext, by_size in files.items():
+            urls = {}
+            for size, name in by_size.items():
+                url = default_storage.url(name)
+                urls[str(size)] = request.build_absolute_uri(url) if request is not None else url
+            out[ext] = urls
+        return out
+
+    def get_avatar_status(self, obj):
+        return avatars.status(obj.pk)
+
     def get_age(self, obj):
         if getattr(obj, 'birthday', None):
             today = date.today()
@@ -160,7 +184,7 @@ class UserUpdateSerializer(serializers.ModelSerializer):
             if avatar_val is None:
                 try:
                     if getattr(instance, 'avatar', None):
-                        instance.avatar.delete(save=False)
+                        avatars.release(instance)
                 except Exception:
                     pass
                 instance.avatar = None
@@ -176,6 +200,7 @@ class UserUpdateSerializer(serializers.ModelSerializer):
 
 # 新增历史序列化器
 from .models import RecommendationHistory
+from .result_codec import summarize
 
 class HistorySerializer(serializers.ModelSerializer):
     """
@@ -188,4 +213,58 @@ class HistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = RecommendationHistory
         fields = ('id', 'summary', 'payload', 'result', 'created_at')
-        read_only_fields = ('id', 'created_at')
\ No newline at end of file
+        read_only_fields = ('id', 'created_at')
+
+    def create(self, validated_data):
+        instance = RecommendationHistory(**validated_data)
+        if getattr(settings, 'HISTORY_COMPACT_RESULTS', False):
+            instance.pack_result()
+        instance.save()
+        return instance
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if 'result' in data and instance.result_packed:
+            data['result'] = instance.get_result()
+        return data
+
+
+class HistoryListSerializer(serializers.ModelSerializer):
+    """
+    历史列表的精简序列化器（?result=omit / ?result=summary），不返回完整 result。
+    result_summary 读取视图注解的 result_count / result_top_*，不在 Python 中解析 result。
+    """
+    result_summary = serializers.SerializerMethodField()
+
+    class Meta:
+        model = RecommendationHistory
+        fields = ('id', 'summary', 'payload', 'created_at', 'result_summary')
+        read_only_fields = fields
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.context.get('result_summary'):
+            self.fields.pop('result_summary')
+
+    def get_result_summary(self, obj):
+        if obj.result_packed:
+            return summarize(obj.result_packed, self.context.get('result_summary_top', 0))
+        top = []
+        for i in range(self.context.get('result_summary_top', 0)):
+            name = getattr(obj, f'result_top_{i}_name', None)
+            if name is None:
+                break
+            top.append({
+                'id': _as_number(getattr(obj, f'result_top_{i}_id', None), int),
+                'name': name,
+                'recommendation_score': _as_number(getattr(obj, f'result_top_{i}_score', None), float),
+            })
+        return {'count': obj.result_count or 0, 'top': top}
+
+
+def _as_number(value, cast):
+    # JSON 路径注解取出的是文本
+    try:
+        return None if value is None else cast(float(value))
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,391 @@
+import csv
+import hashlib
+import io
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from PIL import Image
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
+
+from backend.exports import export_chunks
+from hospital.tests import create_hospitals
+from hospital.views import RecommendHospitalView
+
+from . import avatars
+from .exports import HISTORY_COLUMNS, history_table
+from .models import RecommendationHistory
+from .result_codec import pack_result, rehydrate, summarize
+from .views import ClearHistoryView, HistoryListCreateView, HistoryRetrieveDestroyView
+
+
+User = get_user_model()
+
+
+def hospital_rows(count, first_id=1):
+    """A recommend ``result`` as the frontend stores it."""
+    return [{'id': first_id + i, 'name': f'医院{first_id + i}', 'recommendation_score': round(90.0 - i, 4),
+             'score_breakdown': {'base': 70.0, 'final': round(90.0 - i, 4)}} for i in range(count)]
+
+
+def create_history(user, count, **fields):
+    now = timezone.now()
+    rows = [RecommendationHistory(user=user, summary=f'记录{i}', payload={'disease_code': 'I21', 'n': i},
+                                  result=hospital_rows(5, first_id=i), created_at=now - timedelta(minutes=i),
+                                  **fields)
+            for i in range(count)]
+    return RecommendationHistory.objects.bulk_create(rows)
+
+
+class HistoryListTests(TestCase):
+    url = '/api/accounts/history/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='alice', password='x')
+        cls.other = User.objects.create_user(username='bob', password='x')
+        create_history(cls.user, 45)
+        create_history(cls.other, 5)
+        # rows sharing a created_at still page by id
+        same = timezone.now() - timedelta(days=1)
+        RecommendationHistory.objects.bulk_create(
+            RecommendationHistory(user=cls.user, payload={}, result=[], created_at=same) for _ in range(4))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_requires_login(self):
+        self.assertIn(APIClient().get(self.url).status_code, (401, 403))
+
+    def test_plain_list_is_every_row_newest_first(self):
+        rows = self.client.get(self.url).json()
+        expected = list(RecommendationHistory.objects.filter(user=self.user)
+                        .order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual([row['id'] for row in rows], expected)
+        self.assertEqual(rows[0]['result'], hospital_rows(5, first_id=0))
+
+    def test_cursor_pages(self):
+        expected = list(RecommendationHistory.objects.filter(user=self.user)
+                        .order_by('-created_at', '-id').values_list('id', flat=True))
+        ids, response = [], self.client.get(self.url, {'cursor': '', 'page_size': 10})
+        while True:
+            body = response.json()
+            self.assertLessEqual(len(body['results']), 10)
+            ids += [row['id'] for row in body['results']]
+            if not body['next']:
+                break
+            response = self.client.get(body['next'])
+        self.assertEqual(ids, expected)
+
+    def test_result_modes(self):
+        rows = self.client.get(self.url, {'result': 'omit'}).json()
+        self.assertNotIn('result', rows[0])
+        rows = self.client.get(self.url, {'result': 'summary'}).json()
+        self.assertEqual(rows[0]['result_summary'], {
+            'count': 5,
+            'top': [{'id': row['id'], 'name': row['name'], 'recommendation_score': row['recommendation_score']}
+                    for row in hospital_rows(3, first_id=0)],
+        })
+        self.assertEqual(rows[-1]['result_summary'], {'count': 0, 'top': []})
+        self.assertEqual(self.client.get(self.url, {'result': 'everything'}).status_code, 400)
+
+
+class HistoryDetailTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='alice', password='x')
+        cls.other = User.objects.create_user(username='bob', password='x')
+        cls.staff = User.objects.create_user(username='admin', password='x', is_staff=True)
+        cls.entry = create_history(cls.user, 1)[0]
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def url(self):
+        return f'/api/accounts/history/{self.entry.pk}/'
+
+    def test_owner_and_staff_read_the_full_result(self):
+        for user in (self.user, self.staff):
+            response = self.client_for(user).get(self.url())
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['result'], hospital_rows(5, first_id=0))
+
+    def test_other_users_are_denied(self):
+        client = self.client_for(self.other)
+        self.assertEqual(client.get(self.url()).status_code, 403)
+        self.assertEqual(client.delete(self.url()).status_code, 403)
+        self.assertTrue(RecommendationHistory.objects.filter(pk=self.entry.pk).exists())
+
+    def test_owner_deletes(self):
+        self.assertEqual(self.client_for(self.user).delete(self.url()).status_code, 204)
+        self.assertFalse(RecommendationHistory.objects.filter(pk=self.entry.pk).exists())
+        self.assertEqual(self.client_for(self.user).get(self.url()).status_code, 404)
+
+
+class PackedResultTests(TestCase):
+    url = '/api/accounts/history/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='alice', password='x')
+        create_hospitals(30)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        payload = {'disease_code': 'I21', 'urgency': 'emergency', 'user_lat': 30.25, 'user_lng': 120.15}
+        self.result = APIClient().post('/api/hospital/recommend/', payload, format='json').json()['results'][:10]
+
+    def test_round_trip(self):
+        blob = pack_result(self.result)
+        self.assertIsNotNone(blob)
+        self.assertEqual(rehydrate(blob), self.result)
+        self.assertEqual(summarize(blob, 2), {
+            'count': 10,
+            'top': [{k: row[k] for k in ('id', 'name', 'recommendation_score')} for row in self.result[:2]],
+        })
+
+    def test_results_that_do_not_fit_stay_json(self):
+        self.assertIsNone(pack_result([]))
+        self.assertIsNone(pack_result([dict(self.result[0], note='custom key')]))
+        self.assertIsNone(pack_result([dict(self.result[0], score_breakdown={'base': 'high'})]))
+
+    @override_settings(HISTORY_COMPACT_RESULTS=True)
+    def test_history_api_stores_packed_rows(self):
+        response = self.client.post(self.url, {'summary': 's', 'payload': {}, 'result': self.result}, format='json')
+        self.assertEqual(response.status_code, 201)
+        entry = RecommendationHistory.objects.get(pk=response.json()['id'])
+        self.assertEqual(entry.result, [])
+        self.assertTrue(entry.result_packed)
+        self.assertEqual(self.client.get(f'{self.url}{entry.pk}/').json()['result'], self.result)
+        self.assertEqual(self.client.get(self.url).json()[0]['result'], self.result)
+
+        self.assertNotIn('result', self.client.get(self.url, {'result': 'omit'}).json()[0])
+        summary = self.client.get(self.url, {'result': 'summary'}).json()[0]['result_summary']
+        self.assertEqual(summary, summarize(entry.result_packed, 3))
+
+    def test_compact_history_command(self):
+        packable, custom = create_history(self.user, 2)
+        RecommendationHistory.objects.filter(pk=packable.pk).update(result=self.result)
+        RecommendationHistory.objects.filter(pk=custom.pk).update(result=[{'id': 1, 'note': 'x'}])
+        before = self.client.get(self.url, {'result': 'summary'}).json()
+
+        call_command('compact_history', stdout=io.StringIO())
+        packable.refresh_from_db()
+        custom.refresh_from_db()
+        self.assertTrue(packable.result_packed)
+        self.assertIsNone(custom.result_packed)
+        self.assertEqual(packable.get_result(), self.result)
+        # the list summaries read the same either way
+        self.assertEqual(self.client.get(self.url, {'result': 'summary'}).json(), before)
+
+
+class TwoPerMinuteUser(UserRateThrottle):
+    rate = '2/min'
+
+
+class TwoPerMinuteAnon(AnonRateThrottle):
+    rate = '2/min'
+
+
+class AsyncViewTests(TestCase):
+    """The async views still run DRF's authentication, permissions and throttles."""
+    url = '/api/accounts/history/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='carol', password='x')
+        cls.other = User.objects.create_user(username='dave', password='x')
+        cls.own = create_history(cls.user, 3)
+        cls.foreign = create_history(cls.other, 1)[0]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_views_are_async(self):
+        for view in (HistoryListCreateView, HistoryRetrieveDestroyView, ClearHistoryView, RecommendHospitalView):
+            self.assertTrue(view.view_is_async, view.__name__)
+
+    async def test_login_required(self):
+        for method, url in (('get', self.url), ('get', f'{self.url}{self.own[0].pk}/'),
+                            ('delete', f'{self.url}{self.own[0].pk}/'), ('delete', f'{self.url}clear/')):
+            response = await getattr(self.async_client, method)(url)
+            self.assertEqual(response.status_code, 403, (method, url))
+        self.assertEqual(await RecommendationHistory.objects.acount(), 4)
+
+    async def test_owner_checks(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.json()], [row.pk for row in self.own])
+        self.assertEqual((await self.async_client.get(f'{self.url}{self.foreign.pk}/')).status_code, 403)
+        self.assertEqual((await self.async_client.delete(f'{self.url}{self.foreign.pk}/')).status_code, 403)
+        self.assertEqual((await self.async_client.delete(f'{self.url}clear/')).status_code, 200)
+        self.assertEqual(await RecommendationHistory.objects.acount(), 1)
+
+    async def test_throttles(self):
+        await self.async_client.aforce_login(self.user)
+        with mock.patch.object(HistoryListCreateView, 'throttle_classes', [TwoPerMinuteUser]):
+            statuses = [(await self.async_client.get(self.url)).status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+    def test_throttles_anonymous_recommend(self):
+        with mock.patch.object(RecommendHospitalView, 'throttle_classes', [TwoPerMinuteAnon]):
+            responses = [self.client.post('/api/hospital/recommend/', {}, content_type='application/json')
+                         for _ in range(3)]
+        self.assertEqual([r.status_code for r in responses], [200, 200, 429])
+        self.assertIn('Retry-After', responses[-1])
+
+
+class HistoryExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='erin', password='x')
+        create_hospitals(20)
+
+    def setUp(self):
+        cache.clear()
+        self.plain, self.packed = create_history(self.user, 2)
+        self.result = APIClient().post('/api/hospital/recommend/', {'urgency': 'urgent'},
+                                       format='json').json()['results'][:5]
+        RecommendationHistory.objects.filter(pk=self.packed.pk).update(
+            result=[], result_packed=pack_result(self.result))
+
+    def test_csv(self):
+        data = b''.join(export_chunks(history_table(RecommendationHistory.objects.all(), chunk_size=1), 'csv'))
+        rows = list(csv.DictReader(io.StringIO(data.decode('utf-8'))))
+        self.assertEqual(list(rows[0]), [name for name, _ in HISTORY_COLUMNS])
+        self.assertEqual([int(row['id']) for row in rows], [self.plain.pk, self.packed.pk])
+        self.assertEqual(rows[0]['username'], 'erin')
+        self.assertEqual(json.loads(rows[0]['payload']), self.plain.payload)
+        self.assertEqual(json.loads(rows[0]['result']), self.plain.result)
+        # packed results are rehydrated from the snapshot
+        self.assertEqual(json.loads(rows[1]['result']), self.result)
+
+
+def image_bytes(size=(800, 400), fmt='JPEG', exif=None):
+    buffer = io.BytesIO()
+    options = {'exif': exif} if exif is not None else {}
+    Image.new('RGB', size, (200, 30, 30)).save(buffer, format=fmt, **options)
+    return buffer.getvalue()
+
+
+def upload(data, name='avatar.jpg'):
+    return SimpleUploadedFile(name, data, content_type='image/jpeg')
+
+
+@override_settings(AVATAR_SIZES=(300, 96))
+class AvatarPipelineTests(SimpleTestCase):
+    def test_render_variants(self):
+        out = avatars.render_variants(image_bytes())
+        self.assertEqual(set(out), {(300, 'jpg'), (300, 'webp'), (96, 'jpg'), (96, 'webp')})
+        for (size, ext), data in out.items():
+            with Image.open(io.BytesIO(data)) as img:
+                self.assertEqual(img.format, 'JPEG' if ext == 'jpg' else 'WEBP')
+                self.assertEqual(img.size, (size, size // 2))
+
+    def test_exif_orientation_is_applied(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # rotated 90° clockwise
+        out = avatars.render_variants(image_bytes(exif=exif))
+        with Image.open(io.BytesIO(out[300, 'jpg'])) as img:
+            self.assertEqual(img.size, (150, 300))
+
+    def test_validate_upload(self):
+        data = image_bytes()
+        self.assertEqual(avatars.validate_upload(upload(data)), (data, hashlib.sha256(data).hexdigest()[:32]))
+        for bad in (b'not an image', image_bytes(fmt='TIFF'), data[:200]):
+            with self.assertRaises(avatars.AvatarError):
+                avatars.validate_upload(upload(bad))
+        with override_settings(AVATAR_MAX_UPLOAD_BYTES=100), self.assertRaises(avatars.AvatarError):
+            avatars.validate_upload(upload(data))
+        with override_settings(AVATAR_MAX_PIXELS=1000), self.assertRaises(avatars.AvatarError):
+            avatars.validate_upload(upload(data))
+
+    def test_variants(self):
+        name = avatars.main_name('a' * 32)
+        self.assertEqual(name, f'avatars/{"a" * 32}_300.jpg')
+        self.assertEqual(avatars.variants(name)['webp'][96], f'avatars/{"a" * 32}_96.webp')
+        self.assertIsNone(avatars.variants('avatars/default.png'))
+
+
+@override_settings(AVATAR_ASYNC=False, AVATAR_SIZES=(300, 96))
+class AvatarUploadTests(TestCase):
+    url = '/api/accounts/userinfo/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frank', password='x')
+        cls.other = User.objects.create_user(username='grace', password='x')
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, True)
+        settings_override = override_settings(MEDIA_ROOT=media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def upload_avatar(self, user, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client_for(user).patch(self.url, {'avatar': upload(data)}, format='multipart')
+
+    def test_upload_is_processed_after_commit(self):
+        data = image_bytes()
+        response = self.upload_avatar(self.user, data)
+        self.assertEqual(response.status_code, 200)
+        # the response is built before the commit: the old avatar is still shown
+        self.assertEqual(response.json()['avatar_status'], 'processing')
+
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar.name, avatars.main_name(digest))
+        body = self.client_for(self.user).get(self.url).json()
+        self.assertIsNone(body['avatar_status'])
+        self.assertTrue(body['avatar_variants']['webp']['96'].endswith(f'{digest}_96.webp'))
+        for by_size in avatars.variants(self.user.avatar.name).values():
+            for name in by_size.values():
+                self.assertTrue(default_storage.exists(name), name)
+
+    def test_bad_upload_is_rejected(self):
+        response = self.upload_avatar(self.user, b'not an image')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('avatar', response.json())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar.name, 'avatars/default.png')
+
+    def test_shared_files_are_kept_until_unused(self):
+        data = image_bytes()
+        self.upload_avatar(self.user, data)
+        # the same image again: the existing files are used right away
+        response = self.upload_avatar(self.other, data)
+        self.assertIsNone(response.json()['avatar_status'])
+        self.user.refresh_from_db()
+        name = self.user.avatar.name
+        self.assertEqual(User.objects.get(pk=self.other.pk).avatar.name, name)
+
+        self.client_for(self.user).patch(self.url, {'avatar': None}, format='json')
+        self.assertTrue(default_storage.exists(name))
+        self.client_for(self.other).patch(self.url, {'avatar': None}, format='json')
+        for by_size in avatars.variants(name).values():
+            for variant in by_size.values():
+                self.assertFalse(default_storage.exists(variant), variant)
@@ -10,7 +10,7 @@ from .views import (
     GetCSRFTokenView,
     CheckUsernameView,
     HistoryListCreateView,
-    HistoryDestroyView,
+    HistoryRetrieveDestroyView,
     ClearHistoryView,
 )
 
@@ -47,7 +47,7 @@ urlpatterns = [
     path('check-username/', CheckUsernameView.as_view(), name='check-username'),
     path('history/', HistoryListCreateView.as_view(), name='history-list'),
     path('history/clear/', ClearHistoryView.as_view(), name='history-clear'),
-    path('history/<int:pk>/', HistoryDestroyView.as_view(), name='history-detail'),
+    path('history/<int:pk>/', HistoryRetrieveDestroyView.as_view(), name='history-detail'),
     # Admin API
     path('admin/users/', AdminUserListCreateView.as_view(), name='admin-user-list'),
     path('admin/users/<int:pk>/', AdminUserRetrieveUpdateDestroyView.as_view(), name='admin-user-detail'),
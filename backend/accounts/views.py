@@ -4,19 +4,22 @@ from rest_framework.exceptions import PermissionDenied
 from rest_framework import generics, permissions, status
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.permissions import AllowAny
+from rest_framework.pagination import CursorPagination
+from rest_framework.exceptions import ValidationError
+from asgiref.sync import sync_to_async
 from django.db import transaction
+from django.http import Http404
+from django.db.models import Func, IntegerField
+from django.db.models.fields.json import KT
 from django.contrib.auth import authenticate, login, logout
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.utils.decorators import method_decorator
 from django.middleware.csrf import get_token
 from django.conf import settings
-from .serializers import UserSerializer, UserUpdateSerializer, HistorySerializer
+from .serializers import UserSerializer, UserUpdateSerializer, HistorySerializer, HistoryListSerializer
 from .models import User, RecommendationHistory
-
-# 以下用于服务器端图片处理（可选）
-from django.core.files.uploadedfile import InMemoryUploadedFile
-from PIL import Image
-import io
+from backend.async_views import AsyncAPIViewMixin
+from . import avatars
 
 
 @method_decorator(ensure_csrf_cookie, name='dispatch')
@@ -103,6 +106,8 @@ class UserInfoView(APIView):
       - 仅当请求体中明确包含 avatar 字段且其值为空('', 'null', 'None', None) 时才视作删除头像请求，
         如果请求体完全没有 avatar 字段则不会删除原有头像。
       - 上传文件优先于删除指示（如果同时上传文件，则以上传文件为准）。
+      - 上传的头像在后台处理（见 accounts.avatars）：响应中 avatar_status='processing' 时仍是旧头像，
+        处理完成后 GET 返回新头像（解码失败时为 'failed'）；不合格的图片（过大、像素过多、无法识别）返回 400。
     """
     permission_classes = [permissions.IsAuthenticated]
     # 支持 JSON 与表单/文件上传
@@ -121,65 +126,46 @@ class UserInfoView(APIView):
         if 'avatar' in request.data and request.data.get('avatar') in ('', 'null', 'None', None):
             remove_avatar = True
 
-        with transaction.atomic():
-            # 先处理上传文件（若有上传文件，优先使用上传文件）
-            upload_file = request.FILES.get('avatar')
-            new_avatar_file = None
-
-            if upload_file:
-                try:
-                    # 使用 Pillow 对图片做基本处理并转换为 JPEG（如需保留原格式可调整）
-                    img = Image.open(upload_file)
-                    img = img.convert('RGB')
-                    # 缩放到最大 300x300（按需调整）
-                    img.thumbnail((300, 300), Image.ANTIALIAS)
-
-                    buffer = io.BytesIO()
-                    img.save(buffer, format='JPEG', quality=85)
-                    buffer.seek(0)
-                    size = buffer.getbuffer().nbytes
-
-                    new_avatar_file = InMemoryUploadedFile(
-                        buffer,               # file
-                        'avatar',             # field_name
-                        upload_file.name or 'avatar.jpg',  # name
-                        'image/jpeg',         # content_type
-                        size,                 # size
-                        None                  # charset
-                    )
-                except Exception:
-                    # 如果压缩/转换失败，回退使用原始上传文件（确保文件指针回到开头）
-                    try:
-                        upload_file.seek(0)
-                    except Exception:
-                        pass
-                    new_avatar_file = upload_file
+        # 请求内只做轻量校验（大小/格式/像素），解码缩放在事务提交后由后台线程池完成（见 accounts.avatars）
+        upload_file = request.FILES.get('avatar')
+        avatar_data = digest = None
+        data = request.data
+        if upload_file:
+            try:
+                avatar_data, digest = avatars.validate_upload(upload_file)
+            except avatars.AvatarError as exc:
+                raise ValidationError({'avatar': [str(exc)]})
+            data = {k: v for k, v in request.data.items() if k != 'avatar'}
 
+        with transaction.atomic():
             # 使用 serializer 验证并保存其它字段（partial update）
-            serializer = UserUpdateSerializer(instance=user, data=request.data, partial=True, context={'request': request})
+            serializer = UserUpdateSerializer(instance=user, data=data, partial=True, context={'request': request})
             serializer.is_valid(raise_exception=True)
 
-            # 如果上传了新头像文件，则以上传文件为准覆盖保存
-            if new_avatar_file:
-                serializer.save(avatar=new_avatar_file)
+            if digest is not None and avatars.is_processed(digest):
+                # 同一张图片已处理过（文件名为内容哈希）：直接引用已有文件
+                serializer.save(avatar=avatars.main_name(digest))
             else:
                 # 先保存其它字段
                 serializer.save()
-                # 如果前端明确请求删除头像（并且没有上传新文件），则删除存储的头像并清空字段
-                if remove_avatar:
+                if digest is not None:
+                    # 新头像：提交后异步生成各尺寸 JPEG/WebP，完成前仍显示旧头像（avatar_status='processing'）
+                    avatars.schedule(user.pk, avatar_data, digest)
+                elif remove_avatar:
+                    # 如果前端明确请求删除头像（并且没有上传新文件），则删除存储的头像并清空字段
                     try:
-                        if getattr(user, 'avatar', None):
-                            user.avatar.delete(save=False)
+                        avatars.release(user)
                         user.avatar = None
                         user.save()
                     except Exception:
                         # 记录或忽略删除失败（按需改为 raise）
                         pass
 
-            # 确保从数据库刷新实例后序列化返回最新数据
-            user.refresh_from_db()
-            out = UserSerializer(user, context={'request': request}).data
-            return Response(out, status=status.HTTP_200_OK)
+        # 确保从数据库刷新实例后序列化返回最新数据（事务外：同步处理模式下头像此时已生成）
+        user.refresh_from_db()
+        out = UserSerializer(user, context={'request': request}).data
+        return Response(out, status=status.HTTP_200_OK)
+
 
 class CheckUsernameView(APIView):
     """
@@ -198,33 +184,142 @@ class CheckUsernameView(APIView):
         exists = User.objects.filter(username=username).exists()
         return Response({'exists': exists, 'available': not exists})
 
-class HistoryListCreateView(generics.ListCreateAPIView):
+class JSONArrayLength(Func):
+    """JSON 数组长度（MySQL JSON_LENGTH / SQLite json_array_length / PostgreSQL jsonb_array_length）"""
+    function = 'JSON_LENGTH'
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function='json_array_length', **extra_context)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function='jsonb_array_length', **extra_context)
+
+
+class HistoryCursorPagination(CursorPagination):
+    """按 (user_id, created_at, id) 游标分页，对应 history_user_created_idx 索引"""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+
+
+class HistoryListCreateView(AsyncAPIViewMixin, generics.ListCreateAPIView):
+    """
+    GET /api/accounts/history/
+      - 默认返回全部历史（数组，含完整 result），兼容旧前端
+      - ?cursor= 启用游标分页（{next, previous, results}），继续翻页时请求 next
+      - ?result=omit 不返回 result；?result=summary 返回 result_summary（条数 + 前几名医院）
+        完整 result 通过 GET /api/accounts/history/<id>/ 获取
+    历史相关视图均为异步视图（见 backend.async_views），ASGI 部署下不占用线程等待数据库
+    """
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = HistorySerializer
     pagination_class = None
+    RESULT_MODES = ('full', 'omit', 'summary')
+    SUMMARY_TOP = 3
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            self._paginator = HistoryCursorPagination() if 'cursor' in self.request.query_params else None
+        return self._paginator
+
+    def _result_mode(self):
+        if self.request.method != 'GET':
+            return 'full'
+        mode = self.request.query_params.get('result') or 'full'
+        if mode not in self.RESULT_MODES:
+            raise ValidationError({'result': f'可选值: {", ".join(self.RESULT_MODES)}'})
+        return mode
 
     def get_queryset(self):
-        return RecommendationHistory.objects.filter(user=self.request.user).order_by('-created_at')
+        qs = RecommendationHistory.objects.filter(user=self.request.user).order_by('-created_at', '-id')
+        mode = self._result_mode()
+        if mode == 'full':
+            return qs
+        # 不从数据库取出 result 本体；summary 只取长度与前几名的字段（紧凑存储的行直接解码）
+        if mode == 'omit':
+            return qs.defer('result', 'result_packed')
+        qs = qs.defer('result')
+        if mode == 'summary':
+            annotations = {'result_count': JSONArrayLength('result')}
+            for i in range(self.SUMMARY_TOP):
+                for key, name in (('id', 'id'), ('name', 'name'), ('recommendation_score', 'score')):
+                    annotations[f'result_top_{i}_{name}'] = KT(f'result__{i}__{key}')
+            qs = qs.annotate(**annotations)
+        return qs
+
+    def get_serializer_class(self):
+        if self._result_mode() == 'full':
+            return HistorySerializer
+        return HistoryListSerializer
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self._result_mode() == 'summary':
+            context.update(result_summary=True, result_summary_top=self.SUMMARY_TOP)
+        return context
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    async def get(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.paginator is not None:
+            # DRF 的分页器同步取数，整体放到线程中执行
+            return await sync_to_async(self.list)(request, *args, **kwargs)
+        rows = [row async for row in queryset]
+        # 紧凑存储的 result 需要医院快照还原，序列化放到线程中执行
+        data = await sync_to_async(lambda: self.get_serializer(rows, many=True).data)()
+        return Response(data)
+
+    async def post(self, request, *args, **kwargs):
+        return await sync_to_async(self.create)(request, *args, **kwargs)
+
 
-class HistoryDestroyView(generics.DestroyAPIView):
+class HistoryRetrieveDestroyView(AsyncAPIViewMixin, generics.RetrieveDestroyAPIView):
+    """GET / DELETE /api/accounts/history/<id>/：单条历史（含完整 result）"""
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = HistorySerializer
     queryset = RecommendationHistory.objects.all()
 
+    def _check_owner(self, obj):
+        if obj.user_id != self.request.user.pk and not self.request.user.is_staff:
+            if self.request.method == 'DELETE':
+                raise PermissionDenied("没有权限删除该历史")
+            raise PermissionDenied("没有权限查看该历史")
+
     def get_object(self):
         obj = super().get_object()
-        if obj.user != self.request.user and not self.request.user.is_staff:
-            raise PermissionDenied("没有权限删除该历史")
+        self._check_owner(obj)
+        return obj
+
+    async def aget_object(self):
+        """get_object 的异步版本（异步 ORM 查询）"""
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset())
+        obj = await queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]}).afirst()
+        if obj is None:
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        self._check_owner(obj)
         return obj
 
+    async def get(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        data = await sync_to_async(lambda: self.get_serializer(instance).data)()
+        return Response(data)
+
+    async def delete(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        await instance.adelete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
-class ClearHistoryView(APIView):
+class ClearHistoryView(AsyncAPIViewMixin, APIView):
     permission_classes = [permissions.IsAuthenticated]
 
-    def delete(self, request, *args, **kwargs):
-        RecommendationHistory.objects.filter(user=request.user).delete()
+    async def delete(self, request, *args, **kwargs):
+        await RecommendationHistory.objects.filter(user=request.user).adelete()
         return Response({'detail': 'cleared'}, status=status.HTTP_200_OK)
\ No newline at end of file
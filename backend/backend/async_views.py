@@ -0,0 +1,71 @@
+"""
+Async request handling for DRF views.
+
+DRF's ``APIView.dispatch`` is synchronous, so an ``async def post`` on a plain
+``APIView`` would hand Django an un-awaited coroutine. ``AsyncAPIViewMixin``
+replaces it with an ``async def dispatch``:
+
+  - ``initial()`` (authentication, CSRF, permissions, throttles, content
+    negotiation; the session and user lookups hit the database) runs through
+    ``sync_to_async``
+  - the ``async def`` handler is awaited on the event loop; it awaits its own
+    cache / ORM calls and pushes CPU-heavy work (ranking, serialization) to a
+    thread with ``sync_to_async`` so other requests keep being served
+  - exceptions and response finalization go through the regular DRF code
+
+Django marks a view async when all its handlers are ``async def``. Under ASGI
+(uvicorn workers, ``APP_SERVER=asgi`` in docker-entrypoint.sh) such views run
+on the worker's event loop; under WSGI Django runs them with ``async_to_sync``,
+so the same URLconf keeps working on the sync gunicorn workers.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+
+
+class AsyncAPIViewMixin:
+    """Put before the DRF view class: ``class V(AsyncAPIViewMixin, APIView)``."""
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            # OPTIONS (APIView.options) stays synchronous
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+def is_asgi_request(request):
+    """Was ``request`` (Django or DRF) received by the ASGI handler?"""
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+async def iterate_in_thread(iterator, thread_sensitive=False):
+    """
+    Async iterator over a sync ``iterator``, producing each item in a thread.
+    Streaming bodies under ASGI need one: Django buffers a sync iterator in full
+    before sending it. Iterators that query the database need
+    ``thread_sensitive=True`` (the thread that owns the connection).
+    """
+    step = sync_to_async(next, thread_sensitive=thread_sensitive)
+    while True:
+        item = await step(iterator, None)
+        if item is None:
+            return
+        yield item
@@ -0,0 +1,225 @@
+"""
+Streaming table exports: CSV, gzip-compressed CSV and Parquet.
+
+An ``ExportTable`` reads a queryset as ``values_list`` rows in keyset batches
+(``pk > last`` ordered by pk, ``chunk_size`` rows per query) instead of loading
+model instances: memory stays flat whatever the table size, also on MySQL
+where ``QuerySet.iterator()`` is buffered in full by the driver.
+
+  - ``export_chunks`` yields the encoded file piece by piece; the admin
+    actions wrap it in ``export_response`` (a ``StreamingHttpResponse``), the
+    ``export_hospitals`` / ``export_history`` commands write it to a file
+  - CSV keeps the layout of the old admin export (``str()`` of each value,
+    empty for NULL); ``compress=True`` gzips it on the fly
+  - Parquet (needs pyarrow) writes one row group per ``PARQUET_ROW_GROUP`` rows
+    with a fixed schema, so columns keep their type even when a group is all NULL
+
+Exports of whole large tables from the admin still run inside one gunicorn
+request; the management commands have no time limit.
+"""
+import csv
+import io
+import os
+import zlib
+
+from django.conf import settings
+from django.db import models
+from django.http import StreamingHttpResponse
+
+from .async_views import is_asgi_request, iterate_in_thread
+
+FORMATS = ('csv', 'parquet')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'csv.gz': 'application/gzip',
+    'parquet': 'application/vnd.apache.parquet',
+}
+# column types of an export (see ``column_type``)
+COLUMN_TYPES = ('int', 'float', 'bool', 'str', 'datetime')
+
+CHUNK_SIZE = 2000
+PARQUET_ROW_GROUP = 50000
+
+
+class ExportFormatError(ValueError):
+    """The requested export format is unknown or unavailable."""
+
+
+def column_type(field):
+    """Export column type of a model field."""
+    if isinstance(field, (models.AutoField, models.IntegerField, models.ForeignKey)):
+        return 'int'
+    if isinstance(field, (models.FloatField, models.DecimalField)):
+        return 'float'
+    if isinstance(field, models.BooleanField):
+        return 'bool'
+    if isinstance(field, models.DateTimeField):
+        return 'datetime'
+    return 'str'
+
+
+class ExportTable:
+    """
+    ``queryset`` exported as the ``values_list`` of ``fields``. ``columns`` are
+    the (name, type) pairs of the output (default: the fields, typed from the
+    model); ``convert(row)`` maps a values tuple to an output tuple.
+    """
+
+    def __init__(self, queryset, fields, columns=None, convert=None, chunk_size=CHUNK_SIZE):
+        self.queryset = queryset
+        self.fields = tuple(fields)
+        if columns is None:
+            opts = queryset.model._meta
+            columns = [(name, column_type(opts.get_field(name))) for name in self.fields]
+        self.columns = tuple(columns)
+        self.convert = convert
+        self.chunk_size = chunk_size
+
+    @property
+    def names(self):
+        return [name for name, _ in self.columns]
+
+    def rows(self):
+        qs = self.queryset.order_by('pk').values_list('pk', *self.fields)
+        last_pk = None
+        while True:
+            page = qs if last_pk is None else qs.filter(pk__gt=last_pk)
+            chunk = list(page[:self.chunk_size])
+            if not chunk:
+                return
+            last_pk = chunk[-1][0]
+            for row in chunk:
+                yield row[1:] if self.convert is None else self.convert(row[1:])
+            if len(chunk) < self.chunk_size:
+                return
+
+
+def _csv_chunks(table, compress):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    encoder = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits 31: gzip container
+
+    def take():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return encoder.compress(data) if encoder is not None else data
+
+    writer.writerow(table.names)
+    for count, row in enumerate(table.rows(), start=1):
+        writer.writerow(row)
+        if count % table.chunk_size == 0:
+            chunk = take()
+            if chunk:
+                yield chunk
+    chunk = take()
+    if encoder is not None:
+        chunk += encoder.flush()
+    if chunk:
+        yield chunk
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file collecting the bytes pyarrow writes until ``drain()``."""
+
+    def __init__(self):
+        super().__init__()
+        self._parts = []
+        self._size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._size
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _arrow_schema(pa, columns):
+    types = {
+        'int': pa.int64(),
+        'float': pa.float64(),
+        'bool': pa.bool_(),
+        'str': pa.string(),
+        'datetime': pa.timestamp('us', tz=settings.TIME_ZONE if settings.USE_TZ else None),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+
+def _parquet_chunks(table, pa, pq):
+    schema = _arrow_schema(pa, table.columns)
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema)
+    group = []
+
+    def write_group():
+        values = list(zip(*group))
+        writer.write_batch(pa.record_batch(
+            [pa.array(column, type=field.type) for column, field in zip(values, schema)], schema=schema))
+        group.clear()
+        return sink.drain()
+
+    for row in table.rows():
+        group.append(row)
+        if len(group) >= PARQUET_ROW_GROUP:
+            yield write_group()
+    if group:
+        yield write_group()
+    writer.close()
+    yield sink.drain()
+
+
+def export_chunks(table, fmt='csv', compress=False):
+    """Iterator over the encoded export of ``table`` (bytes)."""
+    if fmt == 'csv':
+        return _csv_chunks(table, compress)
+    if fmt == 'parquet':
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ExportFormatError('Parquet export requires pyarrow (pip install pyarrow)')
+        return _parquet_chunks(table, pa, pq)
+    raise ExportFormatError(f'unsupported format: {fmt} (expected one of {", ".join(FORMATS)})')
+
+
+def detect_format(path, default='csv'):
+    """(format, compress) from an output file name: ``.csv``, ``.csv.gz``, ``.parquet``."""
+    name = (path or '').lower()
+    if name.endswith('.gz'):
+        return 'csv', True
+    if os.path.splitext(name)[1] == '.parquet':
+        return 'parquet', False
+    return default, False
+
+
+def write_export(table, path, fmt='csv', compress=False):
+    """Write the export of ``table`` to ``path``; returns the number of bytes written."""
+    chunks = export_chunks(table, fmt, compress)
+    written = 0
+    with open(path, 'wb') as fh:
+        for chunk in chunks:
+            fh.write(chunk)
+            written += len(chunk)
+    return written
+
+
+def export_response(table, basename, fmt='csv', compress=False, request=None):
+    """``StreamingHttpResponse`` downloading ``table`` as ``<basename>.<ext>``."""
+    chunks = export_chunks(table, fmt, compress)
+    kind = 'csv.gz' if fmt == 'csv' and compress else fmt
+    if request is not None and is_asgi_request(request):
+        # the rows are queried while streaming: stay on the connection's thread
+        chunks = iterate_in_thread(chunks, thread_sensitive=True)
+    response = StreamingHttpResponse(chunks, content_type=CONTENT_TYPES[kind])
+    response['Content-Disposition'] = f'attachment; filename={basename}.{kind}'
+    return response
@@ -0,0 +1,401 @@
+"""
+Lightweight request instrumentation.
+
+``TimingMiddleware`` opens a ``RequestTimings`` for every request; views mark
+their stages with ``span('score')`` and attach counts with
+``record('candidates', n)``. SQL queries are counted and timed through a
+database execute wrapper. When the response leaves the middleware:
+
+  - the stages go out as a ``Server-Timing`` header
+    (``db;desc="3 queries";dur=1.2, score;dur=8.4, ..., total;dur=15.0``)
+  - durations, query counts and recorded values are added to per-worker
+    Prometheus histograms, labelled by URL pattern (not path, to keep the
+    label set small)
+
+Each gunicorn worker has its own ``MetricsRegistry``. Workers flush it to the
+shared cache every ``METRICS_FLUSH_INTERVAL`` seconds, under a key of their own
+that expires after ``METRICS_WORKER_TTL``, and add their pid to a Redis set
+(``SADD``: workers never rewrite a shared value, so no flush is lost to a
+concurrent one). ``/api/metrics/`` merges every worker's flush into one
+Prometheus text exposition, so a scrape sees the whole pod whichever worker
+answers it. Counters of a worker that stopped flushing disappear once its key
+expired (Prometheus treats that as a counter reset), and its pid is dropped
+from the set (``SREM``). Caches without a Redis client (locmem in development
+and tests) are per process: the set is then kept in memory.
+"""
+import bisect
+import contextvars
+import hmac
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+METRICS_PREFIX = 'yixuanbao'
+# Redis set of the pids that flushed (one WORKER_KEY each)
+WORKERS_KEY = 'metrics:worker_pids'
+WORKER_KEY = 'metrics:worker:{}'
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+def metrics_enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def server_timing_enabled():
+    return getattr(settings, 'SERVER_TIMING_ENABLED', True)
+
+
+def flush_interval():
+    return getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+
+
+def worker_ttl():
+    return getattr(settings, 'METRICS_WORKER_TTL', 300)
+
+
+def _redis():
+    """Raw client of the default cache when it is django_redis, else None."""
+    try:
+        return get_redis_connection('default')
+    except NotImplementedError:
+        return None
+
+
+class WorkerSet:
+    """
+    Pids of the workers that flushed metrics. Every change is one set command,
+    so concurrent workers never overwrite each other. Redis errors are ignored
+    like the cache's (IGNORE_EXCEPTIONS): a scrape then misses workers until
+    their next flush.
+    """
+
+    def __init__(self):
+        self._local = set()
+
+    def add(self, pid):
+        client = _redis()
+        if client is None:
+            self._local.add(pid)
+            return
+        key = cache.make_key(WORKERS_KEY)
+        try:
+            # the set outlives the last member's key by one TTL at most
+            client.pipeline().sadd(key, pid).expire(key, worker_ttl()).execute()
+        except RedisError:
+            pass
+
+    def members(self):
+        client = _redis()
+        if client is None:
+            return set(self._local)
+        try:
+            return {int(pid) for pid in client.smembers(cache.make_key(WORKERS_KEY))}
+        except RedisError:
+            return set()
+
+    def discard(self, pids):
+        client = _redis()
+        if client is None:
+            self._local.difference_update(pids)
+            return
+        if pids:
+            try:
+                client.srem(cache.make_key(WORKERS_KEY), *pids)
+            except RedisError:
+                pass
+
+
+workers = WorkerSet()
+
+
+class RequestTimings:
+    """Stage durations (seconds), SQL stats and recorded values of one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.values = {}
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def server_timing(self, total):
+        parts = [f'db;desc="{self.queries} queries";dur={self.query_seconds * 1000:.2f}']
+        parts.extend(f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in self.stages.items())
+        parts.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(parts)
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as ``stage`` of the current request (no-op outside requests)."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(stage, time.perf_counter() - t0)
+
+
+def record(name, value):
+    """Attach a numeric value (e.g. candidate count) to the current request."""
+    timings = _current.get()
+    if timings is not None:
+        timings.values[name] = value
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Per-process counters and histograms, keyed by (metric name, label tuple)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = []
+        self.last_flush = 0.0
+
+    def add_collector(self, collect):
+        """Register ``collect() -> [(counter name, value), ...]`` read on every flush."""
+        self.collectors.append(collect)
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(buckets)
+            hist.observe(value)
+
+    def dump(self):
+        collected = [(name, (), value) for collect in self.collectors for name, value in collect()]
+        with self._lock:
+            return {
+                'counters': [(name, labels, v) for (name, labels), v in self.counters.items()] + collected,
+                'histograms': [(name, labels, list(h.buckets), list(h.counts), h.sum, h.count)
+                               for (name, labels), h in self.histograms.items()],
+            }
+
+    def flush_due(self):
+        return time.monotonic() - self.last_flush >= flush_interval()
+
+    def flush(self, force=False):
+        """Publish this worker's metrics to the shared cache (at most every flush_interval seconds)."""
+        if not force and not self.flush_due():
+            return
+        self.last_flush = time.monotonic()
+        pid = os.getpid()
+        cache.set(WORKER_KEY.format(pid), self.dump(), timeout=worker_ttl())
+        workers.add(pid)
+
+
+registry = MetricsRegistry()
+
+
+def _observe_request(view, method, status, timings, total):
+    registry.inc('http_requests_total', {'view': view, 'method': method, 'status': str(status)})
+    registry.observe('http_request_duration_seconds', {'view': view, 'method': method}, total, DURATION_BUCKETS)
+    registry.observe('stage_duration_seconds', {'view': view, 'stage': 'db'}, timings.query_seconds, DURATION_BUCKETS)
+    for stage, seconds in timings.stages.items():
+        registry.observe('stage_duration_seconds', {'view': view, 'stage': stage}, seconds, DURATION_BUCKETS)
+    registry.observe('db_queries', {'view': view}, timings.queries, COUNT_BUCKETS)
+    for name, value in timings.values.items():
+        registry.observe(name, {'view': view}, value, COUNT_BUCKETS)
+
+
+class TimingMiddleware:
+    """
+    Opens the per-request ``RequestTimings``, emits Server-Timing and feeds the registry.
+    Sync and async capable: under ASGI the database wrapper is installed on the
+    request's thread-sensitive executor thread, where its ``sync_to_async`` ORM
+    calls run.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not metrics_enabled() and not server_timing_enabled():
+            return self.get_response(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            with connection.execute_wrapper(self._count_query):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._finish(request, response, timings)
+        if metrics_enabled():
+            registry.flush()
+        return response
+
+    async def __acall__(self, request):
+        if not metrics_enabled() and not server_timing_enabled():
+            return await self.get_response(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            await sync_to_async(self._wrap_queries)(True)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(self._wrap_queries)(False)
+        finally:
+            _current.reset(token)
+        self._finish(request, response, timings)
+        if metrics_enabled() and registry.flush_due():
+            await sync_to_async(registry.flush)()
+        return response
+
+    def _finish(self, request, response, timings):
+        total = time.perf_counter() - timings.started
+        if server_timing_enabled():
+            response['Server-Timing'] = timings.server_timing(total)
+        if metrics_enabled():
+            match = getattr(request, 'resolver_match', None)
+            # the URL pattern (not the path) keeps label cardinality bounded
+            view = (match.route if match else None) or 'unmatched'
+            _observe_request(view, request.method, response.status_code, timings, total)
+
+    def process_template_response(self, request, response):
+        # DRF responses render after the view returns: time the rendering too
+        timings = _current.get()
+        if timings is not None:
+            t0 = time.perf_counter()
+            response.add_post_render_callback(lambda r: timings.add('render', time.perf_counter() - t0))
+        return response
+
+    def _wrap_queries(self, install):
+        # connections are per thread: this must run on the thread the ORM calls use
+        if install:
+            connection.execute_wrappers.append(self._count_query)
+        else:
+            connection.execute_wrappers.remove(self._count_query)
+
+    @staticmethod
+    def _count_query(execute, sql, params, many, context):
+        timings = _current.get()
+        t0 = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if timings is not None:
+                timings.queries += 1
+                timings.query_seconds += time.perf_counter() - t0
+
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{str(v)}"' for k, v in items) + '}'
+
+
+def _merge(dumps):
+    counters, histograms = {}, {}
+    for dump in dumps:
+        for name, labels, value in dump['counters']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, buckets, counts, total, count in dump['histograms']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            merged = histograms.get(key)
+            if merged is None:
+                histograms[key] = [list(buckets), list(counts), total, count]
+            else:
+                merged[1] = [a + b for a, b in zip(merged[1], counts)]
+                merged[2] += total
+                merged[3] += count
+    return counters, histograms
+
+
+def render_prometheus(dumps):
+    """Prometheus text exposition of the merged worker dumps."""
+    counters, histograms = _merge(dumps)
+    lines = []
+    for name in sorted({n for n, _ in counters}):
+        full = f'{METRICS_PREFIX}_{name}'
+        lines.append(f'# TYPE {full} counter')
+        for (n, labels), value in sorted(counters.items()):
+            if n == name:
+                lines.append(f'{full}{_labels(labels)} {value}')
+    for name in sorted({n for n, _ in histograms}):
+        full = f'{METRICS_PREFIX}_{name}'
+        lines.append(f'# TYPE {full} histogram')
+        for (n, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+            if n != name:
+                continue
+            cumulative = 0
+            for bound, c in zip(buckets, counts):
+                cumulative += c
+                lines.append(f'{full}_bucket{_labels(labels, le=bound)} {cumulative}')
+            lines.append(f'{full}_bucket{_labels(labels, le="+Inf")} {count}')
+            lines.append(f'{full}_sum{_labels(labels)} {total}')
+            lines.append(f'{full}_count{_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    GET /api/metrics/: Prometheus metrics of every worker, behind METRICS_TOKEN.
+    Without a token the endpoint is only served outside production.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if not token:
+        if getattr(settings, 'IS_PRODUCTION', False):
+            return HttpResponseForbidden('forbidden: METRICS_TOKEN is not configured\n', content_type='text/plain')
+    elif not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+        return HttpResponseForbidden('forbidden\n', content_type='text/plain')
+    registry.flush(force=True)
+    pids = workers.members()
+    found = cache.get_many([WORKER_KEY.format(pid) for pid in pids])
+    dumps = [found[WORKER_KEY.format(pid)] for pid in sorted(pids) if WORKER_KEY.format(pid) in found]
+    # workers whose key expired stopped flushing
+    workers.discard([pid for pid in pids if WORKER_KEY.format(pid) not in found])
+    return HttpResponse(render_prometheus(dumps), content_type='text/plain; version=0.0.4; charset=utf-8')
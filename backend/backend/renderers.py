@@ -0,0 +1,126 @@
+"""
+orjson-backed JSON renderer and parser for DRF.
+
+``FastJSONRenderer`` / ``FastJSONParser`` are drop-in replacements for DRF's
+``JSONRenderer`` / ``JSONParser`` (configured in ``REST_FRAMEWORK``). The
+output matches DRF's compact, unicode JSON: datetimes, decimals, UUIDs and
+lazy strings still go through DRF's ``JSONEncoder`` (orjson is told to pass
+them through), and U+2028/U+2029 are escaped like DRF does. Floats use
+orjson's shortest round-trip form (``1e-05`` becomes ``1e-5``; same value).
+
+When orjson is not installed, or a request needs something orjson cannot do
+(``indent`` other than 2, ``UNICODE_JSON = False``, a non-strict parser,
+non-UTF-8 bodies), both classes fall back to the stock DRF implementation.
+
+``NDJSONRenderer`` / ``ndjson_response`` serve newline-delimited JSON
+(``application/x-ndjson``) streams with the same encoder.
+"""
+import time
+
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from .async_views import is_asgi_request, iterate_in_thread
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+if orjson is not None:
+    OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SERIALIZE_NUMPY
+               | orjson.OPT_NON_STR_KEYS)
+else:
+    OPTIONS = 0
+
+_encoder = JSONEncoder()
+
+
+def dumps(data, indent=None):
+    """Encode ``data`` to JSON bytes the way ``FastJSONRenderer`` does."""
+    if orjson is None or not api_settings.UNICODE_JSON or indent not in (None, 2):
+        return JSONRenderer().render(data, renderer_context={'indent': indent})
+    option = OPTIONS | (orjson.OPT_INDENT_2 if indent == 2 else 0)
+    ret = orjson.dumps(data, default=_encoder.default, option=option)
+    # same as DRF: keep the output safe to embed in <script> / JS strings
+    if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+        ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+    return ret
+
+
+class FastJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        renderer_context = renderer_context or {}
+        indent = self.get_indent(accepted_media_type, renderer_context)
+        if indent not in (None, 2) or not api_settings.UNICODE_JSON:
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data, indent=indent)
+
+
+class FastJSONParser(JSONParser):
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', 'utf-8')
+        if orjson is None or not self.strict or encoding.lower().replace('_', '-') not in ('utf-8', 'utf8'):
+            return super().parse(stream, media_type, parser_context)
+        try:
+            # orjson rejects NaN / Infinity like DRF's strict parser
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    ``application/x-ndjson``. Views stream their NDJSON bodies themselves
+    (``ndjson_response``); this renderer only lets content negotiation accept
+    the media type and writes plain responses (errors) as a single line.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return dumps(data) + b'\n'
+
+
+def ndjson_response(meta, batches, request=None):
+    """
+    Stream ``{"meta": meta}``, every row of every batch (lists of dicts,
+    produced lazily) and ``{"summary": {returned, elapsed_ms}}``, one JSON
+    document per line. For ASGI requests the body is an async iterator that
+    produces each chunk in a thread (Django would otherwise buffer a sync
+    iterator in full before sending it).
+    """
+    def lines():
+        started = time.perf_counter()
+        yield dumps({'meta': meta}) + b'\n'
+        returned = 0
+        for batch in batches:
+            if batch:
+                yield b''.join(dumps(row) + b'\n' for row in batch)
+                returned += len(batch)
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+        yield dumps({'summary': {'returned': returned, 'elapsed_ms': elapsed_ms}}) + b'\n'
+
+    if request is not None and is_asgi_request(request):
+        content = iterate_in_thread(lines())
+    else:
+        content = lines()
+    response = StreamingHttpResponse(content, content_type=NDJSONRenderer.media_type)
+    # let nginx pass the lines on as they come instead of buffering the body
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
@@ -78,6 +78,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    # 请求耗时统计（Server-Timing 头 + /api/metrics/）
+    "backend.instrumentation.TimingMiddleware",
 ]
 
 ROOT_URLCONF = "backend.urls"
@@ -145,7 +147,17 @@ REST_FRAMEWORK = {
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.AllowAny',  # ⭐ 允许未认证用户访问
-    )
+    ),
+    # ⭐ orjson 编解码（未安装 orjson 时自动回退到 DRF 默认实现）
+    'DEFAULT_RENDERER_CLASSES': (
+        'backend.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'backend.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
 }
 
 # ⭐ CORS 配置 - 根据环境自动选择
@@ -251,6 +263,65 @@ else:
     }
 
 
+# ⭐ 推荐接口配置
+# top_k 默认/上限；cursor 缓存的排名深度与有效期（秒）
+RECOMMEND_DEFAULT_TOP_K = int(os.getenv('RECOMMEND_DEFAULT_TOP_K', '20'))
+RECOMMEND_MAX_TOP_K = int(os.getenv('RECOMMEND_MAX_TOP_K', '500'))
+RECOMMEND_CURSOR_DEPTH = int(os.getenv('RECOMMEND_CURSOR_DEPTH', '200'))
+RECOMMEND_CURSOR_TTL = int(os.getenv('RECOMMEND_CURSOR_TTL', '600'))
+# 空间索引网格大小（度），用于 max_distance_km / nearest_n 查询
+GEO_GRID_CELL_DEG = float(os.getenv('GEO_GRID_CELL_DEG', '0.5'))
+# 医院特征存储：快照写入一个内存映射文件，同一主机的 worker 共享数值列，
+# 冷启动的 worker 直接映射文件，无需全表查询（按表版本号识别，原子替换）
+FEATURE_STORE_ENABLED = os.getenv('FEATURE_STORE_ENABLED', 'True').lower() in ('1', 'true', 'yes')
+FEATURE_STORE_FILE = os.getenv('FEATURE_STORE_FILE', str(BASE_DIR / 'var' / 'hospital_features.bin'))
+# 地区中心点最近医院索引：只有 region、没有坐标的推荐请求按到地区中心点的距离评分；
+# python manage.py build_region_index 生成/增量刷新（容器启动时执行），医院坐标变化后自动增量刷新
+RECOMMEND_REGION_DISTANCE = os.getenv('RECOMMEND_REGION_DISTANCE', 'True').lower() in ('1', 'true', 'yes')
+REGION_NEAREST_FILE = os.getenv('REGION_NEAREST_FILE', str(BASE_DIR / 'var' / 'region_nearest.bin'))
+REGION_NEAREST_K = int(os.getenv('REGION_NEAREST_K', '1000'))
+REGION_NEAREST_AUTO_REFRESH = os.getenv('REGION_NEAREST_AUTO_REFRESH', 'True').lower() in ('1', 'true', 'yes')
+# 评分权重配置（后台“评分权重配置”）修改后各 worker 热加载：每个 worker 最多每隔
+# SCORING_PROFILES_RELOAD_SECONDS 秒检查一次缓存中的版本号
+SCORING_PROFILES_RELOAD_SECONDS = float(os.getenv('SCORING_PROFILES_RELOAD_SECONDS', '5'))
+# 缓存（Redis）不可用时无法得知医院表版本号，各 worker 的医院快照最多沿用
+# HOSPITAL_SNAPSHOT_OUTAGE_TTL 秒后从数据库重建
+HOSPITAL_SNAPSHOT_OUTAGE_TTL = float(os.getenv('HOSPITAL_SNAPSHOT_OUTAGE_TTL', '5'))
+# 推荐结果缓存：有效期（秒）、坐标量化网格（度，0 表示不量化）、进程内 LRU 容量
+RECOMMEND_CACHE_ENABLED = os.getenv('RECOMMEND_CACHE_ENABLED', 'True').lower() in ('1', 'true', 'yes')
+RECOMMEND_CACHE_TTL = int(os.getenv('RECOMMEND_CACHE_TTL', '300'))
+RECOMMEND_CACHE_GRID_DEG = float(os.getenv('RECOMMEND_CACHE_GRID_DEG', '0.01'))
+RECOMMEND_CACHE_LOCAL_SIZE = int(os.getenv('RECOMMEND_CACHE_LOCAL_SIZE', '256'))
+# 预计算推荐：python manage.py precompute_recommendations 按历史记录中最常见的
+# (地区, 疾病, 紧急程度, 经济水平) 组合预先排名并写入缓存（有效期秒），医院或权重变化前直接返回
+RECOMMEND_PRECOMPUTE_ENABLED = os.getenv('RECOMMEND_PRECOMPUTE_ENABLED', 'True').lower() in ('1', 'true', 'yes')
+RECOMMEND_PRECOMPUTE_TTL = int(os.getenv('RECOMMEND_PRECOMPUTE_TTL', '604800'))
+# 大候选集并行评分：每个 worker 的评分进程数（0 表示关闭，全部在请求线程内评分），
+# 候选医院数达到 RECOMMEND_PARALLEL_MIN_CANDIDATES 才使用进程池
+RECOMMEND_PARALLEL_WORKERS = int(os.getenv('RECOMMEND_PARALLEL_WORKERS', '0'))
+RECOMMEND_PARALLEL_MIN_CANDIDATES = int(os.getenv('RECOMMEND_PARALLEL_MIN_CANDIDATES', '50000'))
+# 推荐历史的 result 以紧凑格式存储（只存医院 id/评分，读取时从医院快照还原）；
+# 已有数据用 python manage.py compact_history 转换
+HISTORY_COMPACT_RESULTS = os.getenv('HISTORY_COMPACT_RESULTS', 'False').lower() in ('1', 'true', 'yes')
+
+# ⭐ 头像处理配置
+# 上传头像在事务提交后由每个 worker 内的线程池处理（AVATAR_ASYNC=False 时在请求内同步处理）；
+# 按 AVATAR_SIZES 生成 JPEG + WebP，文件名为内容哈希；超过大小/像素上限的上传直接拒绝
+AVATAR_ASYNC = os.getenv('AVATAR_ASYNC', 'True').lower() in ('1', 'true', 'yes')
+AVATAR_WORKERS = int(os.getenv('AVATAR_WORKERS', '2'))
+AVATAR_SIZES = tuple(int(s) for s in os.getenv('AVATAR_SIZES', '300,96').split(',') if s.strip())
+AVATAR_MAX_UPLOAD_BYTES = int(os.getenv('AVATAR_MAX_UPLOAD_BYTES', str(10 * 1024 * 1024)))
+AVATAR_MAX_PIXELS = int(os.getenv('AVATAR_MAX_PIXELS', '40000000'))
+
+# ⭐ 性能指标配置
+# Server-Timing 响应头；/api/metrics/ (Prometheus) 指标，各 worker 每 METRICS_FLUSH_INTERVAL 秒同步到缓存
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING_ENABLED', 'True').lower() in ('1', 'true', 'yes')
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() in ('1', 'true', 'yes')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+METRICS_WORKER_TTL = int(os.getenv('METRICS_WORKER_TTL', '300'))
+# /api/metrics/ 需要 Authorization: Bearer <METRICS_TOKEN>；生产环境未设置时拒绝访问（403），仅开发环境可免 token
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
 # ⭐ Cookie 配置 - 根据环境自动选择
 if IS_PRODUCTION:
     # 生产环境：安全的 Cookie 设置（如果使用 HTTPS）
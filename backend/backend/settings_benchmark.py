@@ -0,0 +1,22 @@
+"""
+基准测试配置：在 settings.py 基础上改用内存 SQLite 与本地内存缓存，
+不依赖 MySQL / Redis。用法：
+    DJANGO_SETTINGS_MODULE=backend.settings_benchmark python manage.py benchmark_recommend
+"""
+from .settings import *  # noqa: F401,F403
+
+DEBUG = False
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark',
+    }
+}
@@ -4,6 +4,8 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.http import JsonResponse
 
+from .instrumentation import metrics_view
+
 # API 根视图
 def api_root(request):
     return JsonResponse({
@@ -13,6 +15,7 @@ def api_root(request):
             'accounts': '/api/accounts/',
             'hospital': '/api/hospital/',
             'recommend': '/api/recommend/',
+            'metrics': '/api/metrics/',
             'django_admin': '/django-admin/',
         }
     })
@@ -29,6 +32,7 @@ urlpatterns = [
     path('api/accounts/', include('accounts.urls')),
     path('api/hospital/', include('hospital.urls')),
     path('api/recommend/', include('recommend.urls')),
+    path('api/metrics/', metrics_view, name='metrics'),
 ]
 
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -1,8 +1,8 @@
-from django.contrib import admin
-from django.http import HttpResponse
+from django.contrib import admin, messages
 from django.utils.html import format_html
-import csv
-from .models import Hospital
+from backend.exports import ExportFormatError, ExportTable, export_response
+from .importer import EXPORT_FIELDS
+from .models import Hospital, ScoringProfile
 
 
 @admin.register(Hospital)
@@ -15,7 +15,7 @@ class HospitalAdmin(admin.ModelAdmin):
     - list_editable for quick inline edits
     - fieldsets grouping to make editing easier
     - readonly timestamps
-    - CSV export action for selected hospitals
+    - streaming CSV / gzip CSV / Parquet export actions for selected hospitals
     - clickable map link (when coordinates exist)
     """
     list_display = (
@@ -34,7 +34,7 @@ class HospitalAdmin(admin.ModelAdmin):
     list_filter = ('region', 'grade_level', 'specialty')
     search_fields = ('name', 'region', 'specialty', 'contact')
     list_editable = ('grade_level', 'avg_cost')
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('base_score', 'created_at', 'updated_at')
 
     fieldsets = (
         ('Basic information', {
@@ -47,14 +47,15 @@ class HospitalAdmin(admin.ModelAdmin):
             'fields': ('avg_cost', 'bed_count', 'avg_wait_hours'),
         }),
         ('Scores & stats', {
-            'fields': ('grade_level', 'specialty_score', 'equipment_score', 'success_rate', 'reputation_index'),
+            'fields': ('grade_level', 'specialty_score', 'equipment_score', 'success_rate', 'reputation_index',
+                       'base_score'),
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
         }),
     )
 
-    actions = ['export_selected_as_csv']
+    actions = ['export_selected_as_csv', 'export_selected_as_csv_gz', 'export_selected_as_parquet']
 
     def map_link(self, obj):
         """Return a clickable Google Maps link when coordinates are present."""
@@ -64,44 +65,44 @@ class HospitalAdmin(admin.ModelAdmin):
         return format_html('<a href="{}" target="_blank">地图</a>', url)
     map_link.short_description = '地图'
 
+    def _export(self, request, queryset, fmt, compress=False):
+        """
+        Stream the selected hospitals (EXPORT_FIELDS columns, also the
+        import_hospitals input format) as a download.
+        """
+        table = ExportTable(queryset, EXPORT_FIELDS)
+        try:
+            return export_response(table, 'hospitals_export', fmt, compress, request=request)
+        except ExportFormatError as exc:
+            self.message_user(request, str(exc), level=messages.ERROR)
+
     def export_selected_as_csv(self, request, queryset):
         """
         Export selected hospitals to CSV.
         The CSV includes key fields and scoring-related fields so it can be used for offline analysis.
         """
-        fieldnames = [
-            'id', 'name', 'region', 'specialty', 'address', 'contact',
-            'grade_level', 'longitude', 'latitude', 'avg_cost', 'bed_count',
-            'specialty_score', 'success_rate', 'avg_wait_hours',
-            'equipment_score', 'reputation_index', 'created_at', 'updated_at'
-        ]
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename=hospitals_export.csv'
-        writer = csv.DictWriter(response, fieldnames=fieldnames)
-        writer.writeheader()
-        for h in queryset:
-            writer.writerow({
-                'id': h.id,
-                'name': h.name,
-                'region': h.region,
-                'specialty': h.specialty,
-                'address': h.address,
-                'contact': h.contact,
-                'grade_level': h.grade_level,
-                'longitude': h.longitude,
-                'latitude': h.latitude,
-                'avg_cost': h.avg_cost,
-                'bed_count': h.bed_count,
-                'specialty_score': h.specialty_score,
-                'success_rate': h.success_rate,
-                'avg_wait_hours': h.avg_wait_hours,
-                'equipment_score': h.equipment_score,
-                'reputation_index': h.reputation_index,
-                'created_at': h.created_at,
-                'updated_at': h.updated_at,
-            })
-        return response
+        return self._export(request, queryset, 'csv')
     export_selected_as_csv.short_description = "导出所选医院为 CSV"
 
+    def export_selected_as_csv_gz(self, request, queryset):
+        return self._export(request, queryset, 'csv', compress=True)
+    export_selected_as_csv_gz.short_description = "导出所选医院为 CSV（gzip 压缩）"
+
+    def export_selected_as_parquet(self, request, queryset):
+        return self._export(request, queryset, 'parquet')
+    export_selected_as_parquet.short_description = "导出所选医院为 Parquet"
+
     # Make sure the map_link column is safe for sorting/filters even if it's computed.
-    map_link.admin_order_field = 'latitude'
\ No newline at end of file
+    map_link.admin_order_field = 'latitude'
+
+@admin.register(ScoringProfile)
+class ScoringProfileAdmin(admin.ModelAdmin):
+    """
+    Scoring weight profiles (see hospital.weights):
+    - overrides of DEFAULT_WEIGHTS per urgency and/or region code
+    - saved changes reach every worker within SCORING_PROFILES_RELOAD_SECONDS, no restart
+    """
+    list_display = ('name', 'urgency', 'region_code', 'weights', 'is_active', 'updated_at')
+    list_filter = ('is_active', 'urgency')
+    search_fields = ('name', 'region_code')
+    readonly_fields = ('updated_at',)
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class HospitalConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "hospital"
+
+    def ready(self):
+        from . import signals  # noqa: F401  (connect snapshot invalidation)
+        from backend.instrumentation import registry
+        from .result_cache import cache_metrics
+        registry.add_collector(cache_metrics)
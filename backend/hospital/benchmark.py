@@ -0,0 +1,213 @@
+"""
+Synthetic data and measurement helpers for the ``benchmark_recommend`` command.
+
+``synthetic_hospitals`` builds unsaved ``Hospital`` rows with a realistic shape:
+hospitals cluster around real city centres, specialties are drawn with a
+skewed (Zipf-like) popularity, grades/costs/bed counts follow rough national
+proportions and a few rows miss coordinates or optional numbers.
+``payload_mix`` draws recommend payloads over the same vocabulary
+(disease names, ICD codes, urgency, paging, spatial limits).
+Both are deterministic for a given seed so runs can be compared.
+"""
+import math
+import random
+import time
+import tracemalloc
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .models import Hospital
+from .utils import compute_hospital_base_score, weights_fingerprint
+
+# (province/city region, latitude, longitude, relative weight)
+CITIES = (
+    ('北京市/北京市', 39.904, 116.407, 10),
+    ('上海市/上海市', 31.230, 121.474, 10),
+    ('广东省/广州市', 23.129, 113.264, 8),
+    ('广东省/深圳市', 22.543, 114.058, 7),
+    ('四川省/成都市', 30.573, 104.066, 7),
+    ('浙江省/杭州市', 30.274, 120.155, 6),
+    ('湖北省/武汉市', 30.593, 114.305, 6),
+    ('陕西省/西安市', 34.341, 108.940, 5),
+    ('江苏省/南京市', 32.060, 118.797, 5),
+    ('重庆市/重庆市', 29.563, 106.551, 5),
+    ('天津市/天津市', 39.343, 117.362, 4),
+    ('湖南省/长沙市', 28.228, 112.939, 4),
+    ('河南省/郑州市', 34.747, 113.625, 4),
+    ('辽宁省/沈阳市', 41.806, 123.432, 3),
+    ('山东省/济南市', 36.651, 117.120, 3),
+    ('云南省/昆明市', 25.038, 102.718, 2),
+    ('黑龙江省/哈尔滨市', 45.803, 126.535, 2),
+    ('新疆维吾尔自治区/乌鲁木齐市', 43.825, 87.617, 1),
+    ('西藏自治区/拉萨市', 29.650, 91.100, 1),
+)
+DISTRICTS = ('城区', '新区', '开发区', '高新区', '郊区')
+
+# ordered by popularity (index i drawn with weight 1 / (i + 1))
+SPECIALTIES = (
+    '心血管内科', '呼吸内科', '骨科', '消化内科', '肿瘤科', '儿科', '神经内科',
+    '妇产科', '内分泌科', '泌尿外科', '眼科', '耳鼻喉科', '皮肤科', '急诊科',
+    '肾内科', '血液科', '感染科', '精神心理科', '风湿免疫科', '创伤外科',
+)
+ICD_CODES = ('I10', 'I21', 'J18', 'J45', 'C34', 'C50', 'K29', 'M16', 'S72', 'N18',
+             'E11', 'G40', 'F32', 'H25', 'O80', 'A15', 'D50', 'L40', 'P07', 'T14')
+GRADES = ((3, 20), (2, 35), (1, 30), (0, 15))
+URGENCIES = ('emergency', 'urgent', 'routine', '')
+
+_SPECIALTY_WEIGHTS = [1.0 / (i + 1) for i in range(len(SPECIALTIES))]
+
+
+def _weighted(rnd, pairs):
+    values, weights = zip(*pairs)
+    return rnd.choices(values, weights=weights)[0]
+
+
+def _city(rnd):
+    return rnd.choices(CITIES, weights=[c[3] for c in CITIES])[0]
+
+
+def synthetic_hospitals(n, seed=0):
+    """``n`` unsaved hospitals with ``base_score`` and the region codes already filled in."""
+    rnd = random.Random(seed)
+    fingerprint = weights_fingerprint()
+    hospitals = []
+    for i in range(n):
+        region, lat, lng, _ = _city(rnd)
+        grade = _weighted(rnd, GRADES)
+        terms = set(rnd.choices(SPECIALTIES, weights=_SPECIALTY_WEIGHTS, k=rnd.randint(1, 4)))
+        has_coords = rnd.random() > 0.05
+        h = Hospital(
+            name=f'合成医院{i:06d}',
+            region=f'{region}/{rnd.choice(DISTRICTS)}',
+            specialty=','.join(sorted(terms)),
+            address=f'{region}某路{rnd.randint(1, 999)}号',
+            contact=f'0{rnd.randint(10, 999)}-{rnd.randint(1000000, 9999999)}',
+            grade_level=grade,
+            # most hospitals sit within ~30 km of the city centre
+            latitude=lat + rnd.gauss(0, 0.25) if has_coords else None,
+            longitude=lng + rnd.gauss(0, 0.3) if has_coords else None,
+            avg_cost=round(rnd.lognormvariate(7.5 + 0.3 * grade, 0.6), 2) if rnd.random() > 0.1 else None,
+            bed_count=int(rnd.lognormvariate(5 + 0.5 * grade, 0.5)) if rnd.random() > 0.1 else None,
+            specialty_score=round(min(100.0, max(0.0, rnd.gauss(50 + 8 * grade, 12))), 2),
+            equipment_score=round(min(100.0, max(0.0, rnd.gauss(45 + 10 * grade, 12))), 2),
+            reputation_index=round(min(100.0, max(0.0, rnd.gauss(45 + 10 * grade, 15))), 2),
+            success_rate=round(min(0.99, max(0.3, rnd.gauss(0.75 + 0.05 * grade, 0.08))), 3),
+            avg_wait_hours=round(rnd.expovariate(1 / (2 + 3 * grade)), 2) if rnd.random() > 0.1 else None,
+        )
+        h.base_score = compute_hospital_base_score(h)
+        h.base_score_weights = fingerprint
+        h.refresh_region_codes()
+        hospitals.append(h)
+    return hospitals
+
+
+def payload_mix(n, seed=0, paged=True):
+    """``n`` recommend payloads over the synthetic vocabulary."""
+    rnd = random.Random(seed)
+    payloads = []
+    for _ in range(n):
+        p = {}
+        r = rnd.random()
+        if r < 0.6:
+            p['disease_name'] = rnd.choices(SPECIALTIES, weights=_SPECIALTY_WEIGHTS)[0][:2]
+        elif r < 0.85:
+            p['disease_code'] = rnd.choice(ICD_CODES)
+        urgency = rnd.choice(URGENCIES)
+        if urgency:
+            p['urgency'] = urgency
+        if rnd.random() < 0.7:
+            p['economic_level'] = rnd.choice((0, 1, 2))
+        if rnd.random() < 0.5:
+            p['age'] = rnd.randint(1, 90)
+        region, lat, lng, _ = _city(rnd)
+        if rnd.random() < 0.7:
+            p['user_lat'] = round(lat + rnd.gauss(0, 0.1), 5)
+            p['user_lng'] = round(lng + rnd.gauss(0, 0.1), 5)
+            s = rnd.random()
+            if s < 0.2:
+                p['max_distance_km'] = rnd.choice((10, 30, 100))
+            elif s < 0.3:
+                p['nearest_n'] = rnd.choice((20, 50, 200))
+        elif rnd.random() < 0.5:
+            p['region'] = region.split('/')[0]
+        if rnd.random() < 0.1 and ('disease_name' in p or 'disease_code' in p):
+            p['specialty_only'] = True
+        if paged and rnd.random() < 0.8:
+            p['top_k'] = rnd.choice((10, 20, 50))
+        payloads.append(p)
+    return payloads
+
+
+def percentile(sorted_values, q):
+    """Linear-interpolated percentile ``q`` (0-100) of an ascending list."""
+    if not sorted_values:
+        return None
+    pos = (len(sorted_values) - 1) * q / 100.0
+    lo = math.floor(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def measure(call, payloads, profile_every=10, budget_s=None, max_profiled=20):
+    """
+    Run ``call(payload)`` for every payload and summarize.
+
+    With ``budget_s`` the run stops issuing payloads once that many seconds
+    have passed (unpaged requests on 100k rows take seconds each); the
+    summary then covers the payloads actually sent.
+
+    Latencies come from plain timed calls; every ``profile_every``-th call (at
+    most ``max_profiled``) is repeated under ``tracemalloc`` and
+    ``CaptureQueriesContext`` (which would distort the timings) to sample peak
+    memory and SQL query counts.
+    """
+    latencies = []
+    statuses = {}
+    started = time.perf_counter()
+    sent = []
+    for payload in payloads:
+        t0 = time.perf_counter()
+        status = call(payload)
+        latencies.append(time.perf_counter() - t0)
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        sent.append(payload)
+        if budget_s is not None and time.perf_counter() - started >= budget_s:
+            break
+    elapsed = time.perf_counter() - started
+
+    queries, peaks = [], []
+    for payload in sent[::max(1, profile_every)][:max_profiled]:
+        tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as ctx:
+                call(payload)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+        queries.append(len(ctx.captured_queries))
+
+    latencies.sort()
+    ms = [v * 1000.0 for v in latencies]
+    return {
+        'requests': len(sent),
+        'elapsed_s': round(elapsed, 4),
+        'throughput_rps': round(len(sent) / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'mean': round(sum(ms) / len(ms), 3) if ms else None,
+            'p50': round(percentile(ms, 50), 3) if ms else None,
+            'p90': round(percentile(ms, 90), 3) if ms else None,
+            'p95': round(percentile(ms, 95), 3) if ms else None,
+            'p99': round(percentile(ms, 99), 3) if ms else None,
+            'max': round(ms[-1], 3) if ms else None,
+        },
+        'queries': {
+            'mean': round(sum(queries) / len(queries), 2) if queries else None,
+            'max': max(queries) if queries else None,
+        },
+        'peak_memory_kb': {
+            'mean': round(sum(peaks) / len(peaks) / 1024.0, 1) if peaks else None,
+            'max': round(max(peaks) / 1024.0, 1) if peaks else None,
+        },
+        'status': statuses,
+    }
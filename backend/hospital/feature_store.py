@@ -0,0 +1,151 @@
+"""
+Memory-mapped hospital feature store shared by the workers of one host.
+
+Every gunicorn worker keeps a ``HospitalSnapshot``. Building one meant a
+full-table query per worker and table version, and every worker held its own
+copy of the scoring columns. Snapshots are now also written to one flat file
+(``FEATURE_STORE_FILE``, layout in ``hospital.flatfile``) tagged with the table
+version they were built for, its generation:
+
+  - the first worker that needs a version takes the file lock, builds the
+    snapshot from the database and writes the store; workers waiting on the
+    lock then find the store at their version and map it instead of querying
+  - ids, the numeric scoring columns and the base scores are views into the
+    mapping, shared through the page cache however many workers there are;
+    text columns are dictionary-encoded (row codes + distinct values in one
+    UTF-8 blob), so a worker decodes and interns each distinct string once;
+    datetimes stay epoch microseconds in the mapping and are converted when
+    a row is read (``DatetimeColumn``)
+  - a worker started while the store matches the current version serves its
+    first request without a query on the hospital table
+
+A new generation replaces the file with ``os.replace``; a snapshot of an older
+generation keeps its mapping of the old file until it is dropped.
+"""
+import datetime
+import logging
+import sys
+import time
+from collections.abc import Sequence
+
+import numpy as np
+from django.conf import settings
+
+from . import flatfile
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'YXBHFS01'
+# datetime NULL
+_NAT = np.iinfo(np.int64).min
+_EPOCH_AWARE = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_EPOCH_NAIVE = datetime.datetime(1970, 1, 1)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def store_enabled():
+    return getattr(settings, 'FEATURE_STORE_ENABLED', True)
+
+
+def store_path():
+    return str(getattr(settings, 'FEATURE_STORE_FILE', settings.BASE_DIR / 'var' / 'hospital_features.bin'))
+
+
+def _encode_text(values):
+    """(row codes, character offsets of the distinct values, their UTF-8 blob)."""
+    index = {}
+    codes = np.fromiter((index.setdefault(v, len(index)) for v in values), dtype=np.int32, count=len(values))
+    distinct = list(index)
+    # offsets count characters, so decoding is one bytes.decode() plus slicing
+    offsets = np.zeros(len(distinct) + 1, dtype=np.int64)
+    np.cumsum([len(v) for v in distinct], out=offsets[1:])
+    return codes, offsets, np.frombuffer(''.join(distinct).encode('utf-8'), dtype=np.uint8)
+
+
+def _decode_text(codes, offsets, blob):
+    """Interned strings of a dictionary-encoded column."""
+    text = blob.tobytes().decode('utf-8')
+    bounds = offsets.tolist()
+    distinct = [sys.intern(text[start:end]) for start, end in zip(bounds, bounds[1:])]
+    return list(map(distinct.__getitem__, codes.tolist()))
+
+
+class DatetimeColumn(Sequence):
+    """Datetimes (UTC when ``aware``) of an epoch-microsecond array, converted on access."""
+
+    def __init__(self, values, aware):
+        self.values = values
+        self.aware = aware
+        self._epoch = _EPOCH_AWARE if aware else _EPOCH_NAIVE
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        v = int(self.values[i])
+        return None if v == _NAT else self._epoch + datetime.timedelta(microseconds=v)
+
+
+def _encode_datetimes(values):
+    if isinstance(values, DatetimeColumn):
+        return values.aware, values.values
+    aware = any(v is not None and v.tzinfo is not None for v in values)
+    epoch = _EPOCH_AWARE if aware else _EPOCH_NAIVE
+    return aware, np.array([_NAT if v is None else (v - epoch) // _MICROSECOND for v in values], dtype=np.int64)
+
+
+def write_store(path, generation, field_names, columns):
+    """
+    Write a store of ``generation`` (not None) to ``path`` (atomically). ``columns``:
+    {field: (kind, values)}; 'int' / 'float' values are arrays (NaN for NULL
+    floats), 'text' lists of str, 'datetime' lists of datetimes.
+    """
+    if generation is None:
+        raise ValueError('a feature store needs a generation')
+    arrays, kinds, aware = {}, {}, {}
+    for name, (kind, values) in columns.items():
+        kinds[name] = kind
+        if kind == 'text':
+            arrays[f'{name}.codes'], arrays[f'{name}.offsets'], arrays[f'{name}.text'] = _encode_text(values)
+        elif kind == 'datetime':
+            aware[name], arrays[name] = _encode_datetimes(values)
+        else:
+            arrays[name] = np.asarray(values, dtype=np.int64 if kind == 'int' else np.float64)
+    flatfile.write(path, MAGIC, arrays, {
+        'generation': generation,
+        'fields': list(field_names),
+        'kinds': kinds,
+        'aware': aware,
+        'built_at': time.time(),
+    })
+
+
+def read_store(path, generation, field_names):
+    """
+    {field: column} of the store at ``path`` when it holds ``generation`` (not None) of
+    the same fields, else None. Numeric columns are read-only views into the
+    mapping, text columns lists of interned strings, datetime columns
+    ``DatetimeColumn``.
+    """
+    try:
+        store = flatfile.FlatFile(path, MAGIC)
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError, TypeError) as exc:
+        logger.warning('ignoring hospital feature store %s: %s', path, exc)
+        return None
+    meta = store.meta
+    if generation is None or meta.get('generation') != generation or meta.get('fields') != list(field_names):
+        return None
+    data = {}
+    for name, kind in meta['kinds'].items():
+        if kind == 'text':
+            arrays = store.arrays
+            data[name] = _decode_text(arrays[f'{name}.codes'], arrays[f'{name}.offsets'], arrays[f'{name}.text'])
+        elif kind == 'datetime':
+            data[name] = DatetimeColumn(store.arrays[name], meta['aware'][name])
+        else:
+            data[name] = store.arrays[name]
+    return data
@@ -0,0 +1,109 @@
+"""
+Flat binary files of named NumPy arrays, memory-mapped read-only.
+
+Layout: an 8-byte magic, the length of a JSON header, the header (caller
+metadata plus offset / dtype / shape of every array), then the arrays, each
+aligned to ``ALIGN`` bytes. ``FlatFile`` maps the file once and exposes every
+array as a view into that mapping: nothing is copied or parsed, and the pages
+are shared by every process mapping the same file.
+
+``write`` builds the file under a temporary name and swaps it in with
+``os.replace``: a reader holds either the old or the new file, never a partial
+one, and keeps its old mapping valid until it lets go of it. ``file_lock``
+serializes the writers of one file across processes.
+"""
+import json
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # not on POSIX: writers are only serialized within a process
+    fcntl = None
+
+ALIGN = 64
+MAGIC_SIZE = 8
+_HEADER_LEN = struct.Struct('<Q')
+
+
+def _aligned(size):
+    return -(-size // ALIGN) * ALIGN
+
+
+class FlatFile:
+    """``path`` mapped read-only: ``meta`` (the caller's header values) and ``arrays`` (name -> view)."""
+
+    def __init__(self, path, magic):
+        self.path = path
+        self._map = np.memmap(path, dtype=np.uint8, mode='r')
+        if bytes(self._map[:MAGIC_SIZE]) != magic:
+            raise ValueError(f'{path} is not a {magic.decode()} file')
+        start = MAGIC_SIZE + _HEADER_LEN.size
+        (length,) = _HEADER_LEN.unpack(bytes(self._map[MAGIC_SIZE:start]))
+        header = json.loads(bytes(self._map[start:start + length]).decode('utf-8'))
+        self.arrays = {
+            name: np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=self._map, offset=offset)
+            for name, (offset, dtype, shape) in header.pop('arrays').items()
+        }
+        self.meta = header
+
+
+def write(path, magic, arrays, meta):
+    """Write ``arrays`` (name -> ndarray) and ``meta`` (JSON-able dict) to ``path`` atomically."""
+    assert len(magic) == MAGIC_SIZE
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    header = dict(meta, arrays={})
+    start = 0
+    while True:
+        # the header lists the array offsets, which start after the header
+        offset = start
+        for name, array in arrays.items():
+            header['arrays'][name] = [offset, array.dtype.str, list(array.shape)]
+            offset += _aligned(array.nbytes)
+        encoded = json.dumps(header).encode('utf-8')
+        size = MAGIC_SIZE + _HEADER_LEN.size + len(encoded)
+        if size <= start:
+            break
+        start = _aligned(size)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(tmp, 'wb') as fh:
+            fh.write(magic + _HEADER_LEN.pack(len(encoded)) + encoded)
+            for name, array in arrays.items():
+                fh.seek(header['arrays'][name][0])
+                fh.write(array.tobytes())
+            fh.truncate(offset)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock on ``<path>.lock``, across threads and processes."""
+    with _locks_guard:
+        local = _locks.setdefault(path, threading.Lock())
+    with local:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(f'{path}.lock', 'a') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
@@ -0,0 +1,255 @@
+"""
+Bulk hospital import (``manage.py import_hospitals`` and ``POST /api/hospital/import/``).
+
+Input uses the columns of ``HospitalAdmin.export_selected_as_csv``
+(``EXPORT_FIELDS``) as CSV, JSON Lines or Excel (.xlsx, needs openpyxl); an
+exported file can be edited and imported back. ``id``, ``created_at`` and
+``updated_at`` are ignored, hospitals are matched on their unique ``name``.
+
+Rows are read lazily and handled in batches:
+
+  - each row is validated with the ``HospitalSerializer`` field rules (minus
+    the unique check on ``name``, which the upsert replaces); invalid rows are
+    reported with their line number and skipped
+  - columns missing from a row (JSON Lines may carry only a few) keep their
+    stored value on existing hospitals and the model default on new ones;
+    ``base_score`` and the region codes are then computed like ``Hospital.save()`` would
+  - the batch is written with one ``bulk_create(update_conflicts=True)``
+    (INSERT ... ON CONFLICT / ON DUPLICATE KEY UPDATE) in its own transaction
+
+bulk_create sends no signals, so the snapshot version is bumped (and the
+region centroid lists refreshed, see ``hospital.region_index``) once at the end.
+"""
+import csv
+import io
+import json
+import os
+
+from django.db import DatabaseError, connection, transaction
+
+from .models import Hospital
+from .region_index import schedule_refresh
+from .regions import CODE_FIELDS
+from .serializers import HospitalSerializer
+from .snapshot import bump_snapshot_version
+from .utils import compute_hospital_base_score, weights_fingerprint
+
+# column order of HospitalAdmin.export_selected_as_csv
+EXPORT_FIELDS = (
+    'id', 'name', 'region', 'specialty', 'address', 'contact',
+    'grade_level', 'longitude', 'latitude', 'avg_cost', 'bed_count',
+    'specialty_score', 'success_rate', 'avg_wait_hours',
+    'equipment_score', 'reputation_index', 'created_at', 'updated_at',
+)
+# exported columns that are not imported
+IGNORED_FIELDS = ('id', 'created_at', 'updated_at')
+IMPORT_FIELDS = tuple(f for f in EXPORT_FIELDS if f not in IGNORED_FIELDS)
+TEXT_FIELDS = ('name', 'region', 'specialty', 'address', 'contact')
+
+FORMATS = ('csv', 'jsonl', 'xlsx')
+EXTENSIONS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.xlsx': 'xlsx'}
+
+# per-row errors kept in a report (the counters still cover every row)
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportFormatError(ValueError):
+    """The input cannot be read as the requested format."""
+
+
+class HospitalImportSerializer(HospitalSerializer):
+    """HospitalSerializer rules for the imported columns; ``name`` may already exist (upsert)."""
+
+    class Meta(HospitalSerializer.Meta):
+        fields = list(IMPORT_FIELDS)
+        extra_kwargs = {'name': {'validators': []}}
+
+
+def detect_format(filename, default='csv'):
+    """Input format from a file name's extension."""
+    return EXTENSIONS.get(os.path.splitext(filename or '')[1].lower(), default)
+
+
+def _read_csv(fh):
+    reader = csv.DictReader(io.TextIOWrapper(fh, encoding='utf-8-sig', newline=''))
+    # line numbers count the header as line 1
+    for line, row in enumerate(reader, start=2):
+        yield line, row
+
+
+def _read_jsonl(fh):
+    for line, raw in enumerate(io.TextIOWrapper(fh, encoding='utf-8-sig'), start=1):
+        if not raw.strip():
+            continue
+        try:
+            row = json.loads(raw)
+        except ValueError as exc:
+            yield line, ImportFormatError(f'invalid JSON: {exc}')
+            continue
+        if not isinstance(row, dict):
+            yield line, ImportFormatError('each line must be a JSON object')
+            continue
+        yield line, row
+
+
+def _read_xlsx(fh):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportFormatError('Excel import requires openpyxl (pip install openpyxl)')
+    try:
+        workbook = load_workbook(fh, read_only=True, data_only=True)
+    except Exception as exc:
+        raise ImportFormatError(f'cannot read the Excel file: {exc}')
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [str(h).strip() if h is not None else '' for h in header]
+        for line, values in enumerate(rows, start=2):
+            if all(v is None for v in values):
+                continue
+            yield line, dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+READERS = {'csv': _read_csv, 'jsonl': _read_jsonl, 'xlsx': _read_xlsx}
+
+
+def read_rows(fh, fmt):
+    """Yield (line number, row dict or ImportFormatError) from a file opened in binary mode."""
+    if fmt not in READERS:
+        raise ImportFormatError(f'unsupported format: {fmt} (expected one of {", ".join(FORMATS)})')
+    return READERS[fmt](fh)
+
+
+def _clean(row):
+    """Imported columns of ``row``: blank text stays '', other blanks become None."""
+    data = {}
+    for name in IMPORT_FIELDS:
+        if name not in row:
+            continue
+        value = row[name]
+        if isinstance(value, str):
+            value = value.strip()
+        if name in TEXT_FIELDS:
+            data[name] = '' if value is None else str(value)
+        else:
+            data[name] = None if value == '' else value
+    return data
+
+
+class ImportReport:
+    """Counters and per-row errors of one import."""
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.batches = 0
+        self.errors = []
+
+    def add_error(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.failed,
+            'batches': self.batches,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+def _merge(batch, fingerprint):
+    """
+    Hospitals to write for ``batch`` (name -> validated columns) and the number
+    of names that already exist. Columns missing from a row keep the stored
+    value, so ``base_score`` is computed on the merged row.
+    """
+    current = {h.name: h for h in Hospital.objects.filter(name__in=list(batch)).only(*IMPORT_FIELDS)}
+    hospitals = []
+    for name, data in batch.items():
+        stored = current.get(name)
+        values = {f: getattr(stored, f) for f in IMPORT_FIELDS} if stored is not None else {}
+        values.update(data)
+        hospital = Hospital(**values)
+        hospital.base_score = compute_hospital_base_score(hospital)
+        hospital.base_score_weights = fingerprint
+        hospital.refresh_region_codes()
+        hospitals.append(hospital)
+    return hospitals, len(current)
+
+
+def _upsert(hospitals):
+    """One INSERT ... ON CONFLICT / ON DUPLICATE KEY UPDATE for ``hospitals``."""
+    update_fields = [f for f in IMPORT_FIELDS if f != 'name']
+    update_fields += ['base_score', 'base_score_weights', *CODE_FIELDS, 'updated_at']
+    options = {'update_conflicts': True, 'update_fields': update_fields}
+    if connection.features.supports_update_conflicts_with_target:
+        options['unique_fields'] = ['name']
+    Hospital.objects.bulk_create(hospitals, **options)
+
+
+def import_hospitals(rows, batch_size=500, dry_run=False, progress=None):
+    """
+    Validate and upsert ``rows`` ((line, dict) pairs, see ``read_rows``).
+    ``progress(report)`` is called after every batch. Returns an ImportReport.
+    """
+    report = ImportReport()
+    fingerprint = weights_fingerprint()
+    batch, lines = {}, []
+
+    def flush():
+        if not batch:
+            return
+        if dry_run:
+            existing = Hospital.objects.filter(name__in=list(batch)).count()
+            created, updated = len(batch) - existing, existing
+        else:
+            try:
+                with transaction.atomic():
+                    hospitals, existing = _merge(batch, fingerprint)
+                    _upsert(hospitals)
+                created, updated = len(batch) - existing, existing
+            except DatabaseError as exc:
+                for line in lines:
+                    report.add_error(line, {'non_field_errors': [f'database error: {exc}']})
+                created = updated = 0
+        report.created += created
+        report.updated += updated
+        report.batches += 1
+        batch.clear()
+        lines.clear()
+        if progress is not None:
+            progress(report)
+
+    for line, row in rows:
+        report.rows += 1
+        if isinstance(row, ImportFormatError):
+            report.add_error(line, {'non_field_errors': [str(row)]})
+            continue
+        serializer = HospitalImportSerializer(data=_clean(row))
+        if not serializer.is_valid():
+            report.add_error(line, {k: [str(e) for e in v] for k, v in serializer.errors.items()})
+            continue
+        data = serializer.validated_data
+        # a name repeated inside one batch: later columns win, as they would row by row
+        batch.setdefault(data['name'], {}).update(data)
+        lines.append(line)
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+
+    if not dry_run and report.created + report.updated:
+        bump_snapshot_version()
+        schedule_refresh()
+    return report
@@ -0,0 +1,161 @@
+import json
+import os
+import platform
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import django
+import numpy as np
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from hospital.benchmark import measure, payload_mix, synthetic_hospitals
+from hospital.models import Hospital
+from hospital.result_cache import result_cache
+from hospital.snapshot import bump_snapshot_version, get_snapshot
+from hospital.utils import compute_recommendation_score
+
+TARGETS = ('hospital', 'recommend', 'scalar')
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              timeout=5, cwd=settings.BASE_DIR).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the recommend path on synthetic hospital tables. "
+        "Run against an in-memory SQLite database: "
+        "DJANGO_SETTINGS_MODULE=backend.settings_benchmark python manage.py benchmark_recommend"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000',
+                            help='comma separated hospital table sizes')
+        parser.add_argument('--requests', type=int, default=200, help='payloads per size and endpoint')
+        parser.add_argument('--scalar-requests', type=int, default=10,
+                            help='payloads for the per-row compute_recommendation_score loop')
+        parser.add_argument('--targets', default=','.join(TARGETS),
+                            help=f'comma separated subset of {", ".join(TARGETS)}')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--time-budget', type=float, default=60.0,
+                            help='seconds per size and target before the remaining payloads are skipped')
+        parser.add_argument('--profile-every', type=int, default=10,
+                            help='sample memory / query counts on every n-th payload')
+        parser.add_argument('--with-cache', action='store_true',
+                            help='keep the recommend result cache enabled (off by default)')
+        parser.add_argument('--output', help='write the results as JSON to this file')
+        parser.add_argument('--baseline', help='JSON file of an earlier run to compare against')
+        parser.add_argument('--allow-database', action='store_true',
+                            help='run against a database other than in-memory SQLite '
+                                 '(the hospital table is DELETED and refilled)')
+
+    def handle(self, *args, **options):
+        db = connection.settings_dict
+        in_memory = connection.vendor == 'sqlite' and (
+            str(db['NAME']) in (':memory:', '') or 'mode=memory' in str(db['NAME']))
+        if not in_memory and not options['allow_database']:
+            raise CommandError(
+                "benchmark_recommend replaces every Hospital row; use backend.settings_benchmark "
+                "(in-memory SQLite) or pass --allow-database")
+        targets = [t.strip() for t in options['targets'].split(',') if t.strip()]
+        unknown = sorted(set(targets) - set(TARGETS))
+        if unknown:
+            raise CommandError(f"unknown targets: {', '.join(unknown)}")
+        sizes = [int(s) for s in options['sizes'].split(',') if s.strip()]
+
+        if in_memory:
+            call_command('migrate', verbosity=0, interactive=False)
+
+        report = {
+            'meta': {
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'git_commit': _git_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'numpy': np.__version__,
+                'database': connection.vendor,
+                'cpu_count': os.cpu_count(),
+                'seed': options['seed'],
+                'requests': options['requests'],
+                'result_cache': options['with_cache'],
+            },
+            'results': [],
+        }
+        with override_settings(RECOMMEND_CACHE_ENABLED=options['with_cache']):
+            for size in sizes:
+                report['results'].extend(self._run_size(size, targets, options))
+
+        if options['baseline']:
+            self._compare(report, options['baseline'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as fh:
+                json.dump(report, fh, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"wrote {options['output']}"))
+
+    def _run_size(self, size, targets, options):
+        seed = options['seed']
+        t0 = time.perf_counter()
+        Hospital.objects.all().delete()
+        Hospital.objects.bulk_create(synthetic_hospitals(size, seed=seed), batch_size=2000)
+        # bulk_create sends no signals; outside a transaction this bumps immediately
+        bump_snapshot_version()
+        result_cache.clear_local()
+        load_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        snapshot = get_snapshot()
+        snapshot.spatial_index, snapshot.specialty_index  # noqa: B018 (build eagerly)
+        snapshot_s = time.perf_counter() - t0
+        self.stdout.write(f"{size} hospitals: loaded in {load_s:.2f}s, snapshot built in {snapshot_s * 1000:.1f}ms")
+
+        client = APIClient()
+        payloads = payload_mix(options['requests'], seed=seed)
+        calls = {
+            'hospital': lambda p: client.post('/api/hospital/recommend/', p, format='json').status_code,
+            'recommend': lambda p: client.post('/api/recommend/', p, format='json').status_code,
+        }
+        if 'scalar' in targets:
+            hospitals = [snapshot.instance(i) for i in range(len(snapshot))]
+            calls['scalar'] = lambda p: len([compute_recommendation_score(h, p) for h in hospitals])
+
+        results = []
+        for target in targets:
+            batch = payloads[:options['scalar_requests']] if target == 'scalar' else payloads
+            for p in batch[:min(options['warmup'], len(batch))]:
+                calls[target](p)
+            stats = measure(calls[target], batch, profile_every=options['profile_every'],
+                            budget_s=options['time_budget'] or None)
+            entry = {'size': size, 'target': target, 'snapshot_build_ms': round(snapshot_s * 1000, 1), **stats}
+            results.append(entry)
+            lat = stats['latency_ms']
+            self.stdout.write(
+                f"  {target:<10} {stats['throughput_rps']:>9} req/s  p50 {lat['p50']:>9}ms  "
+                f"p95 {lat['p95']:>9}ms  p99 {lat['p99']:>9}ms  queries {stats['queries']['mean']}  "
+                f"peak {stats['peak_memory_kb']['max']}KB  status {stats['status']}")
+        return results
+
+    def _compare(self, report, path):
+        with open(path, encoding='utf-8') as fh:
+            baseline = json.load(fh)
+        before = {(r['size'], r['target']): r for r in baseline.get('results', [])}
+        self.stdout.write(f"compared with {path} ({baseline.get('meta', {}).get('git_commit')}):")
+        for r in report['results']:
+            old = before.get((r['size'], r['target']))
+            if old is None:
+                continue
+            p50, old_p50 = r['latency_ms']['p50'], old['latency_ms']['p50']
+            ratio = old_p50 / p50 if p50 and old_p50 else None
+            self.stdout.write(
+                f"  {r['size']:>7} {r['target']:<10} p50 {old_p50}ms -> {p50}ms"
+                + (f" ({ratio:.2f}x)" if ratio else ""))
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hospital.region_index import index_path, refresh
+from hospital.snapshot import bump_snapshot_version
+
+
+class Command(BaseCommand):
+    help = (
+        "Build or incrementally refresh the nearest-hospital lists of the region centroids "
+        "(used to score region-only recommend requests by distance)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='index file (default: REGION_NEAREST_FILE)')
+        parser.add_argument('--full', action='store_true',
+                            help='rebuild every list, not only the regions whose hospitals changed')
+
+    def handle(self, *args, **options):
+        path = options['path'] or index_path()
+        started = time.perf_counter()
+        try:
+            stats = refresh(path, full=options['full'])
+        except OSError as exc:
+            raise CommandError(f"cannot write {path}: {exc}")
+        if stats['rebuilt']:
+            # cached recommend results were scored with the old lists
+            bump_snapshot_version()
+
+        kind = 'built' if stats['full'] else 'refreshed'
+        self.stdout.write(self.style.SUCCESS(
+            f"{kind} {path}: {stats['regions']} regions, {stats['rebuilt']} lists recomputed, "
+            f"{stats['changed']} hospitals changed ({time.perf_counter() - started:.1f}s)"))
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backend.exports import CHUNK_SIZE, FORMATS, ExportFormatError, ExportTable, detect_format, write_export
+from hospital.importer import EXPORT_FIELDS
+from hospital.models import Hospital
+
+
+class Command(BaseCommand):
+    help = (
+        "Export all hospitals to CSV (optionally gzipped) or Parquet, streaming keyset batches. "
+        "The CSV is the import_hospitals input format."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='output file (.csv, .csv.gz or .parquet)')
+        parser.add_argument('--format', choices=FORMATS, help='output format (default: from the file extension)')
+        parser.add_argument('--gzip', action='store_true', help='gzip the CSV output')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='rows per query')
+
+    def handle(self, *args, **options):
+        fmt, compress = detect_format(options['path'])
+        fmt = options['format'] or fmt
+        compress = fmt == 'csv' and (compress or options['gzip'])
+        table = ExportTable(Hospital.objects.all(), EXPORT_FIELDS, chunk_size=options['chunk_size'])
+
+        started = time.perf_counter()
+        try:
+            written = write_export(table, options['path'], fmt, compress)
+        except ExportFormatError as exc:
+            raise CommandError(str(exc))
+        except OSError as exc:
+            raise CommandError(f"cannot write {options['path']}: {exc}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"exported hospitals to {options['path']} ({written} bytes, "
+            f"{time.perf_counter() - started:.1f}s)"))
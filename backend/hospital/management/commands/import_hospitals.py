@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hospital.importer import FORMATS, ImportFormatError, detect_format, import_hospitals, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Import hospitals from CSV / JSON Lines / Excel in the admin CSV export format, "
+        "upserting on name in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='input file')
+        parser.add_argument('--format', choices=FORMATS, help='input format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='validate only, write nothing')
+        parser.add_argument('--errors', help='write the per-row errors as JSON to this file')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or detect_format(options['path'])
+        dry_run = options['dry_run']
+
+        def progress(report):
+            self.stdout.write(f"  {report.rows} rows read: {report.created} new, {report.updated} updated, "
+                              f"{report.failed} failed")
+
+        try:
+            with open(options['path'], 'rb') as fh:
+                report = import_hospitals(read_rows(fh, fmt), batch_size=options['batch_size'],
+                                          dry_run=dry_run, progress=progress)
+        except OSError as exc:
+            raise CommandError(f"cannot read {options['path']}: {exc}")
+        except ImportFormatError as exc:
+            raise CommandError(str(exc))
+
+        for error in report.errors[:20]:
+            self.stderr.write(f"  line {error['line']}: {json.dumps(error['errors'], ensure_ascii=False)}")
+        if report.failed > 20:
+            self.stderr.write(f"  ... {report.failed - 20} more")
+        if options['errors']:
+            with open(options['errors'], 'w', encoding='utf-8') as fh:
+                json.dump(report.errors, fh, ensure_ascii=False, indent=2)
+
+        verb = 'would import' if dry_run else 'imported'
+        style = self.style.SUCCESS if not report.failed else self.style.WARNING
+        self.stdout.write(style(
+            f"{verb} {report.created + report.updated} hospitals ({report.created} new, {report.updated} updated), "
+            f"{report.failed} rows failed"))
@@ -0,0 +1,60 @@
+import multiprocessing
+import os
+import time
+from collections import Counter
+from functools import partial
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from hospital.precompute import popular_shapes, refresh_entries
+from hospital.recommender import cursor_depth
+from hospital.snapshot import get_snapshot
+from hospital.weights import get_profiles
+
+
+class Command(BaseCommand):
+    help = (
+        "Precompute the rankings of the most frequent recommend payloads in the history "
+        "(served by POST /hospital/recommend/ until hospitals or weights change). "
+        "Incremental: only entries whose inputs changed are rescored."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='history window in days')
+        parser.add_argument('--top', type=int, default=500, help='number of payload shapes to precompute')
+        parser.add_argument('--min-count', type=int, default=2,
+                            help='skip shapes requested fewer times in the window')
+        parser.add_argument('--depth', type=int, default=None,
+                            help='hospitals kept per ranking (default: RECOMMEND_CURSOR_DEPTH)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='scoring processes (1: score in this process)')
+        parser.add_argument('--full', action='store_true', help='rescore every shape, ignoring stored entries')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        shapes = [shape for shape, _ in popular_shapes(options['days'], options['top'], options['min_count'])]
+        if not shapes:
+            self.stdout.write('no payload shapes to precompute')
+            return
+        depth = options['depth'] or cursor_depth()
+        workers = min(options['workers'], len(shapes))
+
+        # loaded once here: forked workers inherit the snapshot and the weight profiles
+        get_snapshot()
+        get_profiles()
+        if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            # workers split the shapes between them, so each ranks its shapes inline
+            work = partial(refresh_entries, depth=depth, full=options['full'], parallel=False)
+            chunks = [shapes[i::workers] for i in range(workers)]
+            # forked children must not share this process's database connections
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(workers) as pool:
+                stats = sum(pool.imap_unordered(work, chunks), Counter())
+        else:
+            workers = 1
+            stats = refresh_entries(shapes, depth=depth, full=options['full'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(shapes)} payload shapes: {stats['computed']} computed, {stats['restamped']} re-stamped, "
+            f"{stats['current']} current ({workers} workers, {time.perf_counter() - started:.1f}s)"))
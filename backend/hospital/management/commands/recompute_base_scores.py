@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from hospital.models import Hospital
+from hospital.snapshot import bump_snapshot_version
+from hospital.utils import compute_hospital_base_score, weights_fingerprint
+
+# Hospital fields read by compute_hospital_base_score
+SCORE_FIELDS = (
+    'id', 'grade_level', 'specialty_score', 'equipment_score', 'reputation_index',
+    'success_rate', 'bed_count', 'avg_wait_hours', 'avg_cost',
+)
+
+
+class Command(BaseCommand):
+    help = "Recompute the persisted Hospital.base_score (run after DEFAULT_WEIGHTS change)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='recompute every row, not only rows scored with other weights')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        fingerprint = weights_fingerprint()
+        batch_size = options['batch_size']
+        qs = Hospital.objects.only(*SCORE_FIELDS).order_by('pk')
+        if not options['all']:
+            qs = qs.filter(~Q(base_score_weights=fingerprint) | Q(base_score__isnull=True))
+
+        updated = 0
+        batch = []
+        with transaction.atomic():
+            for h in qs.iterator(chunk_size=batch_size):
+                h.base_score = compute_hospital_base_score(h)
+                h.base_score_weights = fingerprint
+                batch.append(h)
+                if len(batch) >= batch_size:
+                    Hospital.objects.bulk_update(batch, ['base_score', 'base_score_weights'])
+                    updated += len(batch)
+                    batch = []
+            if batch:
+                Hospital.objects.bulk_update(batch, ['base_score', 'base_score_weights'])
+                updated += len(batch)
+            if updated:
+                # bulk_update sends no post_save: refresh the worker snapshots explicitly
+                bump_snapshot_version()
+
+        self.stdout.write(self.style.SUCCESS(f"recomputed base_score for {updated} hospitals (weights {fingerprint})"))
@@ -0,0 +1,60 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from hospital.models import Hospital
+from hospital.regions import resolve, resolve_query
+from hospital.snapshot import bump_snapshot_version
+
+TARGETS = ('hospitals', 'users')
+
+
+def refresh_hospital_codes():
+    """Re-resolve Hospital province/city/district codes, one UPDATE per distinct region text that changed."""
+    updated = 0
+    for region in Hospital.objects.order_by('region').values_list('region', flat=True).distinct():
+        codes = resolve(region)
+        updated += Hospital.objects.filter(region=region).exclude(
+            province_code=codes.province, city_code=codes.city, district_code=codes.district,
+        ).update(province_code=codes.province, city_code=codes.city, district_code=codes.district)
+    return updated
+
+
+def refresh_user_codes(batch_size=1000):
+    """Re-resolve User.preferred_region_code (same rule as User.refresh_preferred_region_code)."""
+    User = get_user_model()
+    updated = 0
+    rows = User.objects.values_list('pk', 'preferred_region', 'preferred_region_values', 'preferred_region_code')
+    for pk, region, values, current in rows.iterator(chunk_size=batch_size):
+        codes = resolve_query(values or [])
+        if codes is None:
+            codes = resolve(region or '')
+        if codes.code != current:
+            updated += User.objects.filter(pk=pk).update(preferred_region_code=codes.code)
+    return updated
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-resolve the stored region codes of hospitals and users from their region text "
+        "(run after assets/areas.json changes)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='*', help=f"any of {', '.join(TARGETS)} (default: both)")
+
+    def handle(self, *args, **options):
+        targets = options['targets'] or TARGETS
+        unknown = set(targets) - set(TARGETS)
+        if unknown:
+            raise CommandError(f"unknown targets: {', '.join(sorted(unknown))} (choose from {', '.join(TARGETS)})")
+        with transaction.atomic():
+            if 'hospitals' in targets:
+                hospitals = refresh_hospital_codes()
+                if hospitals:
+                    # queryset.update sends no post_save: refresh the worker snapshots explicitly
+                    bump_snapshot_version()
+                self.stdout.write(f"region codes updated for {hospitals} hospitals")
+            if 'users' in targets:
+                self.stdout.write(f"preferred region codes updated for {refresh_user_codes()} users")
+        self.stdout.write(self.style.SUCCESS('region codes refreshed'))
@@ -0,0 +1,91 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:16
+
+import hashlib
+import json
+
+from django.db import migrations, models
+
+
+# frozen copies of DEFAULT_WEIGHTS and compute_hospital_base_score at the time of this
+# migration; rows scored with other weights are picked up by ``manage.py recompute_base_scores``
+WEIGHTS = {
+    "grade": 0.20,
+    "specialty_score": 0.18,
+    "success_rate": 0.18,
+    "equipment_score": 0.10,
+    "reputation": 0.10,
+    "avg_wait_hours": 0.06,
+    "bed_count": 0.04,
+    "avg_cost": 0.06,
+    "distance": 0.08,
+}
+
+
+def _normalize(value, from_min, from_max):
+    return max(0.0, min(1.0, (value - from_min) / (from_max - from_min)))
+
+
+def base_score(h):
+    wait = h.avg_wait_hours if h.avg_wait_hours is not None else 4.0
+    cost = h.avg_cost if h.avg_cost is not None else 2000.0
+    score = (
+        WEIGHTS["grade"] * (h.grade_level or 0) / 3.0
+        + WEIGHTS["specialty_score"] * (h.specialty_score or 50.0) / 100.0
+        + WEIGHTS["success_rate"] * (h.success_rate if h.success_rate is not None else 0.8)
+        + WEIGHTS["equipment_score"] * (h.equipment_score or 50.0) / 100.0
+        + WEIGHTS["reputation"] * (h.reputation_index or 50.0) / 100.0
+        + WEIGHTS["avg_wait_hours"] * (1.0 - _normalize(wait, 0, 24))
+        + WEIGHTS["bed_count"] * _normalize(h.bed_count or 0, 0, 1000)
+        + WEIGHTS["avg_cost"] * (1.0 - _normalize(cost, 0, 20000))
+    )
+    return max(0.0, min(100.0, score * 100.0))
+
+
+def populate_base_score(apps, schema_editor):
+    Hospital = apps.get_model("hospital", "Hospital")
+    raw = json.dumps(WEIGHTS, sort_keys=True, separators=(",", ":"))
+    fingerprint = hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+    batch = []
+    for h in Hospital.objects.all().iterator(chunk_size=1000):
+        h.base_score = base_score(h)
+        h.base_score_weights = fingerprint
+        batch.append(h)
+        if len(batch) >= 1000:
+            Hospital.objects.bulk_update(batch, ["base_score", "base_score_weights"])
+            batch = []
+    if batch:
+        Hospital.objects.bulk_update(batch, ["base_score", "base_score_weights"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("hospital", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="hospital",
+            name="base_score",
+            field=models.FloatField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                help_text="0-100，由静态字段与 DEFAULT_WEIGHTS 计算",
+                null=True,
+                verbose_name="基础评分",
+            ),
+        ),
+        migrations.AddField(
+            model_name="hospital",
+            name="base_score_weights",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                help_text="计算 base_score 时所用权重的指纹",
+                max_length=16,
+                verbose_name="评分权重指纹",
+            ),
+        ),
+        migrations.RunPython(populate_base_score, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("hospital", "0002_hospital_base_score"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="hospital",
+            index=models.Index(
+                fields=["avg_cost"], name="hospital_ho_avg_cos_6401de_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:17
+
+from django.db import migrations, models
+
+
+def populate_region_codes(apps, schema_editor):
+    from hospital.regions import resolve
+
+    Hospital = apps.get_model("hospital", "Hospital")
+    # one UPDATE per distinct region text (order_by: Meta.ordering would defeat distinct)
+    regions = Hospital.objects.exclude(region="").order_by("region").values_list("region", flat=True).distinct()
+    for region in regions:
+        codes = resolve(region)
+        if codes.province:
+            Hospital.objects.filter(region=region).update(
+                province_code=codes.province, city_code=codes.city, district_code=codes.district
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("hospital", "0003_hospital_avg_cost_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="hospital",
+            name="city_code",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                max_length=6,
+                verbose_name="市级代码",
+            ),
+        ),
+        migrations.AddField(
+            model_name="hospital",
+            name="district_code",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                max_length=6,
+                verbose_name="区县代码",
+            ),
+        ),
+        migrations.AddField(
+            model_name="hospital",
+            name="province_code",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                max_length=6,
+                verbose_name="省级代码",
+            ),
+        ),
+        migrations.RunPython(populate_region_codes, migrations.RunPython.noop),
+    ]
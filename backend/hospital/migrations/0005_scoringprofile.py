@@ -0,0 +1,74 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("hospital", "0004_hospital_region_codes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ScoringProfile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "name",
+                    models.CharField(max_length=100, unique=True, verbose_name="名称"),
+                ),
+                (
+                    "urgency",
+                    models.CharField(
+                        blank=True,
+                        choices=[
+                            ("", "不限"),
+                            ("emergency", "急诊 (emergency)"),
+                            ("urgent", "紧急 (urgent)"),
+                            ("routine", "常规 (routine)"),
+                        ],
+                        help_text="留空表示不限紧急程度",
+                        max_length=20,
+                        verbose_name="紧急程度",
+                    ),
+                ),
+                (
+                    "region_code",
+                    models.CharField(
+                        blank=True,
+                        help_text="省/市/区县行政区划代码（GB/T 2260），留空表示不限地区",
+                        max_length=6,
+                        verbose_name="地区代码",
+                    ),
+                ),
+                (
+                    "weights",
+                    models.JSONField(
+                        blank=True,
+                        default=dict,
+                        help_text='覆盖 DEFAULT_WEIGHTS 中的部分键，例如 {"distance": 0.15}',
+                        verbose_name="权重",
+                    ),
+                ),
+                ("is_active", models.BooleanField(default=True, verbose_name="启用")),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="更新时间"),
+                ),
+            ],
+            options={
+                "verbose_name": "评分权重配置",
+                "verbose_name_plural": "评分权重配置",
+                "ordering": ("urgency", "region_code", "name"),
+            },
+        ),
+    ]
@@ -14,8 +14,9 @@ class Hospital(models.Model):
       - avg_wait_hours (平均候诊时间，小时)
       - equipment_score (设备水平评分 0-100)
       - reputation_index (社会声誉 0-100)
+      - base_score / base_score_weights (预计算的基础评分及其权重指纹)
       - created_at / updated_at
-    另外提供 helper 方法：as_dict(), composite_score()（委托给外部 utils）
+    另外提供 helper 方法：as_dict(), composite_score()（委托给外部 utils）, refresh_base_score()
     """
     GRADE_CHOICES = (
         (3, '三级甲等 (3)'),
@@ -27,6 +28,11 @@ class Hospital(models.Model):
     name = models.CharField("医院名称", max_length=200, unique=True)
     # region 允许自由文本（可存 "省/市/区" 或城市名），如需更细粒度可再拆分为 province/city/area
     region = models.CharField("地区", max_length=150, blank=True, db_index=True, help_text="例如：省/市/区")
+    # 由 region 解析出的行政区划代码（GB/T 2260，见 hospital.regions），保存时刷新；
+    # 地区过滤对这些索引列做等值查询，未能解析的层级为空串（回退到 region 文本匹配）
+    province_code = models.CharField("省级代码", max_length=6, blank=True, db_index=True, editable=False)
+    city_code = models.CharField("市级代码", max_length=6, blank=True, db_index=True, editable=False)
+    district_code = models.CharField("区县代码", max_length=6, blank=True, db_index=True, editable=False)
     specialty = models.CharField("专科/擅长", max_length=300, blank=True, help_text="逗号分隔多个专科")
     address = models.CharField("详细地址", max_length=255, blank=True)
     contact = models.CharField("联系方式", max_length=100, blank=True)
@@ -51,6 +57,12 @@ class Hospital(models.Model):
     success_rate = models.FloatField("治疗成功率", default=0.8, help_text="0-1 标度")
     avg_wait_hours = models.FloatField("平均候诊时间(小时)", null=True, blank=True)
 
+    # 预计算的基础评分（compute_hospital_base_score），保存时刷新；权重变更后用 recompute_base_scores 命令批量重算
+    base_score = models.FloatField("基础评分", null=True, blank=True, db_index=True, editable=False,
+                                   help_text="0-100，由静态字段与 DEFAULT_WEIGHTS 计算")
+    base_score_weights = models.CharField("评分权重指纹", max_length=16, blank=True, editable=False,
+                                          help_text="计算 base_score 时所用权重的指纹")
+
     created_at = models.DateTimeField("创建时间", auto_now_add=True)
     updated_at = models.DateTimeField("更新时间", auto_now=True)
 
@@ -59,6 +71,7 @@ class Hospital(models.Model):
         indexes = [
             models.Index(fields=['region']),
             models.Index(fields=['grade_level']),
+            models.Index(fields=['avg_cost']),
         ]
         verbose_name = "医院"
         verbose_name_plural = "医院"
@@ -66,6 +79,27 @@ class Hospital(models.Model):
     def __str__(self):
         return self.name
 
+    def refresh_base_score(self):
+        """按当前 DEFAULT_WEIGHTS 重新计算 base_score（不保存）"""
+        from .utils import compute_hospital_base_score, weights_fingerprint
+        self.base_score = compute_hospital_base_score(self)
+        self.base_score_weights = weights_fingerprint()
+
+    def refresh_region_codes(self):
+        """由 region 文本解析省/市/区县代码（不保存）"""
+        from .regions import resolve
+        codes = resolve(self.region)
+        self.province_code, self.city_code, self.district_code = codes.province, codes.city, codes.district
+
+    def save(self, *args, **kwargs):
+        self.refresh_base_score()
+        self.refresh_region_codes()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {
+                'base_score', 'base_score_weights', 'province_code', 'city_code', 'district_code'}
+        super().save(*args, **kwargs)
+
     def as_dict(self):
         """简便地把主要字段导出为 dict（供 API 或前端使用）"""
         return {
@@ -95,7 +129,10 @@ class Hospital(models.Model):
         该方法会委托到 hospital.utils.compute_hospital_base_score（如果可用），便于和推荐逻辑复用。
         """
         try:
-            from .utils import compute_hospital_base_score
+            from .utils import compute_hospital_base_score, weights_fingerprint
+            # 默认权重且预计算值仍有效时直接返回持久化的 base_score
+            if weights is None and self.base_score is not None and self.base_score_weights == weights_fingerprint():
+                return self.base_score
             return compute_hospital_base_score(self, weights=weights)
         except Exception:
             # 简单回退计算
@@ -106,4 +143,61 @@ class Hospital(models.Model):
             score += (self.success_rate or 0.8) * 20.0
             score += (self.equipment_score or 50.0) * 0.1
             score += (self.reputation_index or 50.0) * 0.1
-            return min(100.0, max(0.0, score))
\ No newline at end of file
+            return min(100.0, max(0.0, score))
+
+class ScoringProfile(models.Model):
+    """
+    推荐评分权重配置：按紧急程度和/或地区覆盖 DEFAULT_WEIGHTS 的部分权重。
+    保存/删除后各 worker 热加载（见 hospital.weights），无需重启或重新部署；
+    紧急程度与地区都为空的配置即全局默认权重。
+    """
+    URGENCY_CHOICES = (
+        ('', '不限'),
+        ('emergency', '急诊 (emergency)'),
+        ('urgent', '紧急 (urgent)'),
+        ('routine', '常规 (routine)'),
+    )
+
+    name = models.CharField("名称", max_length=100, unique=True)
+    urgency = models.CharField("紧急程度", max_length=20, blank=True, choices=URGENCY_CHOICES,
+                               help_text="留空表示不限紧急程度")
+    region_code = models.CharField("地区代码", max_length=6, blank=True,
+                                   help_text="省/市/区县行政区划代码（GB/T 2260），留空表示不限地区")
+    weights = models.JSONField("权重", default=dict, blank=True,
+                               help_text='覆盖 DEFAULT_WEIGHTS 中的部分键，例如 {"distance": 0.15}')
+    is_active = models.BooleanField("启用", default=True)
+    updated_at = models.DateTimeField("更新时间", auto_now=True)
+
+    class Meta:
+        ordering = ('urgency', 'region_code', 'name')
+        verbose_name = "评分权重配置"
+        verbose_name_plural = "评分权重配置"
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        """校验权重键/取值、地区代码，以及同一 (紧急程度, 地区) 只有一个启用的配置"""
+        from django.core.exceptions import ValidationError
+        from .regions import resolve_code
+        from .utils import DEFAULT_WEIGHTS
+
+        errors = {}
+        if not isinstance(self.weights, dict):
+            errors['weights'] = '必须是 JSON 对象'
+        else:
+            unknown = sorted(set(self.weights) - set(DEFAULT_WEIGHTS))
+            if unknown:
+                errors['weights'] = f'未知的权重：{", ".join(unknown)}（可用：{", ".join(DEFAULT_WEIGHTS)}）'
+            elif any(isinstance(v, bool) or not isinstance(v, (int, float)) for v in self.weights.values()):
+                errors['weights'] = '权重必须是数值'
+        if self.region_code and resolve_code(self.region_code) is None:
+            errors['region_code'] = '未知的行政区划代码'
+        if self.is_active:
+            clash = ScoringProfile.objects.filter(is_active=True, urgency=self.urgency, region_code=self.region_code)
+            if self.pk is not None:
+                clash = clash.exclude(pk=self.pk)
+            if clash.exists():
+                errors['__all__'] = '相同紧急程度与地区已有启用的配置'
+        if errors:
+            raise ValidationError(errors)
@@ -0,0 +1,197 @@
+"""
+Process-pool scoring for large candidate sets.
+
+``rank_candidates`` scores inline, so a province-wide query over ~100k
+hospitals keeps its worker busy for the whole request while the host's other
+cores idle. With ``RECOMMEND_PARALLEL_WORKERS`` > 0, requests with at least
+``RECOMMEND_PARALLEL_MIN_CANDIDATES`` candidates go through ``rank_parallel``:
+
+  - the snapshot's scoring columns and base scores are copied once per
+    snapshot into a ``multiprocessing.shared_memory`` block; pool processes
+    attach to it by name instead of receiving the table per task
+  - the candidates are split into one contiguous chunk per pool process; each
+    process scores its chunk with ``score_hospitals`` and returns only its own
+    top ``depth`` (chunk positions + ``BatchScores``)
+  - the partial lists are merged by (score desc, candidate position asc),
+    which is the order of the inline ``top_k_indices``, so both paths return
+    the same ranking
+
+Smaller requests stay inline: the hand-off costs more than it saves. Each
+gunicorn worker starts its own pool lazily on first use, with the ``spawn``
+start method (forking a threaded worker is unsafe). If the pool fails the
+request is scored inline.
+
+Only Django-free modules are imported here: spawned pool processes import this
+module without setting Django up.
+"""
+import atexit
+import logging
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+from django.conf import settings
+
+from .scoring import NUMERIC_FIELDS, BatchScores, HospitalColumns, score_hospitals, top_k_indices
+
+logger = logging.getLogger(__name__)
+
+# rows of a shared block: the scorer's numeric columns, then the base scores
+BLOCK_FIELDS = NUMERIC_FIELDS + ('base_score',)
+# shared blocks kept per process; older ones are unlinked (owner) / closed (pool process)
+KEEP_BLOCKS = 2
+
+
+def parallel_workers():
+    return getattr(settings, 'RECOMMEND_PARALLEL_WORKERS', 0)
+
+
+def parallel_min_candidates():
+    return getattr(settings, 'RECOMMEND_PARALLEL_MIN_CANDIDATES', 50000)
+
+
+def use_parallel(n_candidates):
+    """Should ``n_candidates`` candidates be scored across the pool?"""
+    return parallel_workers() > 0 and n_candidates >= parallel_min_candidates()
+
+
+# --- pool processes ---------------------------------------------------------
+
+_attached = OrderedDict()
+
+
+def _attach(name, n):
+    """(fields, n) float64 view of the shared block ``name`` (attached once per process)."""
+    entry = _attached.get(name)
+    if entry is None:
+        shm = shared_memory.SharedMemory(name=name)
+        entry = _attached[name] = (shm, np.ndarray((len(BLOCK_FIELDS), n), dtype=np.float64, buffer=shm.buf))
+        while len(_attached) > KEEP_BLOCKS:
+            _, (old, _view) = _attached.popitem(last=False)
+            del _view
+            old.close()
+    return entry[1]
+
+
+def _score_chunk(block, candidates, specialty_rows, region_rows, payload, depth, distances=None,
+                 distance_floor=None, weights=None):
+    """
+    Score one chunk in a pool process: (chunk positions, BatchScores) of its best ``depth``.
+    The block holds the base scores of DEFAULT_WEIGHTS; other ``weights`` compute their own.
+    """
+    name, n = block
+    data = _attach(name, n)
+    numeric = {field: data[i][candidates] for i, field in enumerate(NUMERIC_FIELDS)}
+    # region / specialty text is not shared: the parent passes both masks instead
+    columns = HospitalColumns(ids=candidates, region=(), specialty=(), **numeric)
+    base_scores = data[-1][candidates] if weights is None else None
+    scores = score_hospitals(columns, payload, weights=weights, base_scores=base_scores,
+                             specialty_rows=specialty_rows, region_rows=region_rows,
+                             distances=distances, distance_floor=distance_floor)
+    order = top_k_indices(scores.final, len(candidates) if depth is None else depth)
+    return order, scores.take(order)
+
+
+# --- request side -------------------------------------------------------------
+
+_pool = None
+_pool_lock = threading.Lock()
+_blocks = OrderedDict()
+_blocks_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=parallel_workers(),
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _release(shm):
+    shm.close()
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _export(snapshot):
+    """(name, rows) of the shared block holding ``snapshot``'s scoring columns."""
+    key = (snapshot.version, id(snapshot))
+    with _blocks_lock:
+        shm = _blocks.get(key)
+        if shm is None:
+            n = len(snapshot)
+            shm = shared_memory.SharedMemory(create=True, size=max(1, len(BLOCK_FIELDS) * n * 8))
+            data = np.ndarray((len(BLOCK_FIELDS), n), dtype=np.float64, buffer=shm.buf)
+            for i, field in enumerate(NUMERIC_FIELDS):
+                data[i] = getattr(snapshot.columns, field)
+            data[-1] = snapshot.base_scores()
+            del data
+            _blocks[key] = shm
+            while len(_blocks) > KEEP_BLOCKS:
+                _, old = _blocks.popitem(last=False)
+                _release(old)
+        return shm.name, len(snapshot)
+
+
+@atexit.register
+def _release_blocks():
+    with _blocks_lock:
+        while _blocks:
+            _release(_blocks.popitem()[1])
+
+
+def rank_parallel(snapshot, candidates, payload, specialty_rows, region_rows, depth=None, distances=None,
+                  distance_floor=None, weights=None):
+    """
+    Score ``candidates`` (snapshot rows) for ``payload`` across the pool.
+    ``specialty_rows`` / ``region_rows`` are the candidates' match masks
+    (``region_rows`` None without a region); ``distances`` / ``distance_floor``
+    the region centroid distances of ``score_hospitals``; ``weights`` a
+    ``hospital.weights.Weights`` (None: DEFAULT_WEIGHTS). Returns (positions into
+    ``candidates``, BatchScores) of the best ``depth`` (all when None), best
+    first, or None when the pool failed.
+    """
+    block = _export(snapshot)
+    # only the weight values travel to the pool, and only when they differ from the block's
+    values = None if weights is None or weights.is_default else weights.values
+    bounds = np.linspace(0, len(candidates), parallel_workers() + 1).astype(np.int64)
+    try:
+        pool = _get_pool()
+        futures = [
+            (start, pool.submit(_score_chunk, block, candidates[start:end], specialty_rows[start:end],
+                                None if region_rows is None else region_rows[start:end], payload, depth,
+                                None if distances is None else distances[start:end], distance_floor, values))
+            for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()) if end > start
+        ]
+        parts = [(start, future.result()) for start, future in futures]
+    except BrokenProcessPool:
+        logger.exception('scoring pool broke; restarting it and scoring inline')
+        _reset_pool()
+        return None
+    except Exception:
+        logger.exception('parallel scoring failed; scoring inline')
+        return None
+
+    positions = np.concatenate([start + order for start, (order, _) in parts])
+    scores = BatchScores.concatenate([part for _, (_, part) in parts])
+    # one inline pass orders by score desc, ties by candidate position asc
+    order = np.lexsort((positions, -scores.final))
+    if depth is not None:
+        order = order[:depth]
+    return positions[order], scores.take(order)
@@ -0,0 +1,204 @@
+"""
+Precomputed rankings of the most requested payload shapes.
+
+Recommend traffic concentrates on a few hundred (region, disease, urgency,
+economic_level) combinations. ``manage.py precompute_recommendations`` mines
+``RecommendationHistory.payload`` for the most frequent of these shapes,
+ranks each one to ``depth`` and stores the ``Ranking`` in the shared cache.
+``RecommendHospitalView`` serves a result-cache miss from the stored ranking
+when its payload is exactly such a shape (no coordinates, spatial limits or
+``specialty_only``) and scores live otherwise. A shape names its region by
+the resolved area code (see ``payload_shape``), so "浙江/杭州", "浙江省/杭州市"
+and the cascader list ["330000", "330100"] stored in the history share one
+entry.
+
+An entry is served only while it matches the current hospital-table version
+and the fingerprint of the weights selected for the payload. Entries also keep
+a digest of their scoring inputs (candidate ids, scoring columns, base scores,
+match masks, region distances, weights): on the next run an entry whose table
+version moved but whose inputs did not is re-stamped with the new version
+instead of being rescored, and entries that are still current are skipped.
+"""
+import hashlib
+import json
+import time
+from collections import Counter
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from accounts.models import RecommendationHistory
+
+from .recommender import cursor_depth, rank_inputs, scoring_inputs
+from .regions import region_label, resolve_query
+from .result_cache import canonical_payload
+from .scoring import NUMERIC_FIELDS
+from .snapshot import get_snapshot
+from .weights import select_weights
+
+PRECOMPUTED_KEY = 'hospital:recommend:precomputed:{}'
+
+# payload fields that make up a shape
+SHAPE_FIELDS = ('region', 'disease_name', 'disease_code', 'urgency', 'economic_level')
+# scoring fields that make a payload too specific to precompute
+SPECIFIC_FIELDS = ('user_lat', 'user_lng', 'max_distance_km', 'nearest_n', 'specialty_only')
+
+
+def precompute_enabled():
+    return getattr(settings, 'RECOMMEND_PRECOMPUTE_ENABLED', True)
+
+
+def precompute_ttl():
+    return getattr(settings, 'RECOMMEND_PRECOMPUTE_TTL', 7 * 24 * 3600)
+
+
+def payload_shape(canonical):
+    """
+    Shape of a canonical payload (its SHAPE_FIELDS), or None when it cannot be
+    precomputed. A region that resolves is replaced by the labels of its area
+    code (``regions.region_label``), the text the frontend sends for it.
+    """
+    if any(canonical.get(name) not in (None, False) for name in SPECIFIC_FIELDS):
+        return None
+    shape = {name: canonical[name] for name in SHAPE_FIELDS if name in canonical}
+    if 'region' in shape:
+        codes = resolve_query(shape['region'])
+        if codes is not None:
+            shape['region'] = region_label(codes) or shape['region']
+    return shape
+
+
+def shape_key(shape):
+    raw = json.dumps(shape, sort_keys=True, ensure_ascii=False, default=str)
+    return PRECOMPUTED_KEY.format(hashlib.sha1(raw.encode('utf-8')).hexdigest())
+
+
+def _served(entry, version, weights):
+    if entry is None or entry['version'] != version or entry['weights'] != weights.fingerprint:
+        return None
+    return entry['ranking']
+
+
+def precomputed_ranking(canonical, version, weights):
+    """Stored Ranking of ``canonical`` at table ``version`` scored with ``weights``, or None."""
+    shape = payload_shape(canonical)
+    if shape is None or not precompute_enabled():
+        return None
+    return _served(cache.get(shape_key(shape)), version, weights)
+
+
+async def aprecomputed_ranking(canonical, version, weights):
+    """``precomputed_ranking`` for async views."""
+    shape = payload_shape(canonical)
+    if shape is None or not precompute_enabled():
+        return None
+    return _served(await cache.aget(shape_key(shape)), version, weights)
+
+
+def input_digest(snapshot, inputs):
+    """Digest of everything ``rank_inputs`` reads for ``inputs``."""
+    rows = inputs.candidates
+    digest = hashlib.sha1(inputs.weights.fingerprint.encode('ascii'))
+    digest.update(json.dumps(inputs.payload, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+    digest.update(repr(inputs.distance_floor).encode('ascii'))
+    arrays = [snapshot.ids[rows], snapshot.base_scores(inputs.weights.values)[rows], inputs.specialty_rows]
+    arrays += [np.asarray(getattr(snapshot.columns, name))[rows] for name in NUMERIC_FIELDS]
+    for optional in (inputs.region_rows, inputs.distances):
+        digest.update(b'-' if optional is None else b'+')
+        if optional is not None:
+            arrays.append(optional)
+    for array in arrays:
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def history_fields(payload):
+    """
+    Scoring fields of a stored history payload in the form the frontend posts
+    them, or None when its region does not resolve. The history keeps the
+    form's raw values: the cascader code list as region (or region_cascader)
+    and economic_level '' / '无要求' for "no preference".
+    """
+    fields = {k: payload[k] for k in SHAPE_FIELDS + SPECIFIC_FIELDS if payload.get(k) not in (None, '')}
+    region = fields.get('region') or payload.get('region_cascader')
+    if isinstance(region, (list, tuple)):
+        fields.pop('region', None)
+        if region:
+            codes = resolve_query(list(region))
+            if codes is None:
+                return None
+            fields['region'] = codes.code
+    level = fields.get('economic_level')
+    if isinstance(level, str):
+        try:
+            float(level)
+        except ValueError:
+            del fields['economic_level']
+    return fields
+
+
+def popular_shapes(days=30, limit=500, min_count=2):
+    """
+    [(shape, requests)] of the ``limit`` most frequent precomputable payloads
+    in the history of the last ``days`` days, most frequent first.
+    """
+    since = timezone.now() - timedelta(days=days)
+    payloads = RecommendationHistory.objects.filter(created_at__gte=since).values_list('payload', flat=True)
+    # count the raw scoring fields first: one validation per distinct payload, not per row
+    raw = Counter()
+    for payload in payloads.iterator(chunk_size=2000):
+        if not isinstance(payload, dict):
+            continue
+        fields = history_fields(payload)
+        if fields is None:
+            continue
+        raw[json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str)] += 1
+
+    shapes, counts = {}, Counter()
+    for fields, count in raw.items():
+        canonical = canonical_payload(json.loads(fields))
+        shape = None if canonical is None else payload_shape(canonical)
+        if shape is None:
+            continue
+        key = shape_key(shape)
+        shapes[key] = shape
+        counts[key] += count
+    return [(shapes[key], count) for key, count in counts.most_common(limit) if count >= min_count]
+
+
+def refresh_entry(snapshot, shape, depth=None, full=False, parallel=True):
+    """
+    Bring the stored ranking of ``shape`` up to date with ``snapshot`` and the
+    current weights. Returns 'current', 'restamped' or 'computed'.
+    """
+    depth = depth or cursor_depth()
+    key = shape_key(shape)
+    inputs = scoring_inputs(snapshot, shape, select_weights(shape))
+    entry = None if full else cache.get(key)
+    if entry is not None and entry['depth'] >= depth and entry['weights'] == inputs.weights.fingerprint:
+        if entry['version'] == snapshot.version:
+            return 'current'
+        digest = input_digest(snapshot, inputs)
+        if entry['digest'] == digest:
+            cache.set(key, dict(entry, version=snapshot.version), timeout=precompute_ttl())
+            return 'restamped'
+    else:
+        digest = input_digest(snapshot, inputs)
+    cache.set(key, {
+        'version': snapshot.version,
+        'weights': inputs.weights.fingerprint,
+        'digest': digest,
+        'depth': depth,
+        'ranking': rank_inputs(snapshot, inputs, depth, parallel=parallel),
+        'computed_at': time.time(),
+    }, timeout=precompute_ttl())
+    return 'computed'
+
+
+def refresh_entries(shapes, depth=None, full=False, parallel=True):
+    """``refresh_entry`` for every shape against this process's snapshot; Counter of the outcomes."""
+    snapshot = get_snapshot()
+    return Counter(refresh_entry(snapshot, shape, depth, full, parallel) for shape in shapes)
@@ -0,0 +1,264 @@
+"""
+Recommendation ranking shared by the recommend endpoints.
+
+``rank_candidates`` scores the snapshot rows matching a payload and keeps only
+the top ``depth`` of them (partial selection, see ``scoring.top_k_indices``).
+A ``Ranking`` can be parked in the cache behind an opaque cursor so "load more"
+requests page through the already computed order instead of rescoring.
+Weights come from the payload's scoring profile (see ``hospital.weights``).
+"""
+import math
+import uuid
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .parallel import rank_parallel, use_parallel
+from .region_index import region_distances
+from .scoring import score_hospitals, top_k_indices
+from .weights import select_weights
+
+CURSOR_KEY = 'hospital:recommend:cursor:{}'
+
+
+def cursor_ttl():
+    return getattr(settings, 'RECOMMEND_CURSOR_TTL', 600)
+
+
+def cursor_depth():
+    return getattr(settings, 'RECOMMEND_CURSOR_DEPTH', 200)
+
+
+def default_top_k():
+    return getattr(settings, 'RECOMMEND_DEFAULT_TOP_K', 20)
+
+
+def max_top_k():
+    return getattr(settings, 'RECOMMEND_MAX_TOP_K', 500)
+
+
+class Ranking:
+    """
+    Ranked hospitals for one payload.
+      - ids: hospital primary keys, best first (at most ``depth`` of them)
+      - scores: BatchScores aligned with ``ids`` (for score/breakdown)
+      - total: number of candidates that were scored
+      - payload: the scoring payload (to rank deeper on demand)
+      - weights: the ``Weights`` it was scored with (deeper ranks reuse them)
+    """
+    # rankings cached before profiles existed select their weights again
+    weights = None
+
+    def __init__(self, ids, scores, total, payload, weights=None):
+        self.ids = ids
+        self.scores = scores
+        self.total = total
+        self.payload = payload
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def complete(self):
+        return len(self.ids) >= self.total
+
+
+def _optional_number(payload, name, cast):
+    value = payload.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        value = cast(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be a number')
+    if not math.isfinite(value) or value <= 0:
+        raise ValueError(f'{name} must be positive')
+    return value
+
+
+def spatial_params(payload):
+    """
+    (user_lat, user_lng, max_distance_km, nearest_n) of a payload or query dict.
+    Coordinates are None when absent; raises ValueError on malformed values
+    (not numbers, NaN/infinite, or outside -90..90 / -180..180).
+    """
+    max_distance_km = _optional_number(payload, 'max_distance_km', float)
+    nearest_n = _optional_number(payload, 'nearest_n', int)
+    user_lat, user_lng = payload.get('user_lat'), payload.get('user_lng')
+    if user_lat in (None, '') or user_lng in (None, ''):
+        return None, None, max_distance_km, nearest_n
+    try:
+        user_lat, user_lng = float(user_lat), float(user_lng)
+    except (TypeError, ValueError):
+        raise ValueError('user_lat and user_lng must be numbers')
+    # NaN compares False both ways: it would slip through the range check alone
+    if not (math.isfinite(user_lat) and math.isfinite(user_lng)) or abs(user_lat) > 90 or abs(user_lng) > 180:
+        raise ValueError('user_lat must be within -90..90 and user_lng within -180..180')
+    return user_lat, user_lng, max_distance_km, nearest_n
+
+
+def check_region(payload):
+    """Raise ValueError unless the payload region is absent, text or a list of area codes."""
+    region = payload.get('region')
+    if region is None or isinstance(region, str):
+        return
+    if isinstance(region, (list, tuple)) and all(item is None or isinstance(item, str) for item in region):
+        return
+    raise ValueError('region must be a string or a list of area codes')
+
+
+def spatial_candidates(snapshot, payload):
+    """
+    Row indices selected by ``max_distance_km`` / ``nearest_n`` around the
+    user's coordinates, in ascending row order; None when no spatial limit applies.
+    """
+    user_lat, user_lng, max_distance_km, nearest_n = spatial_params(payload)
+    if user_lat is None or (max_distance_km is None and nearest_n is None):
+        return None
+    index = snapshot.spatial_index
+    if nearest_n is not None:
+        rows, _ = index.nearest(user_lat, user_lng, nearest_n, max_distance_km=max_distance_km)
+        return np.sort(rows)
+    rows, _ = index.within(user_lat, user_lng, max_distance_km)
+    return rows
+
+
+def select_candidates(snapshot, payload, region=None):
+    """
+    Row indices of the snapshot that are eligible for ``payload``.
+    ``region`` is ``snapshot.region_mask`` of the payload region when the
+    caller already has it. Raises ValueError when the spatial options are malformed.
+    """
+    candidates = spatial_candidates(snapshot, payload)
+    if candidates is None:
+        candidates = np.arange(len(snapshot))
+    # optional quick filter: region (code columns, see HospitalSnapshot.region_mask)
+    if region is None:
+        region = snapshot.region_mask(payload.get('region'))
+    if region is not None:
+        candidates = candidates[region[candidates]]
+    # optional: only hospitals whose specialty matches the disease
+    if _truthy(payload.get('specialty_only')):
+        disease_name, disease_code = disease_params(payload)
+        candidates = np.intersect1d(candidates, snapshot.specialty_index.rows_for(disease_name, disease_code))
+    return candidates
+
+
+def _truthy(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def disease_params(payload):
+    """(disease_name, disease_code) exactly as the scorer reads them."""
+    return (payload.get('disease_name') or '') or '', (payload.get('disease_code') or '') or ''
+
+
+class ScoringInputs:
+    """
+    Everything ``rank_candidates`` scores for one payload.
+      - payload: the scoring payload (plain dict); weights: its ``Weights``
+      - candidates: snapshot rows, ascending
+      - specialty_rows / region_rows: the candidates' match masks
+        (``region_rows`` None without a region)
+      - distances / distance_floor: region centroid distances of
+        ``score_hospitals`` (None with user coordinates or without an index)
+    """
+
+    def __init__(self, payload, weights, candidates, specialty_rows, region_rows, distances, distance_floor):
+        self.payload = payload
+        self.weights = weights
+        self.candidates = candidates
+        self.specialty_rows = specialty_rows
+        self.region_rows = region_rows
+        self.distances = distances
+        self.distance_floor = distance_floor
+
+
+def scoring_inputs(snapshot, payload, weights=None):
+    """
+    ScoringInputs of ``payload``; ``weights`` (``hospital.weights.Weights``)
+    defaults to the payload's profile.
+    """
+    # the region is resolved once: it filters the candidates and drives the region boost
+    region = snapshot.region_mask(payload.get('region'))
+    candidates = select_candidates(snapshot, payload, region)
+    payload = payload.dict() if hasattr(payload, 'dict') else dict(payload)
+    if weights is None:
+        weights = select_weights(payload)
+    # specialty matches come from the inverted index instead of a per-row text scan
+    specialty_rows = snapshot.specialty_index.match_mask(*disease_params(payload))[candidates]
+    region_rows = None if region is None else region[candidates]
+    # without coordinates, proximity comes from the region centroid's precomputed list
+    distances = distance_floor = None
+    if payload.get('user_lat') is None or payload.get('user_lng') is None:
+        found = region_distances(snapshot, payload.get('region'), candidates)
+        if found is not None:
+            distances, distance_floor = found
+    return ScoringInputs(payload, weights, candidates, specialty_rows, region_rows, distances, distance_floor)
+
+
+def rank_inputs(snapshot, inputs, depth=None, parallel=True):
+    """
+    Score ``inputs`` and keep the best ``depth`` (all when None). Large
+    candidate sets are scored across the process pool (see hospital.parallel)
+    unless ``parallel`` is False.
+    """
+    candidates, weights = inputs.candidates, inputs.weights
+    total = len(candidates)
+    ranked = None
+    if parallel and use_parallel(total):
+        ranked = rank_parallel(snapshot, candidates, inputs.payload, inputs.specialty_rows, inputs.region_rows,
+                               depth, distances=inputs.distances, distance_floor=inputs.distance_floor,
+                               weights=weights)
+    if ranked is None:
+        scores = score_hospitals(snapshot.columns.take(candidates), inputs.payload, weights=weights.values,
+                                 base_scores=snapshot.base_scores(weights.values)[candidates],
+                                 specialty_rows=inputs.specialty_rows, region_rows=inputs.region_rows,
+                                 distances=inputs.distances, distance_floor=inputs.distance_floor)
+        if depth is None or depth >= total:
+            order = np.argsort(-scores.final, kind='stable')
+        else:
+            order = top_k_indices(scores.final, depth)
+        ranked = order, scores.take(order)
+    order, scores = ranked
+    return Ranking(snapshot.ids[candidates[order]], scores, total, inputs.payload, weights)
+
+
+def rank_candidates(snapshot, payload, depth=None, weights=None):
+    """
+    Score the candidates for ``payload`` and keep the best ``depth`` (all when None).
+    ``weights`` (``hospital.weights.Weights``) defaults to the payload's profile.
+    Large candidate sets are scored across the process pool (see hospital.parallel).
+    """
+    return rank_inputs(snapshot, scoring_inputs(snapshot, payload, weights), depth)
+
+
+def save_ranking(ranking):
+    """Store ``ranking`` in the cache and return its cursor token."""
+    token = uuid.uuid4().hex
+    cache.set(CURSOR_KEY.format(token), ranking, timeout=cursor_ttl())
+    return token
+
+
+def load_ranking(token):
+    """Ranking previously stored by ``save_ranking`` (None when unknown or expired)."""
+    if not token or not token.isalnum():
+        return None
+    return cache.get(CURSOR_KEY.format(token))
+
+
+def encode_cursor(token, offset):
+    return f'{token}.{offset}'
+
+
+def decode_cursor(cursor):
+    """Split a cursor into (token, offset); raises ValueError for malformed cursors."""
+    token, _, offset = str(cursor).partition('.')
+    offset = int(offset)
+    if not token or offset < 0:
+        raise ValueError('invalid cursor')
+    return token, offset
@@ -0,0 +1,400 @@
+"""
+Nearest-hospital lists of region centroids (``manage.py build_region_index``).
+
+Most recommend requests carry a ``region`` but no ``user_lat``/``user_lng``;
+the scorer then has no distance and only adds the flat 3% region boost. This
+module precomputes, for every region code (see ``hospital.regions``), the
+hospitals nearest to the region's centroid:
+
+  - the centroid of a region is the mean position of its hospitals that have
+    coordinates (areas.json carries none); a region without such hospitals has
+    no list and lookups fall back to the enclosing level
+  - a list holds the hospitals within ``PROXIMITY_RANGE_KM`` of the centroid
+    (farther ones get a distance factor of 0 anyway), nearest first, at most
+    ``REGION_NEAREST_K``; its ``bound`` is a distance every hospital outside
+    the list is at least as far away as
+  - everything is one file of flat arrays (the lists CSR-style, plus the id,
+    position and codes of every hospital it was built from) that each worker
+    maps read-only with ``np.memmap``: the pages are shared, nothing is parsed
+
+``refresh`` compares the table with the positions stored in the file and
+recomputes only the regions whose centroid moved, whose list holds a moved or
+deleted hospital, or whose bound a moved or new hospital falls inside. The new
+file is written next to the old one and swapped in with ``os.replace``, so a
+reader never sees a partial file and picks the new one up on its next lookup.
+Hospital writes schedule a refresh once they commit
+(``REGION_NEAREST_AUTO_REFRESH``).
+
+``region_distances`` turns a list into per-candidate distances for
+``score_hospitals``: region-only requests are scored by proximity to the
+region centroid without any per-request trigonometry. Candidates outside the
+list, including those without coordinates, are scored at the list's bound.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from . import flatfile
+from .regions import CODE_FIELDS, resolve_query
+from .scoring import PROXIMITY_RANGE_KM, haversine_km_array
+from .spatial import GridIndex
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'YXBRGN01'
+# arrays of the file: name -> dtype
+ARRAYS = {
+    'codes': '<i8',           # region codes, sorted
+    'centroids': '<f8',       # (regions, 2) lat / lng
+    'offsets': '<i8',         # list i is hospital_ids[offsets[i]:offsets[i + 1]]
+    'bounds': '<f8',          # km; hospitals outside list i are at least this far
+    'hospital_ids': '<i8',
+    'distances': '<f4',       # km, ascending within each list
+    'source_ids': '<i8',      # hospitals the file was built from (with coordinates), sorted
+    'source_coords': '<f8',   # (hospitals, 2) lat / lng
+    'source_codes': '<i8',    # (hospitals, 3) province / city / district code (0: unknown)
+}
+# above this share of changed hospitals a refresh rebuilds every list
+FULL_REBUILD_SHARE = 0.2
+
+
+def index_path():
+    return str(getattr(settings, 'REGION_NEAREST_FILE', settings.BASE_DIR / 'var' / 'region_nearest.bin'))
+
+
+def nearest_k():
+    return getattr(settings, 'REGION_NEAREST_K', 1000)
+
+
+def auto_refresh():
+    return getattr(settings, 'REGION_NEAREST_AUTO_REFRESH', True)
+
+
+def region_distance_enabled():
+    return getattr(settings, 'RECOMMEND_REGION_DISTANCE', True)
+
+
+class RegionIndex:
+    """Read-only view of an index file (arrays are slices of one memory map)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = flatfile.FlatFile(path, MAGIC)
+        self.meta = self._file.meta
+        for name in ARRAYS:
+            setattr(self, name, self._file.arrays[name])
+
+    @property
+    def k(self):
+        return self.meta['k']
+
+    @property
+    def radius_km(self):
+        return self.meta['radius_km']
+
+    def __len__(self):
+        return len(self.codes)
+
+    def position(self, code):
+        """Row of region ``code`` (None when the region has no list)."""
+        code = int(code)
+        i = int(np.searchsorted(self.codes, code))
+        return i if i < len(self.codes) and self.codes[i] == code else None
+
+    def nearest(self, code):
+        """(hospital ids, distances km, bound km) of region ``code``, nearest first; None when absent."""
+        i = self.position(code)
+        if i is None:
+            return None
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.hospital_ids[start:end], self.distances[start:end], float(self.bounds[i])
+
+    def lookup(self, region):
+        """``nearest`` of the most specific level of a ``RegionCode`` that has a list."""
+        for code in (region.district, region.city, region.province):
+            if code:
+                found = self.nearest(code)
+                if found is not None:
+                    return found
+        return None
+
+    def source(self, pk):
+        """(lat, lng, codes) the file holds for hospital ``pk`` (None when it was not indexed)."""
+        i = int(np.searchsorted(self.source_ids, pk))
+        if i >= len(self.source_ids) or self.source_ids[i] != pk:
+            return None
+        return (*self.source_coords[i].tolist(), tuple(self.source_codes[i].tolist()))
+
+
+# --- building -------------------------------------------------------------------
+
+def _load_table():
+    """(ids, coords, codes) of the hospitals with coordinates, ordered by pk."""
+    from .models import Hospital
+
+    rows = list(Hospital.objects.filter(latitude__isnull=False, longitude__isnull=False)
+                .order_by('pk').values_list('pk', 'latitude', 'longitude', *CODE_FIELDS))
+    ids = np.array([r[0] for r in rows], dtype=np.int64)
+    coords = np.array([r[1:3] for r in rows], dtype=np.float64).reshape(-1, 2)
+    codes = np.array([[int(c) if c else 0 for c in r[3:]] for r in rows], dtype=np.int64).reshape(-1, 3)
+    return ids, coords, codes
+
+
+def _centroids(coords, codes):
+    """(region codes sorted, (regions, 2) mean positions) over every level."""
+    found_codes, found_centroids = [], []
+    for level in range(codes.shape[1]):
+        column = codes[:, level]
+        rows = column != 0
+        if not rows.any():
+            continue
+        unique, inverse = np.unique(column[rows], return_inverse=True)
+        counts = np.bincount(inverse)
+        lat = np.bincount(inverse, weights=coords[rows, 0]) / counts
+        lng = np.bincount(inverse, weights=coords[rows, 1]) / counts
+        found_codes.append(unique)
+        found_centroids.append(np.column_stack((lat, lng)))
+    if not found_codes:
+        return np.empty(0, dtype=np.int64), np.empty((0, 2))
+    region_codes = np.concatenate(found_codes)
+    order = np.argsort(region_codes, kind='stable')
+    return region_codes[order], np.concatenate(found_centroids)[order]
+
+
+def _nearest_lists(grid, ids, centroids, k, radius):
+    """[(hospital ids, distances, bound)] for every centroid."""
+    lists = []
+    for lat, lng in centroids.tolist():
+        rows, d = grid.nearest(lat, lng, k, max_distance_km=radius)
+        bound = float(d[-1]) if len(rows) >= k else radius
+        lists.append((ids[rows], d.astype(np.float32), bound))
+    return lists
+
+
+def _arrays(codes, centroids, lists, ids, coords, source_codes):
+    lengths = np.array([len(item[0]) for item in lists], dtype=np.int64)
+    return {
+        'codes': codes,
+        'centroids': centroids,
+        'offsets': np.concatenate(([0], np.cumsum(lengths))).astype(np.int64),
+        'bounds': np.array([item[2] for item in lists], dtype=np.float64),
+        'hospital_ids': np.concatenate([item[0] for item in lists]) if lists else np.empty(0, dtype=np.int64),
+        'distances': np.concatenate([item[1] for item in lists]) if lists else np.empty(0, dtype=np.float32),
+        'source_ids': ids,
+        'source_coords': coords,
+        'source_codes': source_codes,
+    }
+
+
+def write_index(path, arrays, k, radius):
+    """Write ``arrays`` to ``path`` atomically (see ``hospital.flatfile``)."""
+    arrays = {name: np.asarray(arrays[name], dtype=ARRAYS[name]) for name in ARRAYS}
+    flatfile.write(path, MAGIC, arrays, {'k': k, 'radius_km': radius, 'built_at': time.time()})
+
+
+def _read(path):
+    try:
+        return RegionIndex(path)
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError, TypeError) as exc:
+        logger.warning('ignoring region index %s: %s', path, exc)
+        return None
+
+
+def _affected(old, ids, coords, codes, region_codes, centroids):
+    """Region codes whose list must be recomputed after the table changed."""
+    common, old_pos, new_pos = np.intersect1d(old.source_ids, ids, assume_unique=True, return_indices=True)
+    same = ((old.source_coords[old_pos] == coords[new_pos]).all(axis=1)
+            & (old.source_codes[old_pos] == codes[new_pos]).all(axis=1))
+    kept = common[same]
+    gone = np.setdiff1d(old.source_ids, kept, assume_unique=True)
+    arrived = ~np.isin(ids, kept, assume_unique=True)
+    if not len(gone) and not arrived.any():
+        return None
+
+    affected = set()
+    # new regions and regions whose centroid moved
+    pos = np.minimum(np.searchsorted(old.codes, region_codes), max(len(old.codes) - 1, 0))
+    if len(old.codes):
+        unchanged = (old.codes[pos] == region_codes) & (old.centroids[pos] == centroids).all(axis=1)
+    else:
+        unchanged = np.zeros(len(region_codes), dtype=bool)
+    affected.update(region_codes[~unchanged].tolist())
+    # regions listing a hospital that moved or was deleted
+    listed = np.flatnonzero(np.isin(old.hospital_ids, gone))
+    if len(listed):
+        regions = np.searchsorted(old.offsets, listed, side='right') - 1
+        affected.update(old.codes[np.unique(regions)].tolist())
+    # regions whose bound a moved or new hospital now falls inside
+    if len(old.codes):
+        for lat, lng in coords[arrived].tolist():
+            d = haversine_km_array(lat, lng, old.centroids[:, 0], old.centroids[:, 1])
+            affected.update(old.codes[d <= old.bounds].tolist())
+    return affected, len(gone) + int(arrived.sum())
+
+
+def refresh(path=None, full=False):
+    """
+    Bring the index file in line with the hospital table. Returns a dict with
+    the number of ``regions``, ``rebuilt`` regions and ``changed`` hospitals
+    (``full``: every list was rebuilt); the file is not rewritten when
+    nothing changed.
+    """
+    path = path or index_path()
+    with flatfile.file_lock(path):
+        k, radius = nearest_k(), PROXIMITY_RANGE_KM
+        ids, coords, codes = _load_table()
+        region_codes, centroids = _centroids(coords, codes)
+        old = None if full else _read(path)
+        if old is not None and (old.k != k or old.radius_km != radius):
+            old = None
+
+        affected = None
+        if old is not None:
+            found = _affected(old, ids, coords, codes, region_codes, centroids)
+            if found is None:
+                return {'regions': len(old), 'rebuilt': 0, 'changed': 0, 'full': False}
+            affected, changed = found
+            if changed > FULL_REBUILD_SHARE * max(len(ids), 1):
+                affected = None
+
+        grid = GridIndex(coords[:, 0].copy(), coords[:, 1].copy())
+        if affected is None:
+            lists = _nearest_lists(grid, ids, centroids, k, radius)
+            stats = {'regions': len(region_codes), 'rebuilt': len(region_codes), 'changed': len(ids), 'full': True}
+        else:
+            redo = np.flatnonzero(np.isin(region_codes, list(affected)))
+            fresh = dict(zip(redo.tolist(), _nearest_lists(grid, ids, centroids[redo], k, radius)))
+            lists = []
+            for i, code in enumerate(region_codes.tolist()):
+                if i in fresh:
+                    lists.append(fresh[i])
+                    continue
+                # unaffected: the region is in the old file with the same centroid
+                ids_, distances, bound = old.nearest(code)
+                lists.append((np.array(ids_), np.array(distances), bound))
+            stats = {'regions': len(region_codes), 'rebuilt': len(redo), 'changed': changed, 'full': False}
+        arrays = _arrays(region_codes, centroids, lists, ids, coords, codes)
+        del old
+        write_index(path, arrays, k, radius)
+    return stats
+
+
+# --- reading ----------------------------------------------------------------------
+
+_index = None
+_index_key = None
+_index_lock = threading.Lock()
+
+
+def get_region_index():
+    """This worker's view of the index file, reopened when the file was replaced; None without one."""
+    global _index, _index_key
+    path = index_path()
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (path, st.st_ino, st.st_mtime_ns, st.st_size)
+    if key == _index_key:
+        return _index
+    with _index_lock:
+        if key != _index_key:
+            _index, _index_key = _read(path), key
+        return _index
+
+
+def region_distances(snapshot, region_q, candidates):
+    """
+    (distances, floor) for scoring ``candidates`` (snapshot rows) by proximity
+    to the centroid of region ``region_q``: km aligned with ``candidates``
+    (NaN for hospitals not in the region's list) and the list's bound. None
+    when the region does not resolve or has no list.
+    """
+    if not region_q or not region_distance_enabled():
+        return None
+    region = resolve_query(region_q)
+    if region is None:
+        return None
+    index = get_region_index()
+    if index is None:
+        return None
+    found = index.lookup(region)
+    if found is None:
+        return None
+    ids, distances, bound = found
+    rows = snapshot.rows_of(ids)
+    listed = rows >= 0
+    full = np.full(len(snapshot), np.nan)
+    full[rows[listed]] = distances[listed]
+    return full[candidates], bound
+
+
+# --- refresh on write -------------------------------------------------------------
+
+def is_stale(hospital, deleted=False):
+    """Does the index file hold another position (or region) for ``hospital`` than the one given?"""
+    index = get_region_index()
+    if index is None:
+        return False
+    stored = index.source(hospital.pk)
+    if deleted or hospital.latitude is None or hospital.longitude is None:
+        return stored is not None
+    codes = tuple(int(getattr(hospital, name)) if getattr(hospital, name) else 0 for name in CODE_FIELDS)
+    return stored != (float(hospital.latitude), float(hospital.longitude), codes)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_queued = False
+
+
+def _refresh_in_pool():
+    global _queued
+    with _pool_lock:
+        _queued = False
+    try:
+        stats = refresh()
+        if stats['rebuilt']:
+            # cached recommend results were scored with the old lists
+            from .snapshot import bump_snapshot_version
+            bump_snapshot_version()
+    except Exception:
+        logger.exception('region index refresh failed')
+    finally:
+        # the pool thread outlives requests: drop its connection like request_finished does
+        close_old_connections()
+
+
+def schedule_refresh():
+    """
+    Refresh the index in a background thread once the current transaction
+    commits (coalesced). Only an existing index is refreshed: building the
+    first one is left to ``build_region_index``.
+    """
+    if not auto_refresh() or get_region_index() is None:
+        return
+
+    def submit():
+        global _pool, _queued
+        with _pool_lock:
+            if _queued:
+                return
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='region-index')
+            _queued = True
+            pool = _pool
+        try:
+            pool.submit(_refresh_in_pool)
+        except RuntimeError:  # interpreter shutting down
+            with _pool_lock:
+                _queued = False
+
+    transaction.on_commit(submit)
@@ -0,0 +1,245 @@
+"""
+Administrative region codes (GB/T 2260, ``assets/areas.json``) for free-text regions.
+
+``Hospital.region`` is free text: "浙江省/杭州市/西湖区", "杭州市", "北京市/北京市/朝阳区",
+"广东省 深圳市". ``resolve`` maps it to a ``RegionCode`` (6-digit province /
+city / district codes, '' for levels it does not name); hospitals store the
+codes in indexed columns (``Hospital.refresh_region_codes``) and users the
+most specific code of their preferred region. A region filter then compares
+one code column (an index seek in SQL, a vectorized comparison on the
+snapshot) instead of testing every row's text.
+
+Matching walks the tree top-down. At each level the longest child name, full
+("浙江省") or short ("浙江"), that starts the remaining text is consumed;
+separators ('/', spaces, ',', '-') are skipped and a level may be left out
+("浙江省/西湖区"). Text that does not start with a province may start with a
+city or district whose name is unique nationwide. An ambiguous name ends the
+walk. Municipalities have no city level in areas.json: their districts are
+grouped under a city code ``<province><city>00`` taken from the district
+codes, named after the municipality for the main group, so the repeated
+"北京市/北京市" form resolves too.
+
+``resolve`` returns the codes of the longest resolvable prefix and whether
+the whole text was consumed (``complete``); region filters only use codes
+for complete queries and fall back to the text match otherwise.
+"""
+import json
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+
+CODE_FIELDS = ('province_code', 'city_code', 'district_code')
+# name suffixes dropped for the short form ("浙江省" -> "浙江"), longest first
+SUFFIXES = ('特别行政区', '维吾尔自治区', '壮族自治区', '回族自治区', '自治区', '自治州', '自治县',
+            '地区', '省', '市', '盟', '区', '县', '旗')
+SEPARATORS = ' \t/\\,，、-|>'
+# placeholder names in areas.json that never identify a place on their own
+PLACEHOLDERS = ('市辖区', '县', '省直辖县级行政区划', '自治区直辖县级行政区划')
+
+_CODE_RE = re.compile(r'^\d{6}$')
+
+
+class RegionCode(namedtuple('RegionCode', 'province city district complete')):
+    """Codes of a resolved region ('' for missing levels); ``complete``: the whole text matched."""
+
+    def lookup(self):
+        """(code field, code) of the most specific level."""
+        for field, code in zip(reversed(CODE_FIELDS), (self.district, self.city, self.province)):
+            if code:
+                return field, code
+        return None
+
+    @property
+    def code(self):
+        return self.district or self.city or self.province
+
+
+EMPTY = RegionCode('', '', '', False)
+
+
+class _Node:
+    __slots__ = ('code', 'name', 'level', 'parent', 'children', '_index', '_grandchildren')
+
+    def __init__(self, code, name, level, parent=None):
+        self.code = code
+        self.name = name
+        self.level = level
+        self.parent = parent
+        self.children = []
+        self._index = None
+        self._grandchildren = None
+
+    def index(self):
+        if self._index is None:
+            self._index = _name_index(self.children)
+        return self._index
+
+    def grandchildren_index(self):
+        if self._grandchildren is None:
+            self._grandchildren = _name_index([g for c in self.children for g in c.children])
+        return self._grandchildren
+
+    def path(self):
+        node, path = self, []
+        while node is not None:
+            path.append(node)
+            node = node.parent
+        return path[::-1]
+
+
+def short_name(name):
+    for suffix in SUFFIXES:
+        if name.endswith(suffix) and len(name) - len(suffix) >= 2:
+            return name[:-len(suffix)]
+    return None
+
+
+def _name_index(nodes):
+    """{name or short name: [(node, is full name)]} plus the longest key length."""
+    index = {}
+    for node in nodes:
+        if not node.name or node.name in PLACEHOLDERS:
+            continue
+        index.setdefault(node.name.lower(), []).append((node, True))
+        short = short_name(node.name)
+        if short is not None:
+            index.setdefault(short.lower(), []).append((node, False))
+    return index, max(map(len, index), default=0)
+
+
+class _Tree:
+    def __init__(self, data):
+        self.by_code = {}
+        self.provinces = []
+        for item in data:
+            province = self._add(item['code'], item['name'], 0, None)
+            self.provinces.append(province)
+            children = item.get('children') or []
+            if any(child.get('children') for child in children):
+                for city_item in children:
+                    city = self._add(city_item['code'], city_item['name'], 1, province)
+                    for district_item in city_item.get('children') or []:
+                        self._add(district_item['code'], district_item['name'], 2, city)
+            else:
+                # municipality: districts directly below the province, grouped into cities by code
+                for district_item in children:
+                    city_code = district_item['code'][:4] + '00'
+                    city = self.by_code.get(city_code)
+                    if city is None:
+                        name = province.name if city_code[2:4] == '01' else ''
+                        city = self._add(city_code, name, 1, province)
+                    self._add(district_item['code'], district_item['name'], 2, city)
+        self.province_index = _name_index(self.provinces)
+        self.city_index = _name_index([n for n in self.by_code.values() if n.level == 1])
+        self.district_index = _name_index([n for n in self.by_code.values() if n.level == 2])
+
+    def _add(self, code, name, level, parent):
+        node = _Node(code, name, level, parent)
+        self.by_code[code] = node
+        if parent is not None:
+            parent.children.append(node)
+        return node
+
+
+@lru_cache(maxsize=1)
+def _tree():
+    path = getattr(settings, 'REGION_AREAS_FILE', settings.BASE_DIR / 'assets' / 'areas.json')
+    with open(path, encoding='utf-8') as fh:
+        return _Tree(json.load(fh))
+
+
+def _skip(text, pos):
+    while pos < len(text) and text[pos] in SEPARATORS:
+        pos += 1
+    return pos
+
+
+def _match(index, text, pos):
+    """
+    (node, end) of the longest name in ``index`` starting at ``pos``; None if
+    absent or ambiguous. A short name must be followed by a separator or the
+    end of the text ("南京路" is not 南京市), a full name ends in its own suffix.
+    """
+    names, longest = index
+    for end in range(min(len(text), pos + longest), pos + 1, -1):
+        entries = names.get(text[pos:end])
+        if not entries:
+            continue
+        if end < len(text) and text[end] not in SEPARATORS:
+            entries = [e for e in entries if e[1]]
+            if not entries:
+                continue
+        nodes = {id(node): node for node, _ in entries}
+        return (entries[0][0], end) if len(nodes) == 1 else None
+    return None
+
+
+def _codes(node, complete):
+    codes = ['', '', '']
+    for n in node.path():
+        codes[n.level] = n.code
+    return RegionCode(*codes, complete)
+
+
+@lru_cache(maxsize=8192)
+def resolve(text):
+    """RegionCode of free-text ``text`` (EMPTY when nothing matches)."""
+    text = (text or '').strip().lower()
+    tree = _tree()
+    pos = _skip(text, 0)
+    if pos == len(text):
+        return EMPTY
+    found = (_match(tree.province_index, text, pos) or _match(tree.city_index, text, pos)
+             or _match(tree.district_index, text, pos))
+    if found is None:
+        return EMPTY
+    node, pos = found
+    while node.children:
+        pos = _skip(text, pos)
+        if pos == len(text):
+            break
+        found = _match(node.index(), text, pos) or _match(node.grandchildren_index(), text, pos)
+        if found is None:
+            break
+        node, pos = found
+    return _codes(node, _skip(text, pos) == len(text))
+
+
+def resolve_code(code):
+    """RegionCode of a 6-digit area code (None when unknown)."""
+    node = _tree().by_code.get(str(code))
+    return None if node is None else _codes(node, True)
+
+
+def region_label(codes):
+    """
+    Area names of ``codes`` joined by '/', as the frontend cascader labels
+    them: "浙江省/杭州市/西湖区", "北京市/朝阳区" (no grouped municipal city level).
+    """
+    node = _tree().by_code.get(codes.code)
+    if node is None:
+        return ''
+    names = [n.name for n in node.path() if n.name and (n.parent is None or n.name != n.parent.name)]
+    return '/'.join(names)
+
+
+def resolve_query(value):
+    """
+    RegionCode for a region filter: free text, a 6-digit code or a cascader
+    value list (codes, most specific last). None unless it resolves completely.
+    """
+    if isinstance(value, (list, tuple)):
+        for item in reversed(value):
+            code = resolve_code(item) if item not in (None, '') else None
+            if code is not None:
+                return code
+        return None
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    if _CODE_RE.match(value):
+        return resolve_code(value)
+    code = resolve(value)
+    return code if code.complete else None
@@ -0,0 +1,177 @@
+"""
+Result cache for the recommend endpoints.
+
+Keys are built from a canonical form of the patient payload (validated by
+``PatientPayloadSerializer``, text case-folded, coordinates snapped to a
+``RECOMMEND_CACHE_GRID_DEG`` grid) plus the hospital-table version, so a
+snapshot version bump makes every older entry unreachable. Scored endpoints
+also key on the fingerprint of the scoring weights (see ``hospital.weights``),
+so a profile change only misses the payloads it applies to. Views score the
+canonical payload itself, which keeps a cached response identical to what a
+fresh computation for that key would return.
+
+Lookups go through a small per-worker LRU first and the shared Django cache
+(Redis) second; both honour ``RECOMMEND_CACHE_TTL``.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from recommend.serializers import PatientPayloadSerializer
+
+RESULT_KEY = 'hospital:recommend:result:{}'
+
+
+def cache_enabled():
+    return getattr(settings, 'RECOMMEND_CACHE_ENABLED', True)
+
+
+def cache_ttl():
+    return getattr(settings, 'RECOMMEND_CACHE_TTL', 300)
+
+
+def cache_grid_deg():
+    return getattr(settings, 'RECOMMEND_CACHE_GRID_DEG', 0.01)
+
+
+def local_cache_size():
+    return getattr(settings, 'RECOMMEND_CACHE_LOCAL_SIZE', 256)
+
+
+def _quantize(value, grid):
+    if not grid:
+        return value
+    # round() drops the float noise of the multiplication (0.1 * 3 -> 0.3)
+    return round(round(value / grid) * grid, 9)
+
+
+def canonical_payload(data):
+    """
+    Canonical, validated form of a recommend payload, or None when the payload
+    does not validate (such requests bypass the cache).
+    """
+    serializer = PatientPayloadSerializer(data=data or {})
+    if not serializer.is_valid():
+        return None
+    grid = cache_grid_deg()
+    canonical = {}
+    for name, value in serializer.validated_data.items():
+        if isinstance(value, str):
+            value = value.strip().casefold()
+            if not value:
+                continue
+        elif name in ('user_lat', 'user_lng'):
+            value = _quantize(value, grid)
+        canonical[name] = value
+    return canonical
+
+
+def make_key(endpoint, canonical, version, **params):
+    """Cache key for ``canonical`` on ``endpoint`` at hospital-table ``version``."""
+    raw = json.dumps({'e': endpoint, 'v': version, 'p': canonical, 'q': params},
+                     sort_keys=True, ensure_ascii=False, default=str)
+    return RESULT_KEY.format(hashlib.sha1(raw.encode('utf-8')).hexdigest())
+
+
+class RecommendResultCache:
+    """Two-level (local LRU + shared cache) store with hit/miss counters."""
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def _local_get(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return value
+
+    def _local_set(self, key, value, ttl):
+        maxsize = self.maxsize if self.maxsize is not None else local_cache_size()
+        if maxsize <= 0:
+            return
+        with self._lock:
+            self._local[key] = (time.monotonic() + ttl, value)
+            self._local.move_to_end(key)
+            while len(self._local) > maxsize:
+                self._local.popitem(last=False)
+
+    def get(self, key):
+        value = self._local_get(key)
+        if value is not None:
+            self.local_hits += 1
+            return value
+        value = cache.get(key)
+        if value is not None:
+            self.shared_hits += 1
+            self._local_set(key, value, cache_ttl())
+            return value
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        ttl = cache_ttl()
+        cache.set(key, value, timeout=ttl)
+        self._local_set(key, value, ttl)
+
+    async def aget(self, key):
+        """``get`` for async views: local hits never leave the event loop."""
+        value = self._local_get(key)
+        if value is not None:
+            self.local_hits += 1
+            return value
+        value = await cache.aget(key)
+        if value is not None:
+            self.shared_hits += 1
+            self._local_set(key, value, cache_ttl())
+            return value
+        self.misses += 1
+        return None
+
+    async def aset(self, key, value):
+        ttl = cache_ttl()
+        await cache.aset(key, value, timeout=ttl)
+        self._local_set(key, value, ttl)
+
+    def clear_local(self):
+        with self._lock:
+            self._local.clear()
+
+    def stats(self):
+        hits = self.local_hits + self.shared_hits
+        total = hits + self.misses
+        return {
+            'local_hits': self.local_hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'hit_ratio': round(hits / total, 4) if total else 0.0,
+            'local_size': len(self._local),
+        }
+
+
+result_cache = RecommendResultCache()
+
+
+def cache_metrics():
+    """Counters of this worker's ``result_cache`` for ``backend.instrumentation``."""
+    stats = result_cache.stats()
+    return [
+        ('recommend_cache_local_hits_total', stats['local_hits']),
+        ('recommend_cache_shared_hits_total', stats['shared_hits']),
+        ('recommend_cache_misses_total', stats['misses']),
+    ]
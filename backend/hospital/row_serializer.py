@@ -0,0 +1,152 @@
+"""
+Read-only fast path for serializing hospitals in list / recommend responses.
+
+``HospitalSerializer`` builds a field tree per instance, runs every value
+through its DRF field and, per row, imports ``compute_hospital_base_score``
+for ``composite_score`` and re-parses the user coordinates for
+``distance_km``. ``HospitalRowSerializer`` produces the same dicts (same keys,
+order and value formatting) from
+
+  - ``HospitalSnapshot`` columns, with ``composite_score`` from the snapshot's
+    base-score array and ``distance_km`` from distances the caller already has
+    (the scorer's), or
+  - ``QuerySet.values()`` dicts, with the coordinates parsed once per request.
+
+Only plain DRF fields whose output is the raw value are short-circuited; the
+rest (datetimes, choices) still go through the DRF field's
+``to_representation``.
+"""
+import math
+
+from rest_framework import fields as drf_fields
+
+from .models import Hospital
+from .scoring import haversine_km_array
+from .serializers import HospitalSerializer
+from .utils import haversine_km, weights_fingerprint
+
+COMPUTED_FIELDS = ('composite_score', 'distance_km')
+
+_formatters = None
+
+
+def _field_formatters():
+    """field name -> to_representation of the model fields of HospitalSerializer (built once)."""
+    global _formatters
+    if _formatters is None:
+        formatters = {}
+        for name, field in HospitalSerializer().fields.items():
+            if name in COMPUTED_FIELDS:
+                continue
+            if type(field) is drf_fields.FloatField:
+                formatters[name] = float
+            elif type(field) is drf_fields.IntegerField:
+                formatters[name] = int
+            elif type(field) is drf_fields.CharField:
+                formatters[name] = str
+            else:
+                formatters[name] = field.to_representation
+        _formatters = formatters
+    return _formatters
+
+
+def _round_or_none(value, digits):
+    if value is None:
+        return None
+    value = float(value)
+    if not math.isfinite(value):
+        return None
+    return round(value, digits)
+
+
+def request_coords(request):
+    """(user_lat, user_lng) from the query string or body, as HospitalSerializer reads them."""
+    if request is None:
+        return None
+    try:
+        data = getattr(request, 'data', None) or {}
+        user_lat = request.query_params.get('user_lat') or data.get('user_lat')
+        user_lng = request.query_params.get('user_lng') or data.get('user_lng')
+        if user_lat is None or user_lng is None:
+            return None
+        return float(user_lat), float(user_lng)
+    except Exception:
+        return None
+
+
+class HospitalRowSerializer:
+    """
+    Serialize hospitals to the ``HospitalSerializer`` output format.
+      - fields: subset of ``HospitalSerializer.Meta.fields`` (all when None)
+      - weights: scoring weights for ``composite_score`` (``score_weights`` context)
+    """
+
+    def __init__(self, fields=None, weights=None):
+        self.names = [f for f in HospitalSerializer.Meta.fields if fields is None or f in fields]
+        formatters = _field_formatters()
+        self.model_fields = [(name, formatters[name]) for name in self.names if name not in COMPUTED_FIELDS]
+        self.weights = weights
+
+    def _row(self, values, composite, distance):
+        data = {}
+        for name in self.names:
+            if name == 'composite_score':
+                data[name] = composite
+            elif name == 'distance_km':
+                data[name] = distance
+            else:
+                data[name] = values[name]
+        return data
+
+    def from_snapshot(self, snapshot, rows, distances=None):
+        """
+        Row dicts for snapshot rows ``rows``. ``distances`` (km, NaN when
+        unknown) aligned with ``rows``; distance_km is None without it.
+        """
+        columns = [(name, fmt, snapshot.python_column(name)) for name, fmt in self.model_fields]
+        scores = snapshot.base_scores(self.weights) if 'composite_score' in self.names else None
+        results = []
+        for pos, i in enumerate(rows):
+            values = {}
+            for name, fmt, column in columns:
+                v = column[i]
+                values[name] = None if v is None else fmt(v)
+            composite = _round_or_none(scores[i], 4) if scores is not None else None
+            distance = _round_or_none(distances[pos], 3) if distances is not None else None
+            results.append(self._row(values, composite, distance))
+        return results
+
+    def snapshot_distances(self, snapshot, rows, coords):
+        """Distances (km) from ``coords`` to snapshot rows ``rows`` (None without coordinates)."""
+        if coords is None or 'distance_km' not in self.names:
+            return None
+        lat, lng = coords
+        return haversine_km_array(lat, lng, snapshot.columns.latitude[rows], snapshot.columns.longitude[rows])
+
+    def from_values(self, values_rows, coords=None):
+        """Row dicts for ``Hospital.objects.values()`` dicts (all concrete fields)."""
+        fingerprint = weights_fingerprint()
+        want_composite = 'composite_score' in self.names
+        want_distance = coords is not None and 'distance_km' in self.names
+        results = []
+        for raw in values_rows:
+            values = {}
+            for name, fmt in self.model_fields:
+                v = raw[name]
+                values[name] = None if v is None else fmt(v)
+            composite = None
+            if want_composite:
+                if self.weights is None and raw['base_score'] is not None and raw['base_score_weights'] == fingerprint:
+                    composite = _round_or_none(raw['base_score'], 4)
+                else:
+                    composite = _round_or_none(Hospital(**raw).composite_score(weights=self.weights), 4)
+            distance = None
+            if want_distance and raw['latitude'] is not None and raw['longitude'] is not None:
+                distance = round(haversine_km(coords[0], coords[1], raw['latitude'], raw['longitude']), 3)
+            results.append(self._row(values, composite, distance))
+        return results
+
+
+def values_fields():
+    """Field names to pass to ``QuerySet.values()`` for ``HospitalRowSerializer.from_values``."""
+    return [f.attname for f in Hospital._meta.concrete_fields]
@@ -0,0 +1,417 @@
+"""
+Vectorized batch scoring for hospital recommendations.
+
+``compute_recommendation_score`` in ``hospital.utils`` scores one ``Hospital``
+at a time. The functions here evaluate the very same formula for a whole
+candidate set at once: the scoring columns are loaded into NumPy arrays
+(``HospitalColumns``) and every stage (base score, distance factor, cost
+compatibility, urgency, wait penalty, bed bonus) runs as one array operation.
+
+The per-row ``score_breakdown`` dict is only materialized on demand
+(``BatchScores.breakdown``), so callers that return a page of results never
+pay for building dicts of rows they discard.
+"""
+import math
+
+import numpy as np
+
+from .specialty import specialty_matches
+from .utils import DEFAULT_WEIGHTS
+
+# Numeric Hospital columns read by the scorer.
+NUMERIC_FIELDS = (
+    'latitude', 'longitude', 'avg_cost', 'bed_count', 'grade_level',
+    'specialty_score', 'equipment_score', 'reputation_index',
+    'success_rate', 'avg_wait_hours',
+)
+# distance at which the distance factor reaches 0
+PROXIMITY_RANGE_KM = 200.0
+
+
+def _as_float_array(values):
+    """Convert an iterable of optional numbers into float64, with NaN for None."""
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+class HospitalColumns:
+    """
+    Column-oriented view of the hospital fields the scorer reads.
+
+    Nullable model fields are stored as NaN so "field is None" checks of the
+    scalar path become ``np.isnan`` masks. ``region`` and ``specialty`` are
+    plain lists of strings (empty string for blank values).
+    """
+
+    NUMERIC_FIELDS = NUMERIC_FIELDS
+
+    def __init__(self, ids, region, specialty, **numeric):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.region = list(region)
+        self.specialty = list(specialty)
+        for name in self.NUMERIC_FIELDS:
+            values = numeric[name]
+            if isinstance(values, np.ndarray):
+                values = values.astype(np.float64, copy=False)
+            else:
+                values = _as_float_array(values)
+            setattr(self, name, values)
+
+    @classmethod
+    def from_hospitals(cls, hospitals):
+        """Build columns from an iterable of ``Hospital`` instances."""
+        hospitals = list(hospitals)
+        numeric = {
+            name: [getattr(h, name) for h in hospitals]
+            for name in cls.NUMERIC_FIELDS
+        }
+        return cls(
+            ids=[h.pk for h in hospitals],
+            region=[h.region or '' for h in hospitals],
+            specialty=[h.specialty or '' for h in hospitals],
+            **numeric,
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def take(self, indices):
+        """Return a new HospitalColumns restricted to the given row indices."""
+        indices = np.asarray(indices, dtype=np.int64)
+        numeric = {name: getattr(self, name)[indices] for name in self.NUMERIC_FIELDS}
+        return HospitalColumns(
+            ids=self.ids[indices],
+            region=[self.region[i] for i in indices.tolist()],
+            specialty=[self.specialty[i] for i in indices.tolist()],
+            **numeric,
+        )
+
+
+def normalize_array(values, from_min, from_max):
+    """Array version of ``hospital.utils.normalize`` (NaN inputs must be filled by the caller)."""
+    if from_max == from_min:
+        return np.zeros_like(values, dtype=np.float64)
+    v = (values - from_min) / (from_max - from_min)
+    return np.maximum(0.0, np.minimum(1.0, v))
+
+
+def haversine_km_array(lat1, lon1, lat2, lon2):
+    """Haversine distance (km) from one point to arrays of points."""
+    R = 6371.0
+    phi1 = math.radians(lat1)
+    phi2 = np.radians(lat2)
+    dphi = np.radians(lat2 - lat1)
+    dlambda = np.radians(lon2 - lon1)
+    a = np.sin(dphi / 2) ** 2 + math.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return R * c
+
+
+def _or_default(values, default):
+    """Mimic ``value or default`` for a float column (None/NaN and 0 fall back)."""
+    return np.where(np.isnan(values) | (values == 0), default, values)
+
+
+def _is_default(values, default):
+    """Mimic ``value if value is not None else default`` for a float column."""
+    return np.where(np.isnan(values), default, values)
+
+
+def compute_base_scores(columns, weights=None):
+    """
+    Vectorized ``compute_hospital_base_score`` for every row of ``columns``.
+    Returns a float64 array of scores 0..100.
+    """
+    if weights is None:
+        weights = DEFAULT_WEIGHTS
+
+    grade_norm = _or_default(columns.grade_level, 0.0) / 3.0
+    specialty_norm = _or_default(columns.specialty_score, 50.0) / 100.0
+    equipment_norm = _or_default(columns.equipment_score, 50.0) / 100.0
+    reputation_norm = _or_default(columns.reputation_index, 50.0) / 100.0
+    success_norm = _is_default(columns.success_rate, 0.8)
+    bed_norm = normalize_array(_or_default(columns.bed_count, 0.0), 0, 1000)
+    wait_norm = 1.0 - normalize_array(_is_default(columns.avg_wait_hours, 4.0), 0, 24)
+    cost_norm = 1.0 - normalize_array(_is_default(columns.avg_cost, 2000.0), 0, 20000)
+
+    # Same accumulation order as the scalar path so results agree bit for bit.
+    score = np.zeros(len(columns), dtype=np.float64)
+    score += weights.get('grade', 0) * grade_norm
+    score += weights.get('specialty_score', 0) * specialty_norm
+    score += weights.get('success_rate', 0) * success_norm
+    score += weights.get('equipment_score', 0) * equipment_norm
+    score += weights.get('reputation', 0) * reputation_norm
+    score += weights.get('avg_wait_hours', 0) * wait_norm
+    score += weights.get('bed_count', 0) * bed_norm
+    score += weights.get('avg_cost', 0) * cost_norm
+
+    return np.maximum(0.0, np.minimum(100.0, score * 100.0))
+
+
+def _parse_user_coords(user_payload):
+    """
+    Return (coords_given, lat, lng). ``lat``/``lng`` are None when the payload
+    carries coordinates that cannot be used (the scalar path swallows those errors).
+    """
+    user_lat = user_payload.get('user_lat')
+    user_lng = user_payload.get('user_lng')
+    if user_lat is None or user_lng is None:
+        return False, None, None
+    try:
+        lat = float(user_lat)
+        lng = float(user_lng)
+    except (TypeError, ValueError):
+        return True, None, None
+    if not (math.isfinite(lat) and math.isfinite(lng)):
+        return True, None, None
+    return True, lat, lng
+
+
+def region_match_mask(columns, user_region, rows=None):
+    """
+    Boolean mask of rows whose region contains ``user_region`` (case-insensitive).
+    With ``rows`` (row indices) the mask covers only those rows, in that order.
+    """
+    needle = user_region.strip().lower()
+    if rows is None:
+        regions, count = columns.region, len(columns)
+    else:
+        regions, count = (columns.region[i] for i in rows.tolist()), len(rows)
+    return np.fromiter((bool(r) and needle in r.lower() for r in regions), dtype=bool, count=count)
+
+
+def specialty_match_mask(columns, disease_name, disease_code):
+    """
+    Boolean mask of rows whose specialty matches the disease (row by row).
+    Callers holding a ``SpecialtyIndex`` should pass its mask to ``score_hospitals`` instead.
+    """
+    if not disease_name and not disease_code:
+        return np.zeros(len(columns), dtype=bool)
+    return np.fromiter((specialty_matches(s, disease_name, disease_code) for s in columns.specialty),
+                       dtype=bool, count=len(columns))
+
+
+class BatchScores:
+    """
+    Result of ``score_hospitals``: final scores plus the per-stage arrays needed
+    to rebuild each row's ``score_breakdown``. Stages that were not applied to a
+    row hold NaN (numeric stages) or False (flag stages).
+    """
+
+    _ARRAYS = ('final', 'base', 'distance_km', 'distance_factor', 'region_boost',
+               'cost_compat', 'specialty_match', 'wait_penalty', 'bed_bonus')
+
+    def __init__(self, final, base, distance_km, distance_factor, region_boost,
+                 cost_compat, urgency_boost, specialty_match, wait_penalty, bed_bonus,
+                 distance_origin=None):
+        self.final = final
+        self.base = base
+        self.distance_km = distance_km
+        self.distance_factor = distance_factor
+        # None: distances from the user's coordinates; 'region': from the region centroid
+        self.distance_origin = distance_origin
+        self.region_boost = region_boost
+        self.cost_compat = cost_compat
+        self.urgency_boost = urgency_boost
+        self.specialty_match = specialty_match
+        self.wait_penalty = wait_penalty
+        self.bed_bonus = bed_bonus
+
+    def __len__(self):
+        return len(self.final)
+
+    def take(self, indices):
+        """Return a new BatchScores restricted to the given row indices."""
+        indices = np.asarray(indices, dtype=np.int64)
+        arrays = {name: getattr(self, name)[indices] for name in self._ARRAYS}
+        return BatchScores(urgency_boost=self.urgency_boost, distance_origin=self.distance_origin, **arrays)
+
+    @classmethod
+    def concatenate(cls, parts):
+        """Join the BatchScores of consecutive row ranges (same payload) into one."""
+        arrays = {name: np.concatenate([getattr(p, name) for p in parts]) for name in cls._ARRAYS}
+        return cls(urgency_boost=parts[0].urgency_boost, distance_origin=parts[0].distance_origin, **arrays)
+
+    def score(self, i):
+        return float(self.final[i])
+
+    def breakdown(self, i):
+        """Build the ``score_breakdown`` dict of row ``i`` (same keys/order as the scalar path)."""
+        breakdown = {'base': round(float(self.base[i]), 4)}
+        distance_factor = float(self.distance_factor[i])
+        if not math.isnan(distance_factor):
+            # region centroid distances are unknown beyond the precomputed list (factor from its bound)
+            distance_km = float(self.distance_km[i])
+            if not math.isnan(distance_km):
+                key = 'distance_km' if self.distance_origin is None else 'region_distance_km'
+                breakdown[key] = round(distance_km, 3)
+            breakdown['distance_factor'] = round(distance_factor, 4)
+        elif self.region_boost[i]:
+            breakdown['region_match_boost'] = 0.03
+        cost_compat = float(self.cost_compat[i])
+        if not math.isnan(cost_compat):
+            breakdown['cost_compat'] = round(cost_compat, 4)
+        if self.urgency_boost is not None:
+            breakdown['urgency_boost'] = self.urgency_boost
+        specialty_match = float(self.specialty_match[i])
+        if specialty_match:
+            breakdown['specialty_match'] = round(specialty_match, 4)
+        if self.wait_penalty[i]:
+            breakdown['wait_penalty'] = 0.95
+        bed_bonus = float(self.bed_bonus[i])
+        if not math.isnan(bed_bonus):
+            breakdown['bed_bonus'] = round(bed_bonus, 4)
+        breakdown['final'] = round(float(self.final[i]), 4)
+        return breakdown
+
+
+def score_hospitals(columns, user_payload, weights=None, base_scores=None, specialty_rows=None,
+                    region_rows=None, distances=None, distance_floor=None):
+    """
+    Vectorized ``compute_recommendation_score`` over every row of ``columns``.
+
+    ``base_scores`` may be passed when the caller already holds the output of
+    ``compute_base_scores`` for the same weights, ``specialty_rows`` when it
+    already knows which rows match the disease (e.g. from a ``SpecialtyIndex``),
+    ``region_rows`` when it already knows which rows are in the payload region
+    (``region_match_mask``, or the code-based ``HospitalSnapshot.region_mask``)
+    (then ``columns.region`` / ``columns.specialty`` are not read).
+    ``distances`` (km from the region centroid, NaN beyond the precomputed
+    list, see ``hospital.region_index``) score a payload without coordinates
+    by proximity; rows without a distance (beyond the list, or without
+    coordinates) use ``distance_floor``, so every candidate gets a distance
+    factor and none falls back to the region boost.
+    Returns a ``BatchScores``.
+    """
+    if weights is None:
+        weights = DEFAULT_WEIGHTS
+
+    n = len(columns)
+    base = compute_base_scores(columns, weights) if base_scores is None else base_scores
+    score = base.copy()
+    nan_column = np.full(n, np.nan)
+
+    # Distance factor (rows with coordinates on both sides), else the region boost.
+    coords_given, user_lat, user_lng = _parse_user_coords(user_payload)
+    has_coords = ~(np.isnan(columns.latitude) | np.isnan(columns.longitude))
+    distance_km = nan_column.copy()
+    distance_factor = nan_column.copy()
+    d = None
+    distance_origin = None
+    if distances is not None and not coords_given:
+        # candidates are all inside the region: a hospital without coordinates is
+        # scored as the farthest listed one rather than boosted past the located ones
+        distance_rows = np.ones(n, dtype=bool)
+        if n:
+            known = distances
+            d = np.where(np.isnan(known), distance_floor, known)
+            distance_origin = 'region'
+    else:
+        distance_rows = has_coords if coords_given else np.zeros(n, dtype=bool)
+        if user_lat is not None and distance_rows.any():
+            d = known = haversine_km_array(user_lat, user_lng,
+                                           columns.latitude[distance_rows], columns.longitude[distance_rows])
+    if d is not None:
+        prox = 1.0 - normalize_array(d, 0, PROXIMITY_RANGE_KM)
+        dist_weight = weights.get('distance', 0)
+        s = score[distance_rows]
+        score[distance_rows] = s * (1.0 - dist_weight) + (s * dist_weight * prox)
+        distance_km[distance_rows] = known
+        distance_factor[distance_rows] = prox
+
+    region_boost = np.zeros(n, dtype=bool)
+    user_region = user_payload.get('region')
+    if user_region and isinstance(user_region, str) and user_region.strip():
+        if region_rows is None:
+            region_rows = region_match_mask(columns, user_region)
+        region_boost = ~distance_rows & region_rows
+        score = np.where(region_boost, score + 0.03 * score, score)
+
+    # Economic compatibility.
+    cost_compat = nan_column.copy()
+    econ = user_payload.get('economic_level')
+    if econ is not None:
+        if econ == 0:
+            target = 1500.0
+        elif econ == 1:
+            target = 5000.0
+        else:
+            target = 15000.0
+        cost_rows = ~np.isnan(columns.avg_cost)
+        diff = np.abs(_or_default(columns.avg_cost, 0.0) - target)
+        compat = 1.0 - normalize_array(diff, 0, target * 2 if target > 0 else 10000)
+        cost_weight = weights.get('avg_cost', 0)
+        score = np.where(cost_rows, score * (1.0 - cost_weight) + score * cost_weight * compat, score)
+        cost_compat[cost_rows] = compat[cost_rows]
+
+    # Urgency boost applies uniformly.
+    urgency = user_payload.get('urgency')
+    urgency_boost = None
+    if urgency == 'emergency':
+        urgency_boost = 1.06
+    elif urgency == 'urgent':
+        urgency_boost = 1.03
+    if urgency_boost is not None:
+        score = score * urgency_boost
+
+    # Specialty match boost.
+    disease_name = (user_payload.get('disease_name') or '') or ''
+    disease_code = (user_payload.get('disease_code') or '') or ''
+    if specialty_rows is None:
+        matched = specialty_match_mask(columns, disease_name, disease_code)
+    else:
+        matched = specialty_rows
+    specialty_match = np.where(matched, np.minimum(1.0, _or_default(columns.specialty_score, 50.0) / 100.0), 0.0)
+    spec_rows = specialty_match != 0
+    if spec_rows.any():
+        spec_weight = weights.get('specialty_score', 0)
+        score = np.where(spec_rows,
+                         score * (1.0 - spec_weight) + score * spec_weight * (1.0 + specialty_match * 0.2),
+                         score)
+
+    # Long waits are penalized for emergencies.
+    if urgency == 'emergency':
+        wait_penalty = ~np.isnan(columns.avg_wait_hours) & (columns.avg_wait_hours > 6)
+        score = np.where(wait_penalty, score * 0.95, score)
+    else:
+        wait_penalty = np.zeros(n, dtype=bool)
+
+    # Bed count bonus (up to +2%).
+    bed_rows = ~np.isnan(columns.bed_count) & (columns.bed_count != 0)
+    bonus = normalize_array(_or_default(columns.bed_count, 0.0), 0, 1000) * 0.02
+    score = np.where(bed_rows, score * (1.0 + bonus), score)
+    bed_bonus = np.where(bed_rows, bonus, np.nan)
+
+    final = np.maximum(0.0, np.minimum(100.0, score))
+    return BatchScores(
+        final=final,
+        base=base,
+        distance_km=distance_km,
+        distance_factor=distance_factor,
+        region_boost=region_boost,
+        cost_compat=cost_compat,
+        urgency_boost=urgency_boost,
+        specialty_match=specialty_match,
+        wait_penalty=wait_penalty,
+        bed_bonus=bed_bonus,
+        distance_origin=distance_origin,
+    )
+
+
+def top_k_indices(values, k):
+    """
+    Indices of the ``k`` largest ``values`` in descending order.
+
+    Uses partial selection (``np.partition``) so only the selected rows are
+    sorted. Ties keep ascending index order, exactly like a stable full sort
+    with ``reverse=True``, so paging through the result is deterministic.
+    """
+    n = len(values)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    neg = -values
+    if k >= n:
+        return np.argsort(neg, kind='stable')
+    kth = np.partition(neg, k - 1)[k - 1]
+    candidates = np.flatnonzero(neg <= kth)
+    order = candidates[np.argsort(neg[candidates], kind='stable')]
+    return order[:k]
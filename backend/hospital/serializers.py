@@ -19,6 +19,14 @@ class HospitalSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ('created_at', 'updated_at', 'composite_score', 'distance_km')
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # context['fields'] (list view ?fields=) trims the output; dropped method fields are not computed
+        only = self.context.get('fields')
+        if only:
+            for name in set(self.fields) - set(only):
+                self.fields.pop(name)
+
     def get_composite_score(self, obj):
         # Allow caller to pass weight config in serializer context to compute score similarly to recommend
         weights = self.context.get('score_weights')
@@ -33,14 +41,18 @@ class HospitalSerializer(serializers.ModelSerializer):
             return None
 
     def get_distance_km(self, obj):
+        # explicit coordinates in the context win over the request (e.g. paging a cached ranking)
+        user_lat = self.context.get('user_lat')
+        user_lng = self.context.get('user_lng')
         req = self.context.get('request')
-        if not req:
-            return None
-        try:
-            user_lat = req.query_params.get('user_lat') or req.data.get('user_lat') if hasattr(req, 'data') else None
-            user_lng = req.query_params.get('user_lng') or req.data.get('user_lng') if hasattr(req, 'data') else None
-        except Exception:
-            user_lat = user_lng = None
+        if user_lat is None or user_lng is None:
+            if not req:
+                return None
+            try:
+                user_lat = req.query_params.get('user_lat') or req.data.get('user_lat') if hasattr(req, 'data') else None
+                user_lng = req.query_params.get('user_lng') or req.data.get('user_lng') if hasattr(req, 'data') else None
+            except Exception:
+                user_lat = user_lng = None
         if user_lat is None or user_lng is None:
             return None
         try:
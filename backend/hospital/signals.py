@@ -0,0 +1,29 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Hospital, ScoringProfile
+from .region_index import is_stale, schedule_refresh
+from .snapshot import bump_snapshot_version
+from .weights import bump_weights_version
+
+
+@receiver(post_save, sender=Hospital)
+@receiver(post_delete, sender=Hospital)
+def invalidate_hospital_snapshot(sender, **kwargs):
+    """Any hospital write makes the per-worker snapshots stale."""
+    bump_snapshot_version()
+
+
+@receiver(post_save, sender=Hospital)
+@receiver(post_delete, sender=Hospital)
+def refresh_region_index(sender, instance, **kwargs):
+    """A hospital that moved (or changed region, or was deleted) refreshes the region centroid lists."""
+    if is_stale(instance, deleted=kwargs['signal'] is post_delete):
+        schedule_refresh()
+
+
+@receiver(post_save, sender=ScoringProfile)
+@receiver(post_delete, sender=ScoringProfile)
+def reload_scoring_profiles(sender, **kwargs):
+    """Any profile write makes the per-worker profile tables stale."""
+    bump_weights_version()
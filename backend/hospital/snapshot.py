@@ -0,0 +1,324 @@
+"""
+Per-worker, read-only snapshot of the ``Hospital`` table.
+
+Recommend requests used to run ``list(Hospital.objects.all())`` on every call.
+Instead, each worker process keeps one ``HospitalSnapshot``: scoring fields as
+NumPy columns (``HospitalColumns``), text fields as interned string lists.
+
+Freshness is driven by a version counter stored in the default cache (Redis in
+production). ``post_save``/``post_delete`` on ``Hospital`` bump the counter once
+the surrounding transaction commits (see ``hospital.signals``); every worker
+compares its snapshot version with the counter on access and rebuilds when they
+differ. Code that writes hospitals without signals (``queryset.update()``,
+``bulk_create``) must call ``bump_snapshot_version()`` itself. While the cache
+is unreachable there is no version to compare: snapshots then live at most
+``HOSPITAL_SNAPSHOT_OUTAGE_TTL`` seconds.
+
+Rebuilds go through the host's feature store (``hospital.feature_store``): one
+worker queries the table per version, the others map the file it wrote.
+"""
+import logging
+import sys
+import threading
+import time
+from functools import cached_property
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from . import flatfile
+from .feature_store import read_store, store_enabled, store_path, write_store
+from .models import Hospital
+from .regions import CODE_FIELDS, resolve_query
+from .scoring import HospitalColumns, compute_base_scores
+from .spatial import GridIndex
+from .specialty import SpecialtyIndex
+from .utils import weights_fingerprint
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION_KEY = 'hospital:snapshot:version'
+
+# Text columns are interned so repeated values (regions, specialties) share memory.
+TEXT_FIELDS = ('name', 'region', 'specialty', 'address', 'contact', 'base_score_weights') + CODE_FIELDS
+DATETIME_FIELDS = ('created_at', 'updated_at')
+INTEGER_FIELDS = ('grade_level', 'bed_count')
+# Numeric columns kept next to (not inside) the scorer's HospitalColumns.
+EXTRA_NUMERIC_FIELDS = ('base_score',)
+
+
+def outage_ttl():
+    return getattr(settings, 'HOSPITAL_SNAPSHOT_OUTAGE_TTL', 5.0)
+
+
+def _new_version():
+    return time.time_ns()
+
+
+def get_snapshot_version():
+    """
+    Current hospital-table version from the shared cache (initialized on first
+    use), or None when the cache is unreachable.
+    """
+    version = cache.get(SNAPSHOT_VERSION_KEY)
+    if version is None:
+        cache.add(SNAPSHOT_VERSION_KEY, _new_version(), timeout=None)
+        version = cache.get(SNAPSHOT_VERSION_KEY)
+    return version
+
+
+def _bump():
+    try:
+        cache.incr(SNAPSHOT_VERSION_KEY)
+    except ValueError:
+        # key missing (evicted / never set): start from a fresh, non-reused value
+        cache.set(SNAPSHOT_VERSION_KEY, _new_version(), timeout=None)
+
+
+def bump_snapshot_version():
+    """Invalidate every worker's snapshot once the current transaction commits."""
+    transaction.on_commit(_bump)
+
+
+class HospitalSnapshot:
+    """
+    Immutable in-memory copy of the hospital table.
+
+    Rows keep the default ``Hospital`` ordering, so row ``i`` here is the i-th
+    object of ``Hospital.objects.all()`` at build time. ``data`` maps every
+    field to its column: ORM values, or arrays (kept as they are, e.g. views
+    into the feature store) for the id and numeric fields. ``prepared``: the
+    columns come from the feature store, text as interned str (no NULLs) and
+    datetimes as ``DatetimeColumn``, and are used as they are.
+    """
+
+    def __init__(self, version, field_names, data, prepared=False):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.field_names = tuple(field_names)
+
+        for name in TEXT_FIELDS:
+            values = data[name]
+            setattr(self, name, values if prepared else [sys.intern(v) if v else '' for v in values])
+        for name in DATETIME_FIELDS:
+            setattr(self, name, data[name] if prepared else list(data[name]))
+        for name in EXTRA_NUMERIC_FIELDS:
+            values = data[name]
+            if not isinstance(values, np.ndarray):
+                values = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+            setattr(self, name, values)
+
+        self.columns = HospitalColumns(
+            ids=np.asarray(data['id'], dtype=np.int64),
+            region=self.region,
+            specialty=self.specialty,
+            **{name: data[name] if isinstance(data[name], np.ndarray) else list(data[name])
+               for name in HospitalColumns.NUMERIC_FIELDS},
+        )
+        self.ids = self.columns.ids
+        self._index = {pk: i for i, pk in enumerate(self.ids.tolist())}
+        self._base_scores = {}
+        self._python_columns = {}
+
+    @staticmethod
+    def model_fields():
+        return [f.attname for f in Hospital._meta.concrete_fields]
+
+    @classmethod
+    def build(cls, version):
+        """Snapshot of the table, read from the database."""
+        field_names = cls.model_fields()
+        rows = list(Hospital.objects.values_list(*field_names))
+        data = dict(zip(field_names, zip(*rows))) if rows else {f: () for f in field_names}
+        return cls(version, field_names, data)
+
+    @classmethod
+    def from_store(cls, path, version):
+        """Snapshot mapped from the feature store at ``path``; None unless it holds ``version``."""
+        field_names = cls.model_fields()
+        data = read_store(path, version, field_names)
+        return None if data is None else cls(version, field_names, data, prepared=True)
+
+    def store_columns(self):
+        """{field: (kind, values)} of every field, as ``feature_store.write_store`` takes them."""
+        columns = {}
+        for name in self.field_names:
+            if name == 'id':
+                columns[name] = ('int', self.ids)
+            elif name in TEXT_FIELDS:
+                columns[name] = ('text', getattr(self, name))
+            elif name in DATETIME_FIELDS:
+                columns[name] = ('datetime', getattr(self, name))
+            elif name in EXTRA_NUMERIC_FIELDS:
+                columns[name] = ('float', getattr(self, name))
+            else:
+                columns[name] = ('float', getattr(self.columns, name))
+        return columns
+
+    def __len__(self):
+        return len(self.ids)
+
+    @cached_property
+    def spatial_index(self):
+        """Grid index over the rows with coordinates (built on first spatial query)."""
+        return GridIndex(self.columns.latitude, self.columns.longitude)
+
+    @cached_property
+    def specialty_index(self):
+        """Inverted index specialty term -> rows (built on first use)."""
+        return SpecialtyIndex(self.specialty)
+
+    def index_of(self, pk):
+        """Row index of the hospital with primary key ``pk`` (None when absent)."""
+        return self._index.get(pk)
+
+    @cached_property
+    def _pk_order(self):
+        order = np.argsort(self.ids, kind='stable')
+        return order, self.ids[order]
+
+    def rows_of(self, pks):
+        """Row indices of an array of primary keys (-1 where absent), without a dict lookup per key."""
+        pks = np.asarray(pks, dtype=np.int64)
+        order, sorted_ids = self._pk_order
+        if not len(sorted_ids):
+            return np.full(len(pks), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(sorted_ids, pks), len(sorted_ids) - 1)
+        return np.where(sorted_ids[pos] == pks, order[pos], -1)
+
+    def value(self, i, name):
+        """Field value of row ``i`` as the ORM would return it."""
+        if name == 'id':
+            return int(self.ids[i])
+        if name in TEXT_FIELDS or name in DATETIME_FIELDS:
+            return getattr(self, name)[i]
+        column = getattr(self, name) if name in EXTRA_NUMERIC_FIELDS else getattr(self.columns, name)
+        v = float(column[i])
+        if v != v:  # NaN -> NULL
+            return None
+        return int(v) if name in INTEGER_FIELDS else v
+
+    def python_column(self, name):
+        """Field ``name`` of every row as a list of ORM-style Python values (built once, then cached)."""
+        column = self._python_columns.get(name)
+        if column is None:
+            if name == 'id':
+                column = self.ids.tolist()
+            elif name in TEXT_FIELDS or name in DATETIME_FIELDS:
+                column = getattr(self, name)
+            else:
+                values = getattr(self, name) if name in EXTRA_NUMERIC_FIELDS else getattr(self.columns, name)
+                cast = int if name in INTEGER_FIELDS else float
+                column = [None if v != v else cast(v) for v in values.tolist()]
+            self._python_columns[name] = column
+        return column
+
+    def base_scores(self, weights=None):
+        """
+        Base score of every row for ``weights``: the persisted ``base_score`` where
+        it was computed with the same weights, the vectorized computation elsewhere.
+        """
+        fingerprint = weights_fingerprint(weights)
+        scores = self._base_scores.get(fingerprint)
+        if scores is None:
+            stored = ~np.isnan(self.base_score) & np.fromiter(
+                (w == fingerprint for w in self.base_score_weights), dtype=bool, count=len(self))
+            if stored.all():
+                scores = self.base_score
+            else:
+                scores = np.where(stored, self.base_score, compute_base_scores(self.columns, weights))
+            self._base_scores[fingerprint] = scores
+        return scores
+
+    def instance(self, i):
+        """Unsaved-looking ``Hospital`` instance for row ``i`` (no database access)."""
+        values = [self.value(i, name) for name in self.field_names]
+        return Hospital.from_db(DEFAULT_DB_ALIAS, self.field_names, values)
+
+    @cached_property
+    def region_codes(self):
+        """{code field: int64 array} of the region codes (0 where the level is unknown)."""
+        return {name: np.array([int(c) if c else 0 for c in getattr(self, name)], dtype=np.int64)
+                for name in CODE_FIELDS}
+
+    def region_mask(self, region_q):
+        """
+        Rows in region ``region_q`` (text, area code or cascader code list);
+        None when there is no region to filter on.
+
+        A region that resolves to codes (see ``hospital.regions``) compares one
+        code column. Rows whose own region text did not resolve to that level
+        keep the substring test (``region__icontains``), as do queries that do
+        not resolve.
+        """
+        if isinstance(region_q, str):
+            region_q = region_q.strip()
+        if not region_q:
+            return None
+        needle = region_q.lower() if isinstance(region_q, str) else None
+        codes = resolve_query(region_q)
+        if codes is None:
+            if needle is None:
+                return np.zeros(len(self), dtype=bool)
+            return np.fromiter((needle in r.lower() for r in self.region), dtype=bool, count=len(self))
+        field, code = codes.lookup()
+        column = self.region_codes[field]
+        mask = column == int(code)
+        if needle is not None:
+            for i in np.flatnonzero(column == 0).tolist():
+                if needle in self.region[i].lower():
+                    mask[i] = True
+        return mask
+
+
+_snapshot = None
+_lock = threading.Lock()
+
+
+def _load(version):
+    """Snapshot of ``version``: from the feature store when it has it, else built and stored."""
+    # no version (shared cache unreachable): a store tagged None could be from any earlier outage
+    if not store_enabled() or version is None:
+        return HospitalSnapshot.build(version)
+    path = store_path()
+    snap = HospitalSnapshot.from_store(path, version)
+    if snap is not None:
+        return snap
+    try:
+        with flatfile.file_lock(path):
+            # another worker may have stored this version while we waited for the lock
+            snap = HospitalSnapshot.from_store(path, version)
+            if snap is None:
+                snap = HospitalSnapshot.build(version)
+                write_store(path, version, snap.field_names, snap.store_columns())
+                # map what was written, so this worker shares the pages too
+                snap = HospitalSnapshot.from_store(path, version) or snap
+    except OSError as exc:
+        logger.warning('hospital feature store %s unavailable: %s', path, exc)
+    return snap if snap is not None else HospitalSnapshot.build(version)
+
+
+def _current(snap, version):
+    if snap is None or snap.version != version:
+        return False
+    # no version (cache outage): writes cannot be seen, so only trust a recent load
+    return version is not None or time.monotonic() - snap.loaded_at < outage_ttl()
+
+
+def get_snapshot():
+    """Return this worker's snapshot, rebuilding it when the table version moved."""
+    global _snapshot
+    version = get_snapshot_version()
+    snap = _snapshot
+    if _current(snap, version):
+        return snap
+    with _lock:
+        snap = _snapshot
+        if not _current(snap, version):
+            # version is read before the query: a write racing with the build
+            # bumps the counter again and triggers another rebuild.
+            snap = _load(version)
+            _snapshot = snap
+    return snap
@@ -0,0 +1,121 @@
+"""
+Grid-bucketed spatial index over hospital coordinates.
+
+Hospitals are bucketed into fixed lat/lng cells (``GEO_GRID_CELL_DEG`` degrees,
+~55 km at the default 0.5). The buckets are stored CSR-style: row indices
+sorted by cell id plus the start offset of every occupied cell, so a radius
+query only touches the cells overlapping the query circle and runs the exact
+haversine test on those few rows. ``nearest`` doubles the search radius until
+enough hospitals are inside it.
+
+The index is immutable and built from a ``HospitalSnapshot``'s columns; it is
+rebuilt together with the snapshot (see ``HospitalSnapshot.spatial_index``).
+"""
+import math
+
+import numpy as np
+from django.conf import settings
+
+from .scoring import haversine_km_array
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG_LAT = math.pi * EARTH_RADIUS_KM / 180.0
+MAX_DISTANCE_KM = math.pi * EARTH_RADIUS_KM  # half the circumference
+
+
+def grid_cell_deg():
+    return getattr(settings, 'GEO_GRID_CELL_DEG', 0.5)
+
+
+class GridIndex:
+    """Spatial index over the rows of ``HospitalColumns`` that have coordinates."""
+
+    def __init__(self, latitude, longitude, cell_deg=None):
+        self.cell_deg = float(cell_deg or grid_cell_deg())
+        self.n_cols = int(math.ceil(360.0 / self.cell_deg))
+        self.n_rows = int(math.ceil(180.0 / self.cell_deg))
+        self.latitude = latitude
+        self.longitude = longitude
+
+        rows = np.flatnonzero(~(np.isnan(latitude) | np.isnan(longitude)))
+        cell_ids = self._cell_ids(latitude[rows], longitude[rows])
+        order = np.argsort(cell_ids, kind='stable')
+        self.rows = rows[order]
+        sorted_cells = cell_ids[order]
+        self.cells, self.starts = np.unique(sorted_cells, return_index=True)
+        self.ends = np.append(self.starts[1:], len(sorted_cells))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _cell_rc(self, lat, lng):
+        r = np.clip(np.floor((lat + 90.0) / self.cell_deg), 0, self.n_rows - 1).astype(np.int64)
+        c = np.floor(((lng + 180.0) % 360.0) / self.cell_deg).astype(np.int64) % self.n_cols
+        return r, c
+
+    def _cell_ids(self, lat, lng):
+        r, c = self._cell_rc(lat, lng)
+        return r * self.n_cols + c
+
+    def _rows_in_cells(self, lat, lng, radius_km):
+        """Row indices of every hospital in the cells overlapping the query circle."""
+        if not len(self.cells):
+            return np.empty(0, dtype=np.int64)
+        ang = radius_km / EARTH_RADIUS_KM
+        dlat = math.degrees(ang)
+        lat_lo, lat_hi = max(-90.0, lat - dlat), min(90.0, lat + dlat)
+        if ang >= math.pi / 2 - abs(math.radians(lat)):
+            # the circle contains a pole: every longitude is reachable
+            dlng = 180.0
+        else:
+            # exact longitudinal half-width of a spherical cap centred at lat
+            dlng = min(180.0, math.degrees(math.asin(min(1.0, math.sin(ang) / math.cos(math.radians(lat))))))
+
+        (r_lo, r_hi), _ = self._cell_rc(np.array([lat_lo, lat_hi]), np.zeros(2))
+        if dlng >= 180.0:
+            col_list = np.arange(self.n_cols)
+        else:
+            _, (c_lo,) = self._cell_rc(np.array([lat]), np.array([lng - dlng]))
+            span = int(math.ceil(2 * dlng / self.cell_deg)) + 1
+            col_list = np.unique((c_lo + np.arange(span)) % self.n_cols)
+        row_list = np.arange(r_lo, r_hi + 1)
+
+        if len(row_list) * len(col_list) > len(self.cells):
+            # a huge circle touches more cells than are occupied: just test every row
+            return self.rows
+        wanted = (row_list[:, None] * self.n_cols + col_list[None, :]).ravel()
+        pos = np.minimum(np.searchsorted(self.cells, wanted), len(self.cells) - 1)
+        pos = pos[self.cells[pos] == wanted]
+        if not len(pos):
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([self.rows[self.starts[p]:self.ends[p]] for p in pos.tolist()])
+
+    def within(self, lat, lng, radius_km):
+        """
+        Hospitals within ``radius_km`` of (lat, lng).
+        Returns (row_indices, distances_km), rows in ascending index order.
+        """
+        rows = self._rows_in_cells(lat, lng, radius_km)
+        if not len(rows):
+            return rows, np.empty(0)
+        rows = np.sort(rows)
+        d = haversine_km_array(lat, lng, self.latitude[rows], self.longitude[rows])
+        keep = d <= radius_km
+        return rows[keep], d[keep]
+
+    def nearest(self, lat, lng, n, max_distance_km=None):
+        """
+        The ``n`` hospitals nearest to (lat, lng), optionally within ``max_distance_km``.
+        Returns (row_indices, distances_km) ordered by distance.
+        """
+        if n <= 0 or not len(self.rows):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        limit = MAX_DISTANCE_KM if max_distance_km is None else min(max_distance_km, MAX_DISTANCE_KM)
+        radius = min(limit, self.cell_deg * KM_PER_DEG_LAT)
+        while True:
+            rows, d = self.within(lat, lng, radius)
+            if len(rows) >= n or radius >= limit:
+                break
+            radius = min(limit, radius * 2)
+        order = np.argsort(d, kind='stable')[:n]
+        return rows[order], d[order]
@@ -0,0 +1,124 @@
+"""
+Specialty matching: tokenizer, ICD chapter mapping and an inverted index.
+
+``Hospital.specialty`` is a comma separated list of terms ("心血管内科,肿瘤科").
+A hospital matches a disease when one of its terms contains the disease name,
+or, for requests that only carry an ICD-10 code, when one of its terms
+contains a keyword of the specialties that treat that ICD chapter
+(``ICD_CHAPTER_SPECIALTIES``). This replaces the old "first letter of the ICD
+code is a substring of the specialty text" heuristic, which matched e.g.
+every specialty containing a "c".
+
+``SpecialtyIndex`` tokenizes every hospital once and maps each term to the
+rows that list it, so a request resolves its matches with a scan over the
+(few hundred) distinct terms instead of every hospital row.
+"""
+import re
+from collections import defaultdict
+
+import numpy as np
+
+_SEPARATORS = re.compile(r'[,，、;；/|\n]+')
+_ICD_CODE = re.compile(r'\s*([A-Za-z])(\d{2})')
+
+# ICD-10 chapter (first..last 3-character code) -> keywords of specialty terms treating it.
+ICD_CHAPTER_SPECIALTIES = (
+    ('A00', 'B99', ('感染', '传染', 'infect')),
+    ('C00', 'D48', ('肿瘤', 'oncolog', 'cancer')),
+    ('D50', 'D89', ('血液', 'hematolog', 'haematolog')),
+    ('E00', 'E90', ('内分泌', '代谢', 'endocrin')),
+    ('F00', 'F99', ('精神', '心理', 'psychiatr')),
+    ('G00', 'G99', ('神经', 'neurolog')),
+    ('H00', 'H59', ('眼', 'ophthalm')),
+    ('H60', 'H95', ('耳鼻', '耳科', 'otolaryng')),
+    ('I00', 'I99', ('心血管', '心内', '心脏', 'cardio')),
+    ('J00', 'J99', ('呼吸', 'respirat', 'pulmon')),
+    ('K00', 'K93', ('消化', '胃肠', '肝', 'gastro')),
+    ('L00', 'L99', ('皮肤', 'dermat')),
+    ('M00', 'M99', ('骨', '风湿', 'orthop', 'rheumat')),
+    ('N00', 'N99', ('泌尿', '肾', 'urolog', 'nephro')),
+    ('O00', 'O99', ('产科', '妇产', 'obstet')),
+    ('P00', 'P96', ('新生儿', '儿科', 'neonat', 'pediatr')),
+    ('Q00', 'Q99', ('先天', '儿科', 'pediatr')),
+    ('S00', 'T98', ('骨', '创伤', '急诊', 'trauma', 'emergency')),
+    ('V01', 'Y98', ('急诊', 'emergency')),
+)
+
+
+def tokenize_specialty(text):
+    """Lower-cased specialty terms of a ``Hospital.specialty`` value."""
+    if not text:
+        return []
+    return [t for t in (part.strip().lower() for part in _SEPARATORS.split(text)) if t]
+
+
+def icd_specialty_keywords(disease_code):
+    """Specialty keywords for the ICD-10 chapter of ``disease_code`` (empty when unknown)."""
+    m = _ICD_CODE.match(disease_code or '')
+    if not m:
+        return ()
+    code = m.group(1).upper() + m.group(2)
+    for first, last, keywords in ICD_CHAPTER_SPECIALTIES:
+        if first <= code <= last:
+            return keywords
+    return ()
+
+
+def term_matcher(disease_name, disease_code):
+    """
+    Predicate over specialty terms for a request, or None when the request
+    carries no disease information (disease_name wins over disease_code).
+    """
+    if disease_name:
+        needle = disease_name.lower()
+        return lambda term: needle in term
+    if disease_code:
+        keywords = icd_specialty_keywords(disease_code)
+        return lambda term: any(k in term for k in keywords)
+    return None
+
+
+def specialty_matches(specialty, disease_name, disease_code):
+    """Scalar check used by ``compute_recommendation_score``."""
+    matcher = term_matcher(disease_name, disease_code)
+    if matcher is None:
+        return False
+    return any(matcher(term) for term in tokenize_specialty(specialty))
+
+
+class SpecialtyIndex:
+    """Inverted index: specialty term -> sorted row indices of the hospitals listing it."""
+
+    MAX_CACHED_QUERIES = 1024
+
+    def __init__(self, specialties):
+        self.size = len(specialties)
+        postings = defaultdict(list)
+        for row, text in enumerate(specialties):
+            for term in dict.fromkeys(tokenize_specialty(text)):
+                postings[term].append(row)
+        self.postings = {term: np.asarray(rows, dtype=np.int64) for term, rows in postings.items()}
+        self._queries = {}
+
+    def __len__(self):
+        return len(self.postings)
+
+    def rows_for(self, disease_name, disease_code):
+        """Sorted row indices of the hospitals matching the disease."""
+        key = (disease_name or '', '' if disease_name else (disease_code or ''))
+        rows = self._queries.get(key)
+        if rows is not None:
+            return rows
+        matcher = term_matcher(*key)
+        matched = [postings for term, postings in self.postings.items() if matcher and matcher(term)]
+        rows = np.unique(np.concatenate(matched)) if matched else np.empty(0, dtype=np.int64)
+        if len(self._queries) >= self.MAX_CACHED_QUERIES:
+            self._queries.clear()
+        self._queries[key] = rows
+        return rows
+
+    def match_mask(self, disease_name, disease_code):
+        """Boolean mask over all rows of the hospitals matching the disease."""
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self.rows_for(disease_name, disease_code)] = True
+        return mask
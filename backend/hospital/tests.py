@@ -0,0 +1,1092 @@
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+from importlib.util import find_spec
+from unittest import mock, skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from accounts.models import RecommendationHistory
+from backend import exports, instrumentation
+from backend.exports import ExportFormatError, ExportTable, export_chunks
+
+from . import parallel, recommender, snapshot as snapshot_module, views, weights
+from .importer import EXPORT_FIELDS, ImportFormatError, import_hospitals, read_rows
+from .models import Hospital, ScoringProfile
+from .precompute import payload_shape, popular_shapes, shape_key
+from .recommender import rank_candidates
+from .regions import RegionCode, region_label, resolve, resolve_query
+from .result_cache import canonical_payload
+from .row_serializer import HospitalRowSerializer, values_fields
+from .scoring import HospitalColumns, score_hospitals
+from .serializers import HospitalSerializer
+from .snapshot import SNAPSHOT_VERSION_KEY, HospitalSnapshot, get_snapshot, get_snapshot_version
+from .specialty import SpecialtyIndex, icd_specialty_keywords, specialty_matches, tokenize_specialty
+from .utils import DEFAULT_WEIGHTS, compute_hospital_base_score, compute_recommendation_score
+
+
+REGIONS = ('浙江省/杭州市/西湖区', '浙江省/杭州市/上城区', '浙江省/宁波市', '北京市/北京市/朝阳区',
+           '广东省 深圳市', '杭州市', '')
+SPECIALTIES = ('心血管内科,肿瘤科', '神经内科', '呼吸内科,消化内科', '骨科,急诊科', '儿科', '')
+
+
+def random_hospital(rng, i):
+    """An unsaved Hospital with random scoring fields (nullable ones sometimes None)."""
+    def maybe(value):
+        return None if rng.random() < 0.2 else value
+
+    return Hospital(
+        pk=i + 1, name=f'医院{i}', region=rng.choice(REGIONS), specialty=rng.choice(SPECIALTIES),
+        grade_level=rng.randint(0, 3),
+        latitude=maybe(rng.uniform(22.0, 40.0)), longitude=maybe(rng.uniform(113.0, 122.0)),
+        avg_cost=maybe(rng.uniform(0, 30000)), bed_count=maybe(rng.randint(0, 2000)),
+        specialty_score=rng.uniform(0, 100), equipment_score=rng.uniform(0, 100),
+        reputation_index=rng.uniform(0, 100), success_rate=rng.uniform(0, 1),
+        avg_wait_hours=maybe(rng.uniform(0, 30)),
+    )
+
+
+def random_payload(rng):
+    payload = {}
+    if rng.random() < 0.5:
+        payload['user_lat'], payload['user_lng'] = rng.uniform(22.0, 40.0), rng.uniform(113.0, 122.0)
+    if rng.random() < 0.6:
+        payload['region'] = rng.choice(('浙江', '杭州市', '西湖区', '北京', '深圳', 'nowhere', ' '))
+    if rng.random() < 0.6:
+        payload['economic_level'] = rng.randint(0, 2)
+    if rng.random() < 0.8:
+        payload['urgency'] = rng.choice(('emergency', 'urgent', 'routine', ''))
+    if rng.random() < 0.5:
+        payload['disease_name'] = rng.choice(('心血管', '肿瘤', '骨', '不存在'))
+    if rng.random() < 0.5:
+        payload['disease_code'] = rng.choice(('I21', 'C34', 'J18', 'S72', 'Z99'))
+    return payload
+
+
+def create_hospitals(count, seed=7):
+    rng = random.Random(seed)
+    for i in range(count):
+        hospital = random_hospital(rng, i)
+        hospital.pk = None
+        hospital.save()
+
+
+def frontend_payload(**overrides):
+    """A history payload as Recommend.vue stores it (raw form values)."""
+    payload = {
+        'name': '', 'gender': '', 'age': 45,
+        'disease_code': 'I21', 'disease_label': '急性心肌梗死',
+        'disease_vector': [], 'disease_description': '', 'past_history': '',
+        'economic_level': '无要求',
+        'region': ['330000', '330100', '330106'],
+        'region_cascader': ['330000', '330100', '330106'],
+        'health_risk': None, 'urgency': 'urgent', 'urgency_value': 2,
+        'history_satisfaction': None,
+    }
+    payload.update(overrides)
+    return payload
+
+
+class ScoringParityTests(SimpleTestCase):
+    """score_hospitals / BatchScores.breakdown against the scalar compute_recommendation_score."""
+
+    def assert_parity(self, hospitals, payload, weights=None):
+        scores = score_hospitals(HospitalColumns.from_hospitals(hospitals), payload, weights=weights)
+        for i, hospital in enumerate(hospitals):
+            expected_score, expected = compute_recommendation_score(hospital, payload, weights)
+            msg = f'hospital {i} ({hospital.region}, {hospital.specialty}), payload {payload}'
+            self.assertEqual(scores.score(i), expected_score, msg)
+            self.assertEqual(list(scores.breakdown(i).items()), list(expected.items()), msg)
+
+    def test_random_hospitals_and_payloads(self):
+        rng = random.Random(2024)
+        hospitals = [random_hospital(rng, i) for i in range(300)]
+        for _ in range(60):
+            self.assert_parity(hospitals, random_payload(rng))
+
+    def test_custom_weights(self):
+        rng = random.Random(99)
+        hospitals = [random_hospital(rng, i) for i in range(200)]
+        for _ in range(20):
+            weights = {k: rng.uniform(0, 0.3) for k in DEFAULT_WEIGHTS}
+            self.assert_parity(hospitals, random_payload(rng), weights)
+
+
+@override_settings(RECOMMEND_CURSOR_DEPTH=20)
+class RecommendPagingTests(TestCase):
+    url = '/api/hospital/recommend/'
+    payload = {'urgency': 'urgent', 'economic_level': 1, 'disease_name': '心血管'}
+
+    @classmethod
+    def setUpTestData(cls):
+        create_hospitals(60)
+
+    def setUp(self):
+        # a fresh snapshot version: the hospitals above were written in this test's transaction
+        cache.clear()
+        self.client = APIClient()
+
+    def post(self, **params):
+        return self.client.post(self.url, dict(self.payload, **params), format='json')
+
+    def test_without_paging_every_candidate_is_ranked(self):
+        response = self.post()
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(len(results), 60)
+        scores = [row['recommendation_score'] for row in results]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_top_k_is_the_head_of_the_full_ranking(self):
+        full = [row['id'] for row in self.post().json()['results']]
+        body = self.post(top_k=7).json()
+        self.assertEqual([row['id'] for row in body['results']], full[:7])
+        self.assertEqual((body['count'], body['offset'], body['top_k']), (60, 0, 7))
+        self.assertIsNotNone(body['next_cursor'])
+        body = self.post(top_k=5, offset=10).json()
+        self.assertEqual([row['id'] for row in body['results']], full[10:15])
+
+    def test_cursor_pages_through_the_ranking(self):
+        full = [row['id'] for row in self.post().json()['results']]
+        # pages run past RECOMMEND_CURSOR_DEPTH: the ranking is extended once on the way
+        ids, body = [], self.post(top_k=9).json()
+        while True:
+            ids += [row['id'] for row in body['results']]
+            if body['next_cursor'] is None:
+                break
+            body = self.post(top_k=9, cursor=body['next_cursor']).json()
+        self.assertEqual(ids, full)
+
+    def test_expired_cursor(self):
+        cursor = self.post(top_k=5).json()['next_cursor']
+        cache.clear()
+        response = self.post(top_k=5, cursor=cursor)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['detail'], 'cursor expired')
+
+    def test_bad_paging_parameters(self):
+        for params in ({'top_k': 0}, {'top_k': 'ten'}, {'offset': -1}, {'cursor': 'abc'}):
+            self.assertEqual(self.post(**params).status_code, 400, params)
+
+
+class SpatialParamsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_hospitals(10)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_parse(self):
+        self.assertEqual(recommender.spatial_params({'user_lat': '30.25', 'user_lng': 120, 'nearest_n': '3'}),
+                         (30.25, 120.0, None, 3))
+        self.assertEqual(recommender.spatial_params({'user_lat': 30.25}), (None, None, None, None))
+
+    def test_rejects_non_finite_and_out_of_range_coordinates(self):
+        for lat, lng in (('nan', 120), (30, 'inf'), ('-inf', 120), (91, 120), (30, -180.5)):
+            with self.assertRaises(ValueError):
+                recommender.spatial_params({'user_lat': lat, 'user_lng': lng})
+            response = self.client.get('/api/hospital/', {'user_lat': lat, 'user_lng': lng, 'nearest_n': 3})
+            self.assertEqual(response.status_code, 400, (lat, lng))
+            for url in ('/api/hospital/recommend/', '/api/recommend/'):
+                response = self.client.post(url, {'user_lat': lat, 'user_lng': lng}, format='json')
+                self.assertEqual(response.status_code, 400, (url, lat, lng))
+
+
+class ResultCacheTests(TestCase):
+    url = '/api/hospital/recommend/'
+
+    @classmethod
+    def setUpTestData(cls):
+        create_hospitals(30)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def post(self, payload, url=None):
+        return self.client.post(url or self.url, payload, format='json')
+
+    def test_equivalent_payloads_hit(self):
+        payload = {'disease_name': '心血管', 'user_lat': 30.2501, 'user_lng': 120.1502, 'top_k': 5}
+        first = self.post(payload)
+        self.assertEqual(first['X-Recommend-Cache'], 'MISS')
+        # same canonical payload: text is stripped, coordinates snap to the cache grid
+        second = self.post(dict(payload, disease_name=' 心血管 ', user_lat=30.2503))
+        self.assertEqual(second['X-Recommend-Cache'], 'HIT')
+        self.assertEqual(second.json(), first.json())
+        # paging parameters are part of the key
+        self.assertEqual(self.post(dict(payload, top_k=6))['X-Recommend-Cache'], 'MISS')
+
+    def test_hospital_write_invalidates(self):
+        payload = {'urgency': 'urgent'}
+        before = self.post(payload).json()['results']
+        self.assertEqual(self.post(payload)['X-Recommend-Cache'], 'HIT')
+        hospital = Hospital.objects.get(pk=before[-1]['id'])
+        hospital.grade_level, hospital.success_rate, hospital.specialty_score = 3, 1.0, 100.0
+        hospital.equipment_score = hospital.reputation_index = 100.0
+        with self.captureOnCommitCallbacks(execute=True):
+            hospital.save()
+        response = self.post(payload)
+        self.assertEqual(response['X-Recommend-Cache'], 'MISS')
+        self.assertEqual(response.json()['results'][0]['id'], hospital.pk)
+
+    def test_recommend_view_echoes_each_request_payload(self):
+        url = '/api/recommend/'
+        self.assertEqual(self.post({'region': 'Hangzhou'}, url)['X-Recommend-Cache'], 'MISS')
+        response = self.post({'region': 'HANGZHOU'}, url)
+        self.assertEqual(response['X-Recommend-Cache'], 'HIT')
+        self.assertEqual(response.json()['payload']['region'], 'HANGZHOU')
+
+    @override_settings(RECOMMEND_CACHE_ENABLED=False)
+    def test_disabled(self):
+        self.post({'urgency': 'urgent'})
+        self.assertNotIn('X-Recommend-Cache', self.post({'urgency': 'urgent'}))
+
+
+class SnapshotOutageTests(TestCase):
+    """Shared cache unreachable (django_redis IGNORE_EXCEPTIONS: every get returns None)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_hospitals(10)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def outage(self):
+        return mock.patch.object(cache, 'get', return_value=None)
+
+    def rename(self, pk, name):
+        hospital = Hospital.objects.get(pk=pk)
+        hospital.name = name
+        with self.captureOnCommitCallbacks(execute=True):
+            hospital.save()
+
+    def test_snapshot_is_reloaded_after_outage_ttl(self):
+        with self.outage():
+            self.assertIsNone(get_snapshot_version())
+            first = get_snapshot()
+            self.assertIs(get_snapshot(), first)
+            pk = int(first.ids[0])
+            self.rename(pk, '停电后改名')
+            # the version bump is lost with the cache: a snapshot is only kept for the outage TTL
+            self.assertIs(get_snapshot(), first)
+            first.loaded_at -= snapshot_module.outage_ttl()
+            after = get_snapshot()
+        self.assertIsNot(after, first)
+        self.assertEqual(after.value(after.index_of(pk), 'name'), '停电后改名')
+
+    @override_settings(HOSPITAL_SNAPSHOT_OUTAGE_TTL=0)
+    def test_results_are_not_cached_without_version(self):
+        payload = {'urgency': 'urgent'}
+        with self.outage():
+            for url in ('/api/hospital/recommend/', '/api/recommend/'):
+                response = self.client.post(url, payload, format='json')
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn('X-Recommend-Cache', response)
+            pk = response.json()['results'][0]['id']
+            self.rename(pk, '停电后改名')
+            results = self.client.post('/api/recommend/', payload, format='json').json()['results']
+        self.assertEqual({r['id']: r['name'] for r in results}[pk], '停电后改名')
+
+
+class SpecialtyMatchTests(SimpleTestCase):
+    def test_tokenize(self):
+        self.assertEqual(tokenize_specialty('心血管内科, 肿瘤科；Cardiology/ 儿科'),
+                         ['心血管内科', '肿瘤科', 'cardiology', '儿科'])
+        self.assertEqual(tokenize_specialty(''), [])
+        self.assertEqual(tokenize_specialty(None), [])
+
+    def test_icd_chapters(self):
+        self.assertIn('心血管', icd_specialty_keywords('I21.9'))
+        self.assertIn('肿瘤', icd_specialty_keywords('c34'))
+        self.assertIn('骨', icd_specialty_keywords('S72'))
+        self.assertEqual(icd_specialty_keywords('Z99'), ())
+        self.assertEqual(icd_specialty_keywords('not a code'), ())
+
+    def test_specialty_matches(self):
+        self.assertTrue(specialty_matches('心血管内科,肿瘤科', '', 'I21'))
+        self.assertTrue(specialty_matches('心血管内科,肿瘤科', '肿瘤', ''))
+        # the disease name wins over the code
+        self.assertFalse(specialty_matches('心血管内科', '肿瘤', 'I21'))
+        # no longer "first letter of the code appears in the text"
+        self.assertFalse(specialty_matches('cardiac surgery', '', 'C34'))
+        self.assertFalse(specialty_matches('儿科', '', ''))
+
+    def test_index_matches_the_scalar_check(self):
+        rng = random.Random(3)
+        specialties = [','.join(rng.sample(SPECIALTIES, rng.randint(0, 3))) for _ in range(200)]
+        index = SpecialtyIndex(specialties)
+        for name, code in [('心血管', ''), ('骨', ''), ('', 'I21'), ('', 'C34'), ('', 'S72'), ('', 'Z99'),
+                           ('不存在', 'I21'), ('', '')]:
+            expected = [i for i, text in enumerate(specialties) if specialty_matches(text, name, code)]
+            self.assertEqual(index.rows_for(name, code).tolist(), expected, (name, code))
+            self.assertEqual(index.match_mask(name, code).nonzero()[0].tolist(), expected, (name, code))
+
+
+class SpecialtyOnlyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_hospitals(40)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_specialty_only_keeps_matching_hospitals(self):
+        response = APIClient().post('/api/hospital/recommend/', {'disease_code': 'I21', 'specialty_only': True},
+                                    format='json')
+        results = response.json()['results']
+        self.assertTrue(results)
+        self.assertTrue(all(specialty_matches(row['specialty'], '', 'I21') for row in results))
+        everything = APIClient().post('/api/hospital/recommend/', {'disease_code': 'I21'}, format='json')
+        expected = {row['id'] for row in everything.json()['results']
+                    if specialty_matches(row['specialty'], '', 'I21')}
+        self.assertEqual({row['id'] for row in results}, expected)
+
+
+@override_settings(METRICS_TOKEN='')
+class MetricsWorkerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(setattr, instrumentation, 'workers', instrumentation.workers)
+        instrumentation.workers = instrumentation.WorkerSet()
+
+    def scrape(self):
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_every_flushed_worker_is_merged(self):
+        other = os.getpid() + 1
+        dump = {'counters': [('http_requests_total', [('method', 'GET')], 2)], 'histograms': []}
+        cache.set(instrumentation.WORKER_KEY.format(other), dump)
+        instrumentation.workers.add(other)
+        self.assertIn('yixuanbao_http_requests_total{method="GET"} 2', self.scrape())
+        self.assertEqual(instrumentation.workers.members(), {os.getpid(), other})
+        # a worker whose key expired stopped flushing: it leaves the set
+        cache.delete(instrumentation.WORKER_KEY.format(other))
+        self.assertNotIn('method="GET"} 2', self.scrape())
+        self.assertEqual(instrumentation.workers.members(), {os.getpid()})
+
+    def test_redis_worker_set_uses_set_commands(self):
+        client = mock.MagicMock()
+        client.smembers.return_value = {b'11', b'12'}
+        cache.set(instrumentation.WORKER_KEY.format(11), {'counters': [], 'histograms': []})
+        with mock.patch.object(instrumentation, '_redis', return_value=client):
+            instrumentation.workers.add(11)
+            self.assertEqual(instrumentation.workers.members(), {11, 12})
+            self.scrape()
+        key = cache.make_key(instrumentation.WORKERS_KEY)
+        client.pipeline().sadd.assert_any_call(key, 11)
+        client.srem.assert_called_once_with(key, 12)
+        client.set.assert_not_called()
+
+
+class RowSerializerParityTests(TestCase):
+    """HospitalRowSerializer against HospitalSerializer on the same rows."""
+    coords = (30.25, 120.15)
+
+    @classmethod
+    def setUpTestData(cls):
+        create_hospitals(60)
+
+    def expected(self, fields=None, weights=None, coords=None):
+        context = {'fields': fields, 'score_weights': weights}
+        if coords is not None:
+            context.update(user_lat=coords[0], user_lng=coords[1])
+        return HospitalSerializer(Hospital.objects.order_by('pk'), many=True, context=context).data
+
+    def test_from_values(self):
+        weights = {k: v * 1.5 for k, v in DEFAULT_WEIGHTS.items()}
+        for fields, weights, coords in ((None, None, None), (None, None, self.coords), (None, weights, self.coords),
+                                        (['id', 'name', 'distance_km'], None, self.coords)):
+            rows = HospitalRowSerializer(fields=fields, weights=weights).from_values(
+                Hospital.objects.order_by('pk').values(*values_fields()), coords=coords)
+            self.assertEqual(rows, self.expected(fields, weights, coords))
+
+    def test_from_snapshot(self):
+        snapshot = HospitalSnapshot.build(1)
+        rows = list(range(len(snapshot)))
+        for coords in (None, self.coords):
+            serializer = HospitalRowSerializer()
+            data = serializer.from_snapshot(snapshot, rows, serializer.snapshot_distances(snapshot, rows, coords))
+            self.assertEqual(sorted(data, key=lambda row: row['id']), self.expected(coords=coords))
+
+    def test_list_endpoint(self):
+        response = APIClient().get('/api/hospital/', {'fields': 'id,name,composite_score', 'ordering': 'id'})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        results = body['results'] if isinstance(body, dict) else body
+        self.assertEqual(results, self.expected(['id', 'name', 'composite_score'])[:len(results)])
+
+
+class NDJSONStreamTests(TestCase):
+    url = '/api/hospital/recommend/'
+    payload = {'urgency': 'urgent', 'disease_name': '心血管'}
+
+    @classmethod
+    def setUpTestData(cls):
+        create_hospitals(40)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def stream(self, url=None, **kwargs):
+        response = self.client.post(url or self.url + '?stream=1', self.payload, format='json', **kwargs)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['X-Accel-Buffering'], 'no')
+        self.last_response = response
+        body = b''.join(response.streaming_content)
+        self.assertTrue(body.endswith(b'\n'))
+        return [json.loads(line) for line in body.decode().split('\n')[:-1]]
+
+    def test_lines_match_the_json_response(self):
+        expected = self.client.post(self.url, dict(self.payload, top_k=15, offset=3), format='json').json()
+        cache.clear()
+        # several serialization batches
+        with mock.patch.object(views, 'STREAM_BATCH', 4):
+            lines = self.stream(self.url + '?stream=1&top_k=15&offset=3')
+        meta, rows, summary = lines[0]['meta'], lines[1:-1], lines[-1]['summary']
+        # a fresh ranking token per ranking: compare the cursor's position only
+        self.assertEqual(meta.pop('next_cursor').split('.')[1], expected.pop('next_cursor').split('.')[1])
+        self.assertEqual(meta, {k: v for k, v in expected.items() if k != 'results'})
+        self.assertEqual(rows, expected['results'])
+        self.assertEqual(summary['returned'], 15)
+        self.assertIn('elapsed_ms', summary)
+
+    def test_accept_header_and_cache_hit(self):
+        full = self.client.post(self.url, self.payload, format='json').json()
+        lines = self.stream(self.url, HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(self.last_response['X-Recommend-Cache'], 'HIT')
+        self.assertEqual(lines[0]['meta'], {'count': 40})
+        self.assertEqual(lines[1:-1], full['results'])
+        self.assertEqual(lines[-1]['summary']['returned'], 40)
+
+    def test_errors_are_one_line(self):
+        response = self.client.post(self.url, dict(self.payload, top_k=0), format='json',
+                                    HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.content.count(b'\n'), 1)
+        self.assertIsInstance(json.loads(response.content), dict)
+
+
+@override_settings(RECOMMEND_PARALLEL_WORKERS=2, RECOMMEND_PARALLEL_MIN_CANDIDATES=1)
+class ParallelRankingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_hospitals(400)
+
+    @classmethod
+    def tearDownClass(cls):
+        parallel._reset_pool()
+        parallel._release_blocks()
+        super().tearDownClass()
+
+    def test_pool_matches_inline(self):
+        snapshot = HospitalSnapshot.build(1)
+        rng = random.Random(5)
+        for depth in (None, 10, 57):
+            payload = random_payload(rng)
+            results = []
+
+            def spy(*args, **kwargs):
+                results.append(parallel.rank_parallel(*args, **kwargs))
+                return results[-1]
+
+            with mock.patch.object(recommender, 'rank_parallel', spy):
+                pooled = rank_candidates(snapshot, payload, depth)
+            # None: the pool failed and the request was scored inline
+            self.assertEqual(len(results), 1)
+            self.assertIsNotNone(results[0])
+            with override_settings(RECOMMEND_PARALLEL_WORKERS=0):
+                inline = rank_candidates(snapshot, payload, depth)
+            self.assertEqual(pooled.ids.tolist(), inline.ids.tolist())
+            self.assertEqual(pooled.scores.final.tolist(), inline.scores.final.tolist())
+            for i in range(min(len(inline), 20)):
+                self.assertEqual(pooled.scores.breakdown(i), inline.scores.breakdown(i))
+
+
+CSV_HEADER = 'id,name,region,specialty,grade_level,latitude,longitude,avg_cost,success_rate,created_at\n'
+
+
+class HospitalImportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.existing = Hospital.objects.create(name='旧医院', region='浙江省/杭州市', grade_level=1,
+                                                specialty_score=60.0, avg_cost=5000.0)
+
+    def run_import(self, text, fmt='csv', **kwargs):
+        return import_hospitals(read_rows(io.BytesIO(text.encode()), fmt), **kwargs)
+
+    def test_csv_upsert_and_errors(self):
+        text = CSV_HEADER + (
+            '99,旧医院,浙江省/宁波市,骨科,3,29.87,121.55,,0.9,2020-01-01\n'
+            ',新医院,北京市/朝阳区,儿科,2,39.92,116.44,800,0.85,\n'
+            ',坏医院,,,x,north,,,0.5,\n'
+            ',另一家,杭州市,,0,,,,0.7,\n'
+        )
+        version = get_snapshot_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            report = self.run_import(text, batch_size=2).as_dict()
+        self.assertEqual((report['rows'], report['created'], report['updated'], report['failed']), (4, 2, 1, 1))
+        self.assertEqual(report['batches'], 2)
+        self.assertEqual([e['line'] for e in report['errors']], [4])
+        self.assertEqual(set(report['errors'][0]['errors']), {'grade_level', 'latitude'})
+        self.assertFalse(report['errors_truncated'])
+        # bulk_create sends no signals: the importer bumps the snapshot version itself
+        self.assertNotEqual(get_snapshot_version(), version)
+
+        updated = Hospital.objects.get(pk=self.existing.pk)
+        self.assertEqual((updated.region, updated.grade_level, updated.avg_cost), ('浙江省/宁波市', 3, None))
+        # columns absent from the file keep their stored value
+        self.assertEqual(updated.specialty_score, 60.0)
+        self.assertEqual(Hospital.objects.count(), 3)
+        for hospital in Hospital.objects.all():
+            self.assertAlmostEqual(hospital.base_score, compute_hospital_base_score(hospital), places=9)
+
+    def test_jsonl_partial_rows(self):
+        text = ('{"name": "旧医院", "grade_level": 3}\n'
+                '\n'
+                'not json\n'
+                '[1, 2]\n'
+                '{"name": "新医院", "region": "杭州市"}\n'
+                '{"name": "新医院", "grade_level": 2}\n')
+        report = self.run_import(text, 'jsonl').as_dict()
+        self.assertEqual((report['rows'], report['created'], report['updated'], report['failed']), (5, 1, 1, 2))
+        self.assertEqual([e['line'] for e in report['errors']], [3, 4])
+        existing = Hospital.objects.get(pk=self.existing.pk)
+        self.assertEqual((existing.grade_level, existing.region, existing.avg_cost), (3, '浙江省/杭州市', 5000.0))
+        # a name repeated in one batch: its columns are merged, later rows win
+        new = Hospital.objects.get(name='新医院')
+        self.assertEqual((new.region, new.grade_level), ('杭州市', 2))
+
+    def test_dry_run_writes_nothing(self):
+        report = self.run_import(CSV_HEADER + ',新医院,,,1,,,,0.8,\n', dry_run=True)
+        self.assertEqual((report.created, report.updated), (1, 0))
+        self.assertFalse(Hospital.objects.filter(name='新医院').exists())
+
+    def test_unknown_format(self):
+        with self.assertRaises(ImportFormatError):
+            read_rows(io.BytesIO(b''), 'xml')
+
+
+class HospitalImportViewTests(TestCase):
+    url = '/api/hospital/import/'
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.staff = User.objects.create_user(username='admin', password='x', is_staff=True)
+        cls.user = User.objects.create_user(username='user', password='x')
+
+    def post(self, user, **data):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        return client.post(self.url, data, format='multipart')
+
+    def upload(self, name='hospitals.csv', text=CSV_HEADER + ',新医院,,,1,,,,0.8,\n'):
+        return SimpleUploadedFile(name, text.encode(), content_type='application/octet-stream')
+
+    def test_staff_only(self):
+        self.assertEqual(self.post(None, file=self.upload()).status_code, 403)
+        self.assertEqual(self.post(self.user, file=self.upload()).status_code, 403)
+        self.assertFalse(Hospital.objects.exists())
+
+    def test_import(self):
+        response = self.post(self.staff, file=self.upload(), dry_run='true')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 1)
+        self.assertFalse(Hospital.objects.exists())
+        response = self.post(self.staff, file=self.upload(name='hospitals.txt'), format='csv')
+        self.assertEqual(response.json()['created'], 1)
+        self.assertTrue(Hospital.objects.filter(name='新医院').exists())
+
+    def test_bad_requests(self):
+        self.assertEqual(self.post(self.staff).status_code, 400)
+        response = self.post(self.staff, file=self.upload(), format='xml')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('unsupported format', response.json()['detail'])
+
+
+class HospitalExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_hospitals(30)
+
+    def table(self, chunk_size=7):
+        return ExportTable(Hospital.objects.all(), EXPORT_FIELDS, chunk_size=chunk_size)
+
+    def expected_csv(self):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+        writer.writerows(Hospital.objects.order_by('pk').values_list(*EXPORT_FIELDS))
+        return buffer.getvalue().encode('utf-8')
+
+    def test_csv(self):
+        chunks = list(export_chunks(self.table(), 'csv'))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b''.join(chunks), self.expected_csv())
+
+    def test_csv_gzip(self):
+        data = b''.join(export_chunks(self.table(), 'csv', compress=True))
+        self.assertEqual(gzip.decompress(data), self.expected_csv())
+
+    def test_csv_round_trips_through_the_importer(self):
+        data = b''.join(export_chunks(self.table(), 'csv'))
+        report = import_hospitals(read_rows(io.BytesIO(data), 'csv'))
+        self.assertEqual((report.created, report.updated, report.failed), (0, 30, 0))
+
+    @skipUnless(find_spec('pyarrow'), 'pyarrow is not installed')
+    def test_parquet(self):
+        import pyarrow.parquet as pq
+
+        with mock.patch.object(exports, 'PARQUET_ROW_GROUP', 12):
+            data = b''.join(export_chunks(self.table(), 'parquet'))
+        parquet = pq.ParquetFile(io.BytesIO(data))
+        self.assertEqual(parquet.metadata.num_row_groups, 3)
+        table = parquet.read()
+        self.assertEqual(table.column_names, list(EXPORT_FIELDS))
+        self.assertEqual(str(table.schema.field('bed_count').type), 'int64')
+        self.assertEqual(str(table.schema.field('avg_cost').type), 'double')
+        rows = [tuple(row.values()) for row in table.to_pylist()]
+        self.assertEqual(rows, list(Hospital.objects.order_by('pk').values_list(*EXPORT_FIELDS)))
+
+    def test_unknown_format(self):
+        with self.assertRaises(ExportFormatError):
+            export_chunks(self.table(), 'xml')
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'hospitals.csv.gz')
+            call_command('export_hospitals', path, '--chunk-size', '4', stdout=io.StringIO())
+            with gzip.open(path, 'rb') as fh:
+                self.assertEqual(fh.read(), self.expected_csv())
+
+    def test_admin_action(self):
+        admin = get_user_model().objects.create_superuser(username='root', password='x')
+        self.client.force_login(admin)
+        ids = list(Hospital.objects.values_list('pk', flat=True)[:5])
+        response = self.client.post('/django-admin/hospital/hospital/', {
+            'action': 'export_selected_as_csv_gz', '_selected_action': ids})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename=hospitals_export.csv.gz')
+        rows = list(csv.reader(io.StringIO(gzip.decompress(b''.join(response.streaming_content)).decode())))
+        self.assertEqual([int(row[0]) for row in rows[1:]], sorted(ids))
+
+
+class RegionResolveTests(SimpleTestCase):
+    def test_resolve(self):
+        cases = {
+            '浙江省/杭州市/西湖区': RegionCode('330000', '330100', '330106', True),
+            '浙江/杭州/西湖': RegionCode('330000', '330100', '330106', True),
+            '浙江省 杭州市': RegionCode('330000', '330100', '', True),
+            '浙江省/西湖区': RegionCode('330000', '330100', '330106', True),
+            '杭州市': RegionCode('330000', '330100', '', True),
+            '北京市/北京市/朝阳区': RegionCode('110000', '110100', '110105', True),
+            '北京市/朝阳区': RegionCode('110000', '110100', '110105', True),
+            '浙江省/杭州市/不存在区': RegionCode('330000', '330100', '', False),
+            '南京路': RegionCode('', '', '', False),
+            '': RegionCode('', '', '', False),
+        }
+        for text, expected in cases.items():
+            self.assertEqual(resolve(text), expected, text)
+
+    def test_resolve_query(self):
+        self.assertEqual(resolve_query(['330000', '330100', '330106']).code, '330106')
+        self.assertEqual(resolve_query(['330000', '330100', '']).code, '330100')
+        self.assertEqual(resolve_query('330106').code, '330106')
+        self.assertEqual(resolve_query('浙江/杭州').code, '330100')
+        # incomplete text or unknown codes do not resolve
+        self.assertIsNone(resolve_query('浙江省/杭州市/不存在区'))
+        self.assertIsNone(resolve_query(['999999']))
+        self.assertIsNone(resolve_query([]))
+        self.assertIsNone(resolve_query(3301))
+
+    def test_region_label(self):
+        self.assertEqual(region_label(resolve('浙江/杭州/西湖')), '浙江省/杭州市/西湖区')
+        self.assertEqual(region_label(resolve('北京市/北京市/朝阳区')), '北京市/朝阳区')
+
+
+class RegionFilterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_hospitals(80)
+
+    def setUp(self):
+        cache.clear()
+
+    def listed(self, region):
+        response = APIClient().get('/api/hospital/', {'region': region, 'cursor': '', 'page_size': 500})
+        self.assertEqual(response.status_code, 200)
+        return {row['id'] for row in response.json()['results']}
+
+    def recommended(self, region):
+        response = APIClient().post('/api/hospital/recommend/', {'region': region}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return {row['id'] for row in response.json()['results']}
+
+    def ids(self, *regions):
+        return set(Hospital.objects.filter(region__in=regions).values_list('id', flat=True))
+
+    def test_codes_are_stored_on_save(self):
+        hospital = Hospital.objects.filter(region='浙江省/杭州市/西湖区').first()
+        self.assertEqual((hospital.province_code, hospital.city_code, hospital.district_code),
+                         ('330000', '330100', '330106'))
+
+    def test_resolved_regions(self):
+        zhejiang = self.ids('浙江省/杭州市/西湖区', '浙江省/杭州市/上城区', '浙江省/宁波市', '杭州市')
+        hangzhou = self.ids('浙江省/杭州市/西湖区', '浙江省/杭州市/上城区', '杭州市')
+        for query, expected in (('浙江', zhejiang), ('浙江省/杭州市', hangzhou), ('330100', hangzhou),
+                                ('330106', self.ids('浙江省/杭州市/西湖区'))):
+            self.assertEqual(self.listed(query), expected, query)
+            self.assertEqual(self.recommended(query), expected, query)
+
+    def test_unresolved_text(self):
+        self.assertEqual(self.listed('nowhere'), set())
+        self.assertEqual(self.recommended('nowhere'), set())
+
+    def test_unresolved_text_is_a_substring_on_both_endpoints(self):
+        hospital = random_hospital(random.Random(1), 0)
+        hospital.pk, hospital.name, hospital.region = None, '小镇医院', 'Sample Town'
+        with self.captureOnCommitCallbacks(execute=True):
+            hospital.save()
+        self.assertEqual(self.listed('TOWN'), {hospital.pk})
+        self.assertEqual(self.recommended('TOWN'), {hospital.pk})
+
+    def test_non_string_region_is_rejected(self):
+        for region in (123, {'code': '330100'}, [330000, 330100]):
+            response = APIClient().post('/api/hospital/recommend/', {'region': region}, format='json')
+            self.assertEqual(response.status_code, 400, region)
+        self.assertEqual(self.recommended(['330000', '330100']), self.recommended('330100'))
+
+
+class PreferredRegionCodeTests(TestCase):
+    def test_code_is_refreshed_on_save(self):
+        user = get_user_model().objects.create_user(username='henry', password='x', preferred_region='浙江/杭州')
+        self.assertEqual(user.preferred_region_code, '330100')
+        # the cascader codes win over the text
+        user.preferred_region_values = ['110000', '110100', '110105']
+        user.save(update_fields=['preferred_region_values'])
+        self.assertEqual(get_user_model().objects.get(pk=user.pk).preferred_region_code, '110105')
+
+
+class RegionCodeMigrationTests(TransactionTestCase):
+    """hospital 0004 / accounts 0005 fill the codes of rows that predate them."""
+    before = [('hospital', '0003_hospital_avg_cost_index'), ('accounts', '0004_recommendationhistory_result_packed')]
+    after = [('hospital', '0004_hospital_region_codes'), ('accounts', '0005_user_preferred_region_code')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        call_command('migrate', verbosity=0)
+
+    def test_backfill(self):
+        apps = self.migrate(self.before)
+        OldHospital, OldUser = apps.get_model('hospital', 'Hospital'), apps.get_model('accounts', 'User')
+        OldHospital.objects.create(name='a', region='浙江/杭州/西湖')
+        OldHospital.objects.create(name='b', region='南京路')
+        OldUser.objects.create(username='u1', preferred_region='浙江/杭州')
+        OldUser.objects.create(username='u2', preferred_region='浙江/杭州', preferred_region_values=['110000', '110105'])
+        cache.clear()
+
+        apps = self.migrate(self.after)
+        codes = apps.get_model('hospital', 'Hospital').objects.values_list(
+            'name', 'province_code', 'city_code', 'district_code')
+        self.assertEqual(sorted(codes), [('a', '330000', '330100', '330106'), ('b', '', '', '')])
+        users = apps.get_model('accounts', 'User').objects.values_list('username', 'preferred_region_code')
+        self.assertEqual(sorted(users), [('u1', '330100'), ('u2', '110105')])
+        # data migrations leave the shared cache alone
+        self.assertIsNone(cache.get(SNAPSHOT_VERSION_KEY))
+
+
+class RefreshRegionCodesCommandTests(TestCase):
+    def test_refresh(self):
+        hospital = Hospital.objects.create(name='a', region='浙江/杭州/西湖')
+        user = get_user_model().objects.create_user(username='u', password='x', preferred_region='杭州')
+        Hospital.objects.update(province_code='', city_code='', district_code='')
+        get_user_model().objects.update(preferred_region_code='')
+        version = get_snapshot_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('refresh_region_codes', stdout=io.StringIO())
+        hospital.refresh_from_db()
+        user.refresh_from_db()
+        self.assertEqual((hospital.province_code, hospital.city_code, hospital.district_code),
+                         ('330000', '330100', '330106'))
+        self.assertEqual(user.preferred_region_code, '330100')
+        # queryset.update sends no signals: the command moves the snapshot version itself
+        self.assertNotEqual(get_snapshot_version(), version)
+
+    def test_unknown_target(self):
+        with self.assertRaises(CommandError):
+            call_command('refresh_region_codes', 'clinics', stdout=io.StringIO())
+
+
+class FeatureStoreTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_hospitals(50)
+
+    def setUp(self):
+        cache.clear()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+        self.path = os.path.join(self.dir, 'features.bin')
+        settings_override = override_settings(FEATURE_STORE_ENABLED=True, FEATURE_STORE_FILE=self.path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def assert_same(self, mapped, built):
+        self.assertEqual(mapped.ids.tolist(), built.ids.tolist())
+        for name in built.field_names:
+            # datetimes stay epoch microseconds in the mapping (DatetimeColumn)
+            self.assertEqual(list(mapped.python_column(name)), list(built.python_column(name)), name)
+        self.assertEqual(mapped.base_scores().tolist(), built.base_scores().tolist())
+        rows = list(range(len(built)))
+        self.assertEqual(HospitalRowSerializer().from_snapshot(mapped, rows),
+                         HospitalRowSerializer().from_snapshot(built, rows))
+
+    def test_publish_and_map(self):
+        built = HospitalSnapshot.build(7)
+        # the first load of a version builds the snapshot and publishes it
+        loaded = snapshot_module._load(7)
+        self.assertTrue(os.path.exists(self.path))
+        self.assert_same(loaded, built)
+        # later loads of the same version map the file without touching the table
+        with self.assertNumQueries(0):
+            mapped = snapshot_module._load(7)
+        self.assert_same(mapped, built)
+
+    def test_new_version_replaces_the_store(self):
+        snapshot_module._load(7)
+        hospital = Hospital.objects.first()
+        hospital.name = '改名医院'
+        hospital.save()
+        self.assertIsNone(HospitalSnapshot.from_store(self.path, 8))
+        reloaded = snapshot_module._load(8)
+        self.assertIn('改名医院', reloaded.python_column('name'))
+        self.assertIsNone(HospitalSnapshot.from_store(self.path, 7))
+        self.assert_same(HospitalSnapshot.from_store(self.path, 8), HospitalSnapshot.build(8))
+
+    def test_unreadable_store_is_rebuilt(self):
+        with open(self.path, 'wb') as fh:
+            fh.write(b'not a feature store')
+        with self.assertLogs('hospital.feature_store', 'WARNING'):
+            self.assertIsNone(HospitalSnapshot.from_store(self.path, 7))
+            loaded = snapshot_module._load(7)
+        self.assert_same(loaded, HospitalSnapshot.build(7))
+        self.assertIsNotNone(HospitalSnapshot.from_store(self.path, 7))
+
+    def test_worker_reloads_after_a_write(self):
+        before = get_snapshot()
+        hospital = Hospital.objects.first()
+        hospital.name = '新名字'
+        with self.captureOnCommitCallbacks(execute=True):
+            hospital.save()
+        after = get_snapshot()
+        self.assertNotEqual(after.version, before.version)
+        self.assertEqual(after.value(after.index_of(hospital.pk), 'name'), '新名字')
+        self.assertIsNotNone(HospitalSnapshot.from_store(self.path, after.version))
+
+
+class ScoringProfileValidationTests(TestCase):
+    def assert_invalid(self, field, **kwargs):
+        with self.assertRaises(ValidationError) as ctx:
+            ScoringProfile(name='p', **kwargs).clean()
+        self.assertIn(field, ctx.exception.message_dict)
+
+    def test_valid(self):
+        ScoringProfile(name='p', urgency='urgent', region_code='330100', weights={'distance': 0.3, 'grade': 1}).clean()
+
+    def test_invalid(self):
+        self.assert_invalid('weights', weights={'speed': 0.1})
+        self.assert_invalid('weights', weights={'distance': '0.1'})
+        self.assert_invalid('weights', weights={'distance': True})
+        self.assert_invalid('weights', weights=[0.1])
+        self.assert_invalid('region_code', region_code='999999')
+
+    def test_one_active_profile_per_key(self):
+        ScoringProfile.objects.create(name='a', urgency='urgent', region_code='330100')
+        self.assert_invalid('__all__', urgency='urgent', region_code='330100')
+        ScoringProfile(name='b', urgency='urgent', region_code='330100', is_active=False).clean()
+        ScoringProfile(name='b', urgency='urgent', region_code='330000').clean()
+
+
+@override_settings(SCORING_PROFILES_RELOAD_SECONDS=0)
+class ScoringProfileReloadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_hospitals(40)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def save(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ScoringProfile.objects.create(**kwargs)
+
+    def test_selection_order(self):
+        for name, urgency, region in (('default', '', ''), ('zj', '', '330000'), ('urgent', 'urgent', ''),
+                                      ('urgent-hz', 'urgent', '330100'), ('urgent-xh', 'urgent', '330106')):
+            self.save(name=name, urgency=urgency, region_code=region, weights={'distance': 0.5})
+
+        def select(**payload):
+            return weights.select_weights(payload).name
+
+        self.assertEqual(select(urgency='urgent', region='浙江省/杭州市/西湖区'), 'urgent-xh')
+        self.assertEqual(select(urgency='URGENT', region=['330000', '330100', '330102']), 'urgent-hz')
+        self.assertEqual(select(urgency='urgent', region='北京'), 'urgent')
+        self.assertEqual(select(urgency='routine', region='宁波'), 'zj')
+        self.assertEqual(select(urgency='routine'), 'default')
+
+    def test_hot_reload(self):
+        self.assertIs(weights.select_weights({'urgency': 'urgent'}), weights.DEFAULT)
+        profile = self.save(name='urgent', urgency='urgent', weights={'grade': 0.5})
+        selected = weights.select_weights({'urgency': 'urgent'})
+        self.assertEqual(selected.values, dict(DEFAULT_WEIGHTS, grade=0.5))
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.is_active = False
+            profile.save()
+        self.assertIs(weights.select_weights({'urgency': 'urgent'}), weights.DEFAULT)
+
+    @override_settings(SCORING_PROFILES_RELOAD_SECONDS=3600)
+    def test_version_is_polled_at_most_every_reload_interval(self):
+        table = weights.get_profiles()
+        self.save(name='urgent', urgency='urgent', weights={'grade': 0.5})
+        self.assertIs(weights.get_profiles(), table)
+
+    def test_recommend_uses_and_keys_on_the_profile(self):
+        url, urgent, routine = '/api/hospital/recommend/', {'urgency': 'urgent'}, {'urgency': 'routine'}
+        self.client.post(url, urgent, format='json')
+        self.client.post(url, routine, format='json')
+        values = dict(DEFAULT_WEIGHTS, grade=0.6, distance=0.0)
+        self.save(name='urgent', urgency='urgent', weights=values)
+
+        response = self.client.post(url, urgent, format='json')
+        self.assertEqual(response['X-Recommend-Cache'], 'MISS')
+        for row in response.json()['results']:
+            score, _ = compute_recommendation_score(Hospital.objects.get(pk=row['id']), urgent, values)
+            self.assertEqual(row['recommendation_score'], round(score, 4))
+        # only the payloads the profile applies to miss
+        self.assertEqual(self.client.post(url, routine, format='json')['X-Recommend-Cache'], 'HIT')
+
+    def test_default_profile_drives_composite_score(self):
+        hospital = Hospital.objects.first()
+        values = dict(DEFAULT_WEIGHTS, grade=0.6)
+        self.save(name='default', weights=values)
+        body = self.client.get(f'/api/hospital/{hospital.pk}/').json()
+        self.assertEqual(body['composite_score'], round(hospital.composite_score(weights=values), 4))
+        rows = self.client.get('/api/hospital/', {'fields': 'id,composite_score'}).json()
+        self.assertEqual({row['id']: row['composite_score'] for row in rows}[hospital.pk], body['composite_score'])
+
+    def test_default_profile_drives_plain_recommend(self):
+        url, payload = '/api/recommend/', {'region': '杭州'}
+        self.assertEqual(self.client.post(url, payload, format='json')['X-Recommend-Cache'], 'MISS')
+        values = dict(DEFAULT_WEIGHTS, grade=0.6)
+        self.save(name='default', weights=values)
+        response = self.client.post(url, payload, format='json')
+        # the cached entry was scored with the previous weights
+        self.assertEqual(response['X-Recommend-Cache'], 'MISS')
+        for row in response.json()['results']:
+            expected = round(Hospital.objects.get(pk=row['id']).composite_score(weights=values), 4)
+            self.assertEqual(row['composite_score'], expected)
+
+
+class HospitalCursorPagingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_hospitals(120)
+
+    def collect(self, ordering):
+        client, ids = APIClient(), []
+        response = client.get('/api/hospital/', {'cursor': '', 'page_size': 25, 'ordering': ordering})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids += [row['id'] for row in response.json()['results']]
+            if not response.json()['next']:
+                return ids
+            response = client.get(response.json()['next'])
+
+    def test_pages_cover_every_row_once(self):
+        expected = set(Hospital.objects.values_list('id', flat=True))
+        for ordering in ('name', '-name', 'id', '-id'):
+            ids = self.collect(ordering)
+            self.assertEqual(len(ids), len(expected), ordering)
+            self.assertEqual(set(ids), expected, ordering)
+
+    def test_non_unique_orderings_are_rejected(self):
+        for ordering in ('grade_level', '-composite_score', 'avg_cost'):
+            response = APIClient().get('/api/hospital/', {'cursor': '', 'ordering': ordering})
+            self.assertEqual(response.status_code, 400, ordering)
+
+
+class PopularShapesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(username='shapes', password='x')
+
+    def record(self, *payloads):
+        RecommendationHistory.objects.bulk_create(
+            RecommendationHistory(user=self.user, payload=payload) for payload in payloads)
+
+    def test_frontend_payloads_share_the_live_shape(self):
+        self.record(
+            frontend_payload(),
+            frontend_payload(economic_level=''),
+            frontend_payload(region=[], region_cascader=['330000', '330100', '330106']),
+            frontend_payload(region='浙江/杭州/西湖'),
+        )
+        shapes = popular_shapes(min_count=1)
+        self.assertEqual(len(shapes), 1)
+        shape, count = shapes[0]
+        self.assertEqual(count, 4)
+        self.assertEqual(shape, {'region': '浙江省/杭州市/西湖区', 'disease_code': 'i21', 'urgency': 'urgent'})
+
+        # what the frontend posts for the same form (labels joined by '/', no economic_level)
+        live = canonical_payload({'region': '浙江省/杭州市/西湖区', 'disease_code': 'I21', 'urgency': 'urgent', 'age': 45})
+        self.assertEqual(shape_key(payload_shape(live)), shape_key(shape))
+
+    def test_economic_level_and_region_normalisation(self):
+        self.record(
+            frontend_payload(economic_level='1'),
+            frontend_payload(economic_level=1, region=['110000', '110105']),
+            frontend_payload(region=[], region_cascader=[]),
+            frontend_payload(region=['999999']),
+        )
+        shapes = {shape_key(shape): shape for shape, _ in popular_shapes(min_count=1)}
+        self.assertEqual(len(shapes), 3)
+        self.assertIn(shape_key({'region': '浙江省/杭州市/西湖区', 'disease_code': 'i21', 'urgency': 'urgent',
+                                 'economic_level': 1}), shapes)
+        self.assertIn(shape_key({'region': '北京市/朝阳区', 'disease_code': 'i21', 'urgency': 'urgent',
+                                 'economic_level': 1}), shapes)
+        # no region selected: the region-less shape; an unknown code is skipped
+        self.assertIn(shape_key({'disease_code': 'i21', 'urgency': 'urgent'}), shapes)
+
+    def test_specific_payloads_are_not_shapes(self):
+        self.record(frontend_payload(user_lat=30.25, user_lng=120.15), frontend_payload(specialty_only=True))
+        self.assertEqual(popular_shapes(min_count=1), [])
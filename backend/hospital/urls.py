@@ -4,6 +4,7 @@ from django.views import View
 from .views import (
     HospitalListCreateView,
     HospitalRetrieveUpdateDestroyView,
+    HospitalImportView,
     RecommendHospitalView
 )
 
@@ -11,4 +12,5 @@ urlpatterns = [
     path('', HospitalListCreateView.as_view(), name='hospital-list'),
     path('<int:pk>/', HospitalRetrieveUpdateDestroyView.as_view(), name='hospital-detail'),
     path('recommend/', RecommendHospitalView.as_view(), name='recommend'),
+    path('import/', HospitalImportView.as_view(), name='hospital-import'),
 ]
\ No newline at end of file
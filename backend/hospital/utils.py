@@ -1,5 +1,9 @@
+import hashlib
+import json
 import math
 
+from .specialty import specialty_matches
+
 # Default scoring weights (tunable)
 DEFAULT_WEIGHTS = {
     'grade': 0.20,            # hospital grade weight
@@ -13,6 +17,13 @@ DEFAULT_WEIGHTS = {
     'distance': 0.08          # proximity factor
 }
 
+def weights_fingerprint(weights=None):
+    """Short stable hash of a weights dict (identifies which weights produced a stored score)."""
+    if weights is None:
+        weights = DEFAULT_WEIGHTS
+    raw = json.dumps(weights, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
 # Haversine distance (km)
 def haversine_km(lat1, lon1, lat2, lon2):
     R = 6371.0
@@ -154,14 +165,10 @@ def compute_recommendation_score(hospital, user_payload, weights=None):
     # small boost proportional to specialty_score
     disease_name = (user_payload.get('disease_name') or '') or ''
     disease_code = (user_payload.get('disease_code') or '') or ''
+    # (a specialty term contains the disease name, or matches the ICD chapter of the code)
     specialty_match = 0.0
-    if disease_name:
-        if hospital.specialty and disease_name.lower() in hospital.specialty.lower():
-            specialty_match = min(1.0, (hospital.specialty_score or 50.0) / 100.0)
-    elif disease_code:
-        # compare ICD code first letter to specialty (heuristic)
-        if hospital.specialty and disease_code[0:1].lower() in hospital.specialty.lower():
-            specialty_match = min(1.0, (hospital.specialty_score or 50.0) / 100.0)
+    if specialty_matches(hospital.specialty, disease_name, disease_code):
+        specialty_match = min(1.0, (hospital.specialty_score or 50.0) / 100.0)
     if specialty_match:
         spec_weight = weights.get('specialty_score', 0)
         score = score * (1.0 - spec_weight) + score * spec_weight * (1.0 + specialty_match * 0.2)
@@ -1,60 +1,493 @@
+import math
+
+from asgiref.sync import sync_to_async
 from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.parsers import FormParser, MultiPartParser
+from rest_framework.settings import api_settings
+from django.db.models import Q
 from django.shortcuts import get_object_or_404
+from .importer import ImportFormatError, detect_format, import_hospitals, read_rows
 from .models import Hospital
+from .regions import resolve_query
 from .serializers import HospitalSerializer
-from .utils import compute_recommendation_score
+from .row_serializer import HospitalRowSerializer, request_coords, values_fields
+from .recommender import (
+    check_region, cursor_depth, decode_cursor, default_top_k, encode_cursor, load_ranking,
+    max_top_k, rank_candidates, save_ranking, spatial_params,
+)
+from .precompute import aprecomputed_ranking
+from .result_cache import cache_enabled, canonical_payload, make_key, result_cache
+from .snapshot import get_snapshot, get_snapshot_version
+from .weights import get_profiles, select_weights
+from accounts.admin_views import IsStaff
+from backend.async_views import AsyncAPIViewMixin
+from backend.instrumentation import record, span
+from backend.renderers import NDJSONRenderer, ndjson_response
+
+# hospitals serialized per chunk of a streamed (NDJSON) recommendation
+STREAM_BATCH = 100
+
+# ?ordering= values accepted by the hospital list (mapped to indexed columns)
+LIST_ORDERING_FIELDS = {
+    'composite_score': 'base_score',
+    'base_score': 'base_score',
+    'grade_level': 'grade_level',
+    'avg_cost': 'avg_cost',
+    'region': 'region',
+    'name': 'name',
+    'id': 'id',
+}
+# DRF cursors keep a position in the first ordering column only: it must be unique and non-null
+CURSOR_ORDERING_FIELDS = ('name', 'id')
+# ?field= values of the admin search box (?q=... matched with icontains)
+LIST_SEARCH_FIELDS = ('name', 'region', 'specialty', 'address', 'contact')
+# largest ?nearest_n= of the hospital list
+MAX_NEAREST_N = 500
+# ?min_x= / ?max_x= range filters -> column
+LIST_RANGE_FILTERS = {
+    'avg_cost': 'avg_cost',
+    'score': 'base_score',
+}
+
+
+class HospitalPagePagination(PageNumberPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class HospitalCursorPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('id',)
+
+
+def _list_ordering(request):
+    """(sign, column) of ``?ordering=``, or None when not given."""
+    ordering = request.query_params.get('ordering')
+    if not ordering:
+        return None
+    field = LIST_ORDERING_FIELDS.get(ordering.lstrip('-'))
+    if field is None:
+        raise ValidationError({'ordering': f'unsupported ordering: {ordering}'})
+    return ('-' if ordering.startswith('-') else ''), field
+
+
+def _score_weights():
+    """``score_weights`` context of the global default profile (None: DEFAULT_WEIGHTS)."""
+    weights = get_profiles().default
+    return None if weights.is_default else weights.values
+
+
+def _float_param(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValidationError({name: 'must be a number'})
+    if not math.isfinite(value):
+        raise ValidationError({name: 'must be a number'})
+    return value
+
 
 class HospitalListCreateView(generics.ListCreateAPIView):
+    """
+    GET /hospital/ optionally limited around a point:
+      ?user_lat=..&user_lng=..&max_distance_km=..  hospitals within the radius
+      ?user_lat=..&user_lng=..&nearest_n=..        the n nearest hospitals (nearest first,
+                                                   n <= MAX_NEAREST_N)
+    Candidates come from the snapshot's spatial index, not a per-row distance scan.
+    Filters (indexed columns):
+      ?region=..            region (e.g. "浙江省", "浙江省/杭州市" or an area code), matched on
+                            the province/city/district code columns; text that does not
+                            resolve to codes is a region substring (as on /hospital/recommend/)
+      ?grade_level=3 / 2,3  one or several grades
+      ?min_avg_cost= / ?max_avg_cost=, ?min_score= / ?max_score=  inclusive ranges
+      ?q=..&field=name      admin search box: ``field`` icontains ``q``
+    ?ordering=-composite_score sorts in SQL on the persisted, indexed base_score
+    (also grade_level, avg_cost, region, name, id). base_score uses DEFAULT_WEIGHTS;
+    composite_score follows the global default ScoringProfile when there is one.
+    ?fields=id,name,... only serializes the listed fields.
+    Paging is opt-in so existing callers keep the plain array:
+      ?page=..&page_size=..  numbered pages ({count, next, previous, results})
+      ?cursor=               cursor pages following ?ordering=name / id (default id);
+                             pass ``next`` back for the following page
+    """
     queryset = Hospital.objects.all()
     serializer_class = HospitalSerializer
     permission_classes = [AllowAny]  # adjust for admin operations as needed
 
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if 'cursor' in params:
+                self._paginator = HospitalCursorPagination()
+                ordering = _list_ordering(self.request)
+                if ordering is not None:
+                    sign, field = ordering
+                    if field not in CURSOR_ORDERING_FIELDS:
+                        raise ValidationError({'ordering': f'cursor paging does not support ordering by {field}'})
+                    self._paginator.ordering = (sign + field,)
+            elif 'page' in params or 'page_size' in params:
+                self._paginator = HospitalPagePagination()
+            else:
+                self._paginator = None
+        return self._paginator
+
+    def get_queryset(self):
+        qs = self._spatial_filter(super().get_queryset())
+        qs = self._filter(qs)
+        ordering = _list_ordering(self.request)
+        if ordering is not None:
+            sign, field = ordering
+            qs = qs.order_by(sign + field, 'name')
+        return qs
+
+    def list(self, request, *args, **kwargs):
+        # read-only fast path: row dicts straight from .values(), same output as HospitalSerializer
+        queryset = self.filter_queryset(self.get_queryset()).values(*values_fields())
+        nearest = getattr(self, '_nearest_order', None)
+        if nearest is not None and _list_ordering(request) is None and not isinstance(
+                self.paginator, HospitalCursorPagination):
+            # nearest first: at most MAX_NEAREST_N rows, ordered here instead of a per-pk CASE in SQL
+            queryset = sorted(queryset, key=lambda row: nearest[row['id']])
+        page = self.paginate_queryset(queryset)
+        context = self.get_serializer_context()
+        serializer = HospitalRowSerializer(fields=context.get('fields'), weights=context.get('score_weights'))
+        rows = serializer.from_values(page if page is not None else queryset, coords=request_coords(request))
+        if page is not None:
+            return self.get_paginated_response(rows)
+        return Response(rows)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        fields = self.request.query_params.get('fields') if self.request.method == 'GET' else None
+        if fields:
+            names = [f.strip() for f in fields.split(',') if f.strip()]
+            unknown = sorted(set(names) - set(HospitalSerializer.Meta.fields))
+            if unknown:
+                raise ValidationError({'fields': f'unknown fields: {", ".join(unknown)}'})
+            context['fields'] = names
+        context['score_weights'] = _score_weights()
+        return context
+
+    def _filter(self, qs):
+        params = self.request.query_params
+        region = params.get('region', '').strip()
+        if region:
+            codes = resolve_query(region)
+            # same rule as HospitalSnapshot.region_mask (the recommend candidates)
+            if codes is None:
+                qs = qs.filter(region__icontains=region)
+            else:
+                # equality on the indexed code column; rows whose region text did not
+                # resolve to that level keep the substring match
+                field, code = codes.lookup()
+                qs = qs.filter(Q(**{field: code}) | Q(**{field: ''}, region__icontains=region))
+
+        grade_level = params.get('grade_level', '').strip()
+        if grade_level:
+            try:
+                grades = [int(g) for g in grade_level.split(',') if g.strip()]
+            except ValueError:
+                raise ValidationError({'grade_level': 'must be an integer or a comma separated list'})
+            qs = qs.filter(grade_level__in=grades)
+
+        for name, column in LIST_RANGE_FILTERS.items():
+            low, high = _float_param(params, f'min_{name}'), _float_param(params, f'max_{name}')
+            if low is not None:
+                qs = qs.filter(**{f'{column}__gte': low})
+            if high is not None:
+                qs = qs.filter(**{f'{column}__lte': high})
+
+        q = params.get('q', '').strip()
+        if q:
+            field = params.get('field') or 'name'
+            if field not in LIST_SEARCH_FIELDS:
+                raise ValidationError({'field': f'unsupported search field: {field}'})
+            qs = qs.filter(**{f'{field}__icontains': q})
+        return qs
+
+    def _spatial_filter(self, qs):
+        try:
+            user_lat, user_lng, max_distance_km, nearest_n = spatial_params(self.request.query_params)
+        except ValueError as exc:
+            raise ValidationError({'detail': str(exc)})
+        if user_lat is None or (max_distance_km is None and nearest_n is None):
+            return qs
+        snapshot = get_snapshot()
+        index, ids = snapshot.spatial_index, snapshot.ids
+        if nearest_n is not None:
+            if nearest_n > MAX_NEAREST_N:
+                raise ValidationError({'nearest_n': f'must be <= {MAX_NEAREST_N}'})
+            rows, _ = index.nearest(user_lat, user_lng, nearest_n, max_distance_km=max_distance_km)
+            pks = ids[rows].tolist()
+            # nearest-first order is applied by list()
+            self._nearest_order = {pk: pos for pos, pk in enumerate(pks)}
+            return qs.filter(pk__in=pks)
+        rows, _ = index.within(user_lat, user_lng, max_distance_km)
+        return qs.filter(pk__in=ids[rows].tolist())
+
 class HospitalRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Hospital.objects.all()
     serializer_class = HospitalSerializer
     permission_classes = [AllowAny]  # adjust permissions per your needs
 
-class RecommendHospitalView(APIView):
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['score_weights'] = _score_weights()
+        return context
+
+
+class HospitalImportView(APIView):
+    """
+    POST /hospital/import/ (staff only), multipart:
+      - file: CSV / JSON Lines / Excel in the admin CSV export format
+      - format: csv | jsonl | xlsx (default: from the file name)
+      - dry_run: validate only
+    Upserts on ``name`` in batches (see hospital.importer) and returns
+    {rows, created, updated, failed, batches, errors: [{line, errors}], errors_truncated}.
+    """
+    permission_classes = [IsStaff]
+    parser_classes = (MultiPartParser, FormParser)
+
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'detail': 'file required'}, status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.data.get('format') or detect_format(upload.name)
+        dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+        try:
+            report = import_hospitals(read_rows(upload.file, fmt), dry_run=dry_run)
+        except ImportFormatError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report.as_dict(), status=status.HTTP_200_OK)
+
+
+def _paging_params(request, payload):
+    """
+    Read top_k / offset / cursor from the body or the query string.
+    Returns (paginated, top_k, offset, cursor); raises ValueError on bad input.
+    """
+    def param(name):
+        value = payload.get(name) if hasattr(payload, 'get') else None
+        if value in (None, ''):
+            value = request.query_params.get(name)
+        return None if value in (None, '') else value
+
+    top_k, offset, cursor = param('top_k'), param('offset'), param('cursor')
+    paginated = top_k is not None or offset is not None or cursor is not None
+    try:
+        top_k = int(top_k) if top_k is not None else default_top_k()
+        offset = int(offset) if offset is not None else 0
+    except (TypeError, ValueError):
+        raise ValueError('top_k and offset must be integers')
+    if top_k < 1 or offset < 0:
+        raise ValueError('top_k must be >= 1 and offset >= 0')
+    return paginated, min(top_k, max_top_k()), offset, cursor
+
+
+def _cache_context(canonical):
+    """(hospital-table version, scoring Weights) of a cacheable payload, in one thread hop."""
+    return get_snapshot_version(), select_weights(canonical)
+
+
+def _wants_stream(request):
+    """NDJSON streaming requested (``?stream=1`` or ``Accept: application/x-ndjson``)?"""
+    if request.query_params.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return isinstance(getattr(request, 'accepted_renderer', None), NDJSONRenderer)
+
+
+class RecommendHospitalView(AsyncAPIViewMixin, APIView):
     """
     POST /hospital/recommend/
     Accepts JSON payload describing user request:
       - disease_code, disease_name
       - urgency: 'emergency'|'urgent'|'routine'
       - region (string)
-      - user_lat, user_lng (floats) optional for distance
+      - user_lat, user_lng (floats) optional for distance; without them the
+        distance is taken from the region's centroid (see hospital.region_index)
       - economic_level (0/1/2)
       - age (int)
+      - max_distance_km / nearest_n: only rank hospitals within the radius /
+        the n nearest ones around user_lat/user_lng (spatial index lookup)
+    Optional paging (body or query string):
+      - top_k: page size; offset: rank of the first returned hospital
+      - cursor: ``next_cursor`` of a previous page; pages through the cached
+        ranking of that request without rescoring
     Returns list of hospitals ordered by recommendation score, with breakdown.
+    Without paging parameters every candidate is returned (legacy shape).
+    Responses for valid payloads are cached (see hospital.result_cache); the
+    ``X-Recommend-Cache`` header tells HIT from MISS.
+    Streaming (``?stream=1`` or ``Accept: application/x-ndjson``): the same
+    hospitals as NDJSON, one per line, serialized in batches of STREAM_BATCH
+    while the body is sent. The first line is ``{"meta": {count, offset, top_k,
+    next_cursor}}``, the last ``{"summary": {returned, elapsed_ms}}``; a body
+    without the summary line was cut short. Streamed misses are not written to
+    the result cache (that would hold the whole list again).
+    Async view (see backend.async_views): cache lookups are awaited, ranking
+    and serialization run in a thread.
+    Scoring weights come from the ScoringProfile matching urgency / region
+    (see hospital.weights); cache keys carry their fingerprint.
+    Result-cache misses on frequent payloads are served from the rankings of
+    ``manage.py precompute_recommendations`` while they are current (see
+    hospital.precompute); other payloads are scored live.
     """
     permission_classes = [AllowAny]
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
 
-    def post(self, request, *args, **kwargs):
-        payload = request.data or {}
-        # Fetch candidates (optionally filter by region or specialty)
-        qs = Hospital.objects.all()
-
-        # optional quick filter: region substring
-        region_q = payload.get('region')
-        if region_q:
-            qs = qs.filter(region__icontains=region_q)
-
-        # Collect and score
-        hospitals = list(qs)
-        scored = []
-        for h in hospitals:
-            score, breakdown = compute_recommendation_score(h, payload)
-            # serialize with context (include request to compute distance if needed)
-            serializer = HospitalSerializer(h, context={'request': request})
-            data = serializer.data
-            data['recommendation_score'] = round(score, 4)
-            data['score_breakdown'] = breakdown
-            scored.append((score, data))
-
-        # sort by score desc
-        scored.sort(key=lambda x: x[0], reverse=True)
-        results = [d for s, d in scored]
-
-        return Response({'results': results, 'count': len(results)}, status=status.HTTP_200_OK)
\ No newline at end of file
+    async def post(self, request, *args, **kwargs):
+        with span('parse'):
+            payload = request.data or {}
+        stream = _wants_stream(request)
+        try:
+            paginated, top_k, offset, cursor = _paging_params(request, payload)
+            token = None
+            if cursor is not None:
+                token, offset = decode_cursor(cursor)
+        except ValueError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            spatial_params(payload)
+            check_region(payload)
+        except ValueError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Result cache: score the canonical payload so the entry matches its key
+        cache_key = weights = precomputed = None
+        if token is None and cache_enabled():
+            with span('cache'):
+                canonical = canonical_payload(payload)
+                if canonical is not None:
+                    payload = canonical
+                    version, weights = await sync_to_async(_cache_context)(canonical)
+                # no table version (cache unreachable): results cannot be invalidated, do not cache them
+                if canonical is not None and version is not None:
+                    cache_key = make_key('hospital', canonical, version, weights=weights.fingerprint,
+                                         paginated=paginated, top_k=top_k, offset=offset)
+                    cached = await result_cache.aget(cache_key)
+            if cache_key is not None and cached is not None:
+                if stream:
+                    meta = {k: v for k, v in cached.items() if k != 'results'}
+                    response = ndjson_response(meta, [cached['results']], request)
+                else:
+                    response = Response(cached, status=status.HTTP_200_OK)
+                response['X-Recommend-Cache'] = 'HIT'
+                return response
+            if cache_key is not None:
+                with span('precomputed'):
+                    precomputed = await aprecomputed_ranking(canonical, version, weights)
+
+        # ranking and serialization are CPU work: run them off the event loop
+        if stream:
+            return await sync_to_async(self._stream)(request, payload, paginated, top_k, offset, token, weights,
+                                                     precomputed)
+        response = await sync_to_async(self._respond)(request, payload, paginated, top_k, offset, token, weights,
+                                                      precomputed)
+        if cache_key is not None and response.status_code == status.HTTP_200_OK:
+            with span('cache'):
+                await result_cache.aset(cache_key, response.data)
+            response['X-Recommend-Cache'] = 'MISS'
+        return response
+
+    def _respond(self, request, payload, paginated, top_k, offset, token, weights=None, precomputed=None):
+        ranked = self._rank(payload, paginated, top_k, offset, token, weights, precomputed)
+        if isinstance(ranked, Response):
+            return ranked
+        snapshot, ranking, positions, meta = ranked
+        with span('serialize'):
+            results = self._serialize(request, snapshot, ranking, positions)
+        return Response({'results': results, **meta}, status=status.HTTP_200_OK)
+
+    def _rank(self, payload, paginated, top_k, offset, token, weights=None, precomputed=None):
+        """
+        Rank the candidates of one request with ``weights`` (None: the payload's profile),
+        starting from the ``precomputed`` Ranking of the payload when there is one.
+        Returns (snapshot, ranking, positions to return, response metadata) or
+        an error Response.
+        """
+        # Candidates come from the per-worker snapshot (no full-table SELECT per request)
+        with span('snapshot'):
+            snapshot = get_snapshot()
+
+        if not paginated:
+            # the unpaged response lists every candidate: only a complete precomputed ranking will do
+            ranking = precomputed if precomputed is not None and precomputed.complete else None
+            if ranking is None:
+                with span('rank'):
+                    ranking = rank_candidates(snapshot, payload, weights=weights)
+            record('candidates', ranking.total)
+            return snapshot, ranking, range(len(ranking)), {'count': len(ranking)}
+
+        end = offset + top_k
+        if token is not None:
+            ranking = load_ranking(token)
+            if ranking is None:
+                return Response({'detail': 'cursor expired'}, status=status.HTTP_400_BAD_REQUEST)
+        elif precomputed is not None:
+            ranking = precomputed
+        else:
+            with span('rank'):
+                ranking = rank_candidates(snapshot, payload, depth=max(end, cursor_depth()), weights=weights)
+        if end > len(ranking) and not ranking.complete:
+            # paged past the stored depth: rank deeper once and hand out a new cursor
+            with span('rank'):
+                ranking = rank_candidates(snapshot, ranking.payload, depth=max(end, 2 * len(ranking)),
+                                          weights=ranking.weights)
+            token = None
+        record('candidates', ranking.total)
+
+        next_cursor = None
+        if end < ranking.total:
+            if token is None:
+                token = save_ranking(ranking)
+            next_cursor = encode_cursor(token, end)
+        return snapshot, ranking, range(offset, min(end, len(ranking))), {
+            'count': ranking.total,
+            'offset': offset,
+            'top_k': top_k,
+            'next_cursor': next_cursor,
+        }
+
+    def _stream(self, request, payload, paginated, top_k, offset, token, weights=None, precomputed=None):
+        """Rank now, serialize and send the hospitals batch by batch while the body streams."""
+        ranked = self._rank(payload, paginated, top_k, offset, token, weights, precomputed)
+        if isinstance(ranked, Response):
+            return ranked
+        snapshot, ranking, positions, meta = ranked
+
+        def batches():
+            for start in range(0, len(positions), STREAM_BATCH):
+                yield self._serialize(request, snapshot, ranking, positions[start:start + STREAM_BATCH])
+
+        return ndjson_response(meta, batches(), request)
+
+    def _serialize(self, request, snapshot, ranking, positions):
+        """Serialize the hospitals at the given ranking positions (only those rows)."""
+        kept, rows = [], []
+        for pos in positions:
+            row = snapshot.index_of(int(ranking.ids[pos]))
+            if row is None:
+                # deleted since the ranking was cached
+                continue
+            kept.append(pos)
+            rows.append(row)
+        # distance_km reuses the distances the scorer computed (NaN without user coordinates);
+        # region centroid distances only go into score_breakdown
+        distances = ranking.scores.distance_km[kept] if ranking.scores.distance_origin is None else None
+        results = HospitalRowSerializer().from_snapshot(snapshot, rows, distances)
+        for pos, data in zip(kept, results):
+            data['recommendation_score'] = round(ranking.scores.score(pos), 4)
+            data['score_breakdown'] = ranking.scores.breakdown(pos)
+        return results
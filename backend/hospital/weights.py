@@ -0,0 +1,173 @@
+"""
+Scoring weight profiles, compiled once per worker and reloaded without a restart.
+
+``ScoringProfile`` rows override some of ``DEFAULT_WEIGHTS`` for an urgency,
+a region code (province, city or district), both, or neither (the global
+default). Every worker keeps one ``ProfileTable``: the active profiles merged
+over ``DEFAULT_WEIGHTS`` into ``Weights`` (values + fingerprint), in a dict
+keyed by (urgency, region code).
+
+Freshness follows ``hospital.snapshot``: ``post_save``/``post_delete`` on
+``ScoringProfile`` bump a version counter in the shared cache once the
+transaction commits (see ``hospital.signals``). A worker compares its table
+with the counter at most every ``SCORING_PROFILES_RELOAD_SECONDS`` and
+recompiles when they differ, so ``select_weights`` on the request path is a
+clock read and a few dict lookups.
+
+Everything keyed on scores carries the fingerprint of the weights used: the
+snapshot's base scores (``HospitalSnapshot.base_scores``) and the recommend
+result cache keys. Changing one profile leaves the caches of the others warm.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import ScoringProfile
+from .regions import resolve_query
+from .utils import DEFAULT_WEIGHTS, weights_fingerprint
+
+WEIGHTS_VERSION_KEY = 'hospital:weights:version'
+# (urgency, region) selections remembered per table
+SELECT_MEMO_SIZE = 4096
+
+
+def reload_seconds():
+    return getattr(settings, 'SCORING_PROFILES_RELOAD_SECONDS', 5.0)
+
+
+def _new_version():
+    return time.time_ns()
+
+
+def get_weights_version():
+    """Current profile version from the shared cache (initialized on first use)."""
+    version = cache.get(WEIGHTS_VERSION_KEY)
+    if version is None:
+        cache.add(WEIGHTS_VERSION_KEY, _new_version(), timeout=None)
+        version = cache.get(WEIGHTS_VERSION_KEY)
+    return version
+
+
+def _bump():
+    try:
+        cache.incr(WEIGHTS_VERSION_KEY)
+    except ValueError:
+        cache.set(WEIGHTS_VERSION_KEY, _new_version(), timeout=None)
+
+
+def bump_weights_version():
+    """Make every worker reload the profiles once the current transaction commits."""
+    transaction.on_commit(_bump)
+
+
+class Weights:
+    """
+    Compiled weights of one profile.
+      - name: profile name (None for DEFAULT_WEIGHTS)
+      - values: every weight, the profile's overrides merged over DEFAULT_WEIGHTS
+      - fingerprint: ``weights_fingerprint(values)``
+    """
+
+    def __init__(self, name, values):
+        self.name = name
+        self.values = values
+        self.fingerprint = weights_fingerprint(values)
+
+    @property
+    def is_default(self):
+        """Same values as DEFAULT_WEIGHTS (the persisted base_score applies)?"""
+        return self.fingerprint == DEFAULT.fingerprint
+
+
+DEFAULT = Weights(None, dict(DEFAULT_WEIGHTS))
+
+
+def compile_profile(profile):
+    values = dict(DEFAULT_WEIGHTS)
+    values.update({k: float(v) for k, v in (profile.weights or {}).items() if k in DEFAULT_WEIGHTS})
+    return Weights(profile.name, values)
+
+
+class ProfileTable:
+    """Active profiles of one version, looked up by (urgency, region code)."""
+
+    def __init__(self, version, profiles):
+        self.version = version
+        self._rules = {}
+        # ordering keeps the choice stable if the table ever holds two active rows for a key
+        for profile in sorted(profiles, key=lambda p: p.name):
+            self._rules.setdefault((profile.urgency, profile.region_code), compile_profile(profile))
+        self.default = self._rules.get(('', ''), DEFAULT)
+        # no urgency / region profiles: every payload gets the default
+        self._only_default = set(self._rules) <= {('', '')}
+        self._memo = {}
+
+    @classmethod
+    def load(cls, version):
+        return cls(version, ScoringProfile.objects.filter(is_active=True))
+
+    def __len__(self):
+        return len(self._rules)
+
+    def select(self, payload):
+        """
+        Weights for ``payload``, most specific profile first: urgency and
+        region (district, city, then province), urgency alone, region alone,
+        then the global default profile, else DEFAULT_WEIGHTS.
+        """
+        if self._only_default:
+            return self.default
+        urgency, region = payload.get('urgency') or '', payload.get('region')
+        key = (urgency, tuple(region) if isinstance(region, list) else region)
+        try:
+            weights = self._memo.get(key)
+        except TypeError:  # unhashable region value
+            return self._select(urgency, region)
+        if weights is None:
+            if len(self._memo) >= SELECT_MEMO_SIZE:
+                self._memo.clear()
+            weights = self._memo[key] = self._select(urgency, region)
+        return weights
+
+    def _select(self, urgency, region):
+        urgency = urgency.strip().lower() if isinstance(urgency, str) else ''
+        codes = resolve_query(region)
+        levels = (codes.district, codes.city, codes.province) if codes is not None else ()
+        levels = [code for code in levels if code] + ['']
+        for key in (urgency, '') if urgency else ('',):
+            for code in levels:
+                weights = self._rules.get((key, code))
+                if weights is not None:
+                    return weights
+        return DEFAULT
+
+
+_table = None
+_checked_at = None
+_lock = threading.Lock()
+
+
+def get_profiles():
+    """This worker's ProfileTable, reloaded when the profile version moved."""
+    global _table, _checked_at
+    table, checked_at = _table, _checked_at
+    now = time.monotonic()
+    if table is not None and checked_at is not None and now - checked_at < reload_seconds():
+        return table
+    version = get_weights_version()
+    if table is None or table.version != version:
+        with _lock:
+            table = _table
+            if table is None or table.version != version:
+                table = ProfileTable.load(version)
+                _table = table
+    _checked_at = now
+    return table
+
+
+def select_weights(payload):
+    """Weights that score ``payload`` (see ``ProfileTable.select``)."""
+    return get_profiles().select(payload)
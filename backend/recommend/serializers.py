@@ -13,5 +13,16 @@ class PatientPayloadSerializer(serializers.Serializer):
     user_lng = serializers.FloatField(required=False)
     economic_level = serializers.IntegerField(required=False, min_value=0, max_value=2)
     age = serializers.IntegerField(required=False, min_value=0, max_value=150)
+    # optional spatial limits around user_lat/user_lng
+    max_distance_km = serializers.FloatField(required=False, min_value=0)
+    nearest_n = serializers.IntegerField(required=False, min_value=1)
+    # only rank hospitals whose specialty matches disease_name / disease_code
+    specialty_only = serializers.BooleanField(required=False)
     # extra free-form fields allowed
-    extra = serializers.DictField(required=False, child=serializers.JSONField(), allow_empty=True)
\ No newline at end of file
+    extra = serializers.DictField(required=False, child=serializers.JSONField(), allow_empty=True)
+
+    def validate_max_distance_km(self, value):
+        # a radius of 0 selects nothing; hospital.recommender.spatial_params rejects it too
+        if value <= 0:
+            raise serializers.ValidationError('must be positive')
+        return value
\ No newline at end of file
@@ -1,12 +1,25 @@
+import numpy as np
+from asgiref.sync import sync_to_async
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from .serializers import PatientPayloadSerializer
-from hospital.models import Hospital
-from hospital.serializers import HospitalSerializer
+from hospital.recommender import spatial_candidates, spatial_params
+from hospital.result_cache import cache_enabled, canonical_payload, make_key, result_cache
+from hospital.snapshot import get_snapshot, get_snapshot_version
+from hospital.row_serializer import HospitalRowSerializer, request_coords
+from hospital.weights import get_profiles
 from rest_framework.permissions import AllowAny
+from backend.async_views import AsyncAPIViewMixin
+from backend.instrumentation import record, span
 
-class RecommendView(APIView):
+
+def _cache_context():
+    """(hospital-table version, default-profile Weights), in one thread hop."""
+    return get_snapshot_version(), get_profiles().default
+
+
+class RecommendView(AsyncAPIViewMixin, APIView):
     """
     POST /api/recommend/
     Accepts patient payload (see PatientPayloadSerializer), returns recommended hospitals.
@@ -20,20 +33,69 @@ class RecommendView(APIView):
     """
     permission_classes = [AllowAny]
 
-    def post(self, request, *args, **kwargs):
-        serializer = PatientPayloadSerializer(data=request.data or {})
-        if not serializer.is_valid():
+    async def post(self, request, *args, **kwargs):
+        with span('parse'):
+            serializer = PatientPayloadSerializer(data=request.data or {})
+            valid = serializer.is_valid()
+        if not valid:
             return Response({'detail': 'invalid payload', 'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
         payload = serializer.validated_data
+        try:
+            spatial_params(payload)
+        except ValueError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Result cache keyed by the canonical payload; the echoed payload stays per request
+        scoring_payload = payload
+        coords = None
+        cache_key = weights = None
+        if cache_enabled():
+            with span('cache'):
+                scoring_payload = canonical_payload(request.data or {})
+                if scoring_payload.get('user_lat') is not None and scoring_payload.get('user_lng') is not None:
+                    coords = (scoring_payload['user_lat'], scoring_payload['user_lng'])
+                version, weights = await sync_to_async(_cache_context)()
+                # no table version (cache unreachable): results cannot be invalidated, do not cache them
+                if version is not None:
+                    # composite_score follows the default profile: key on its weights too
+                    cache_key = make_key('recommend', scoring_payload, version, weights=weights.fingerprint)
+                    cached = await result_cache.aget(cache_key)
+            if cache_key is not None and cached is not None:
+                return Response(dict(cached, payload=payload), status=status.HTTP_200_OK,
+                                headers={'X-Recommend-Cache': 'HIT'})
+
+        # snapshot access and serialization are CPU work: run them off the event loop
+        data = await sync_to_async(self._results)(request, scoring_payload, coords, weights)
+        response = Response(dict(data, payload=payload), status=status.HTTP_200_OK)
+        if cache_key is not None:
+            with span('cache'):
+                await result_cache.aset(cache_key, data)
+            response['X-Recommend-Cache'] = 'MISS'
+        return response
 
-        # Current simple behavior: return all hospitals
-        qs = Hospital.objects.all()
+    def _results(self, request, scoring_payload, coords, weights=None):
+        # Current simple behavior: return all hospitals (read from the per-worker snapshot)
+        with span('snapshot'):
+            snapshot = get_snapshot()
+        # optional max_distance_km / nearest_n limits around the user's coordinates
+        with span('candidates'):
+            rows = spatial_candidates(snapshot, scoring_payload)
+            if rows is None:
+                rows = np.arange(len(snapshot))
+        record('candidates', len(rows))
 
-        # serialize hospitals using hospital.serializers.HospitalSerializer
-        # pass request to context so HospitalSerializer can compute distance if it supports it
-        ser = HospitalSerializer(qs, many=True, context={'request': request})
-        hospitals_data = ser.data
+        # serialize straight from the snapshot columns (same output as HospitalSerializer);
+        # user coordinates are parsed once and distances computed for all rows together
+        with span('serialize'):
+            if weights is None:
+                weights = get_profiles().default
+            # composite_score with the default profile, as on /api/hospital/
+            serializer = HospitalRowSerializer(weights=None if weights.is_default else weights.values)
+            if coords is None:
+                coords = request_coords(request)
+            distances = serializer.snapshot_distances(snapshot, rows, coords)
+            hospitals_data = serializer.from_snapshot(snapshot, rows, distances)
 
         # (optionally) you can compute per-hospital recommendation_score here.
         # For now we don't score — but attach empty fields to keep response shape consistent.
@@ -44,4 +106,4 @@ class RecommendView(APIView):
             h['score_breakdown'] = {}
             results.append(h)
 
-        return Response({'results': results, 'count': len(results), 'payload': payload}, status=status.HTTP_200_OK)
\ No newline at end of file
+        return {'results': results, 'count': len(results)}
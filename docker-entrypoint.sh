@@ -19,14 +19,40 @@ cd /app/backend
 echo "📊 执行数据库迁移..."
 python manage.py migrate --noinput
 
+# 地区中心点最近医院索引（增量刷新，失败不影响启动）
+echo "🗺️ 刷新地区最近医院索引..."
+python manage.py build_region_index || echo "⚠️ 地区最近医院索引刷新失败，地区推荐暂不按距离评分"
+
 # 收集静态文件
 echo "📦 收集静态文件..."
 python manage.py collectstatic --noinput
 
-echo "🚀 启动Gunicorn..."
+# ⭐ 应用服务器模式：APP_SERVER=asgi 使用 uvicorn worker（异步视图在事件循环中运行），
+#    默认 wsgi 为同步 worker；uvicorn worker 不可用时自动回退到 WSGI
+APP_SERVER="${APP_SERVER:-wsgi}"
+GUNICORN_WORKERS="${GUNICORN_WORKERS:-3}"
+
+if [ "$APP_SERVER" = "asgi" ] && ! python -c "import uvicorn_worker" 2>/dev/null; then
+    echo "⚠️ 未安装 uvicorn-worker，回退到 WSGI 模式"
+    APP_SERVER="wsgi"
+fi
+
+if [ "$APP_SERVER" = "asgi" ]; then
+    echo "🚀 启动Gunicorn (ASGI, uvicorn worker)..."
+    exec gunicorn \
+        --bind 0.0.0.0:8000 \
+        --workers "$GUNICORN_WORKERS" \
+        --worker-class uvicorn_worker.UvicornWorker \
+        --timeout 120 \
+        --access-logfile - \
+        --error-logfile - \
+        backend.asgi:application
+fi
+
+echo "🚀 启动Gunicorn (WSGI)..."
 exec gunicorn \
     --bind 0.0.0.0:8000 \
-    --workers 3 \
+    --workers "$GUNICORN_WORKERS" \
     --timeout 120 \
     --access-logfile - \
     --error-logfile - \